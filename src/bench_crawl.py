@@ -0,0 +1,179 @@
+"""Throughput benchmark of the crawl scripts against the GitHub stand-in
+
+Each script runs in its own process against src/github_stub.py with synthetic repos,
+and is reported with its repos per second, API calls per repo and peak memory:
++ find_repos: on a synthetic oss-fuzz projects directory (no API calls),
+    then again with the projects cached
++ check_repo_stats: metadata queries and requirement checks
++ download_repos: for each number of workers, and with the REST resolver,
+    then a refresh of the last downloads
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import logging
+from collections import Counter
+from typing import Optional
+import fire
+from src.github_stub import StubConfig, StubServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_script(module: str, args: list[str], env: dict, log_path: str):
+    """run python -m module args
+
+    Returns: (seconds, peak memory in MB)
+    """
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", module, *args],
+            cwd=REPO_ROOT,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        # wait4 gives the resource usage of this child only
+        _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"{module} failed, see {log_path}")
+    return seconds, usage.ru_maxrss / 1024
+
+
+def make_inputs(workdir: str, n_repos: int, n_tokens: int) -> list[str]:
+    """write the repo lists, oss-fuzz projects and tokens, returns the repo ids"""
+    # a few repos do not exist, see github_stub
+    repo_ids = [
+        f"owner{i % 97}/{'missing' if i % 50 == 49 else 'repo'}{i}"
+        for i in range(n_repos)
+    ]
+    with open(os.path.join(workdir, "repos.txt"), "w") as fp:
+        fp.write("\n".join(repo_ids))
+    with open(os.path.join(workdir, "repos.jsonl"), "w") as fp:
+        fp.write("\n".join(json.dumps({"repo_id": r}) for r in repo_ids))
+    with open(os.path.join(workdir, "oauth"), "w") as fp:
+        fp.write("\n".join(f"token{i}" for i in range(n_tokens)))
+    projects = os.path.join(workdir, "oss-fuzz", "projects")
+    for i, repo_id in enumerate(repo_ids):
+        os.makedirs(os.path.join(projects, f"project{i}"), exist_ok=True)
+        with open(os.path.join(projects, f"project{i}", "project.yaml"), "w") as fp:
+            fp.write(f"language: python\nmain_repo: https://github.com/{repo_id}\n")
+    return repo_ids
+
+
+def main(
+    repos: int = 200,
+    workers: tuple[int, ...] | int = (1, 8),
+    tokens: int = 1,
+    latency: float = 0.02,
+    failure_rate: float = 0.0,
+    rate_limit: int = 5000,
+    archive_files: int = 10,
+    workdir: Optional[str] = None,
+    output: Optional[str] = None,
+):
+    """benchmark the crawl scripts on repos synthetic repos
+
+    Args:
+        workers: numbers of download workers to benchmark.
+        tokens (int): number of (fake) tokens in the oauth file.
+        latency, failure_rate, rate_limit, archive_files: see github_stub.StubConfig.
+        workdir (str): where inputs and outputs are written, a temporary directory by default.
+        output (str): jsonl to append the results to.
+    """
+    workers = (workers,) if isinstance(workers, int) else tuple(workers)
+    workdir = workdir or tempfile.mkdtemp(prefix="bench_crawl_")
+    os.makedirs(workdir, exist_ok=True)
+    make_inputs(workdir, repos, tokens)
+    config = StubConfig(latency, failure_rate, rate_limit, archive_files=archive_files)
+    server = StubServer(("127.0.0.1", 0), config)
+    server.start()
+    env = os.environ | {
+        "GITHUB_API": server.url,
+        "GITHUB_GRAPHQL_API": f"{server.url}/graphql",
+        "PYTHONPATH": REPO_ROOT,
+        "WORKDIR": workdir,
+    }
+
+    results = []
+
+    def bench(name: str, module: str, args: list[str]):
+        before = Counter(server.calls)
+        seconds, peak_mb = run_script(
+            module, args, env, os.path.join(workdir, f"{name}.log")
+        )
+        calls = Counter(server.calls)
+        calls.subtract(before)
+        downloads = calls.pop("tarball", 0)
+        result = {
+            "name": name,
+            "repos": repos,
+            "seconds": round(seconds, 3),
+            "repos_per_s": round(repos / seconds, 2),
+            "api_calls_per_repo": round(sum(calls.values()) / repos, 3),
+            "downloads_per_repo": round(downloads / repos, 3),
+            "peak_mb": round(peak_mb, 1),
+        }
+        logging.info(result)
+        results.append(result)
+
+    path = lambda *p: os.path.join(workdir, *p)
+    find_args = ["--output_file", path("found.jsonl")]
+    find_args += ["--cache", path(f"oss_fuzz_{time.time_ns()}.json")]
+    bench("find_repos", "src.find_repos", find_args)
+    # unchanged projects are found in the cache of the last run
+    bench("find_repos_refresh", "src.find_repos", find_args)
+    bench(
+        "check_repo_stats",
+        "src.check_repo_stats",
+        [
+            "--input_repo_list_path",
+            path("repos.jsonl"),
+            "--output_filter_result",
+            path("filtered.jsonl"),
+            "--token",
+            path("oauth"),
+            "--metadata_db",
+            path(f"metadata_{time.time_ns()}.db"),
+        ],
+    )
+
+    def download_args(name: str, resolver: str, n_workers: int) -> list[str]:
+        os.makedirs(path(name), exist_ok=True)
+        args = ["-i", path("repos.txt"), "--oroot", path(name)]
+        args += ["--oauth", path("oauth"), "--workers", str(n_workers)]
+        return args + ["--extract", "py", "--resolver", resolver]
+
+    runs = [("graphql", n_workers) for n_workers in workers]
+    runs.append(("rest", workers[-1]))
+    for resolver, n_workers in runs:
+        name = f"download_repos_{resolver}_{n_workers}"
+        bench(name, "src.download_repos", download_args(name, resolver, n_workers))
+    # unchanged repos are skipped thanks to the manifest of the last download
+    for resolver in ("graphql", "rest"):
+        name = f"download_repos_{resolver}_{workers[-1]}"
+        args = download_args(name, resolver, workers[-1])
+        bench(f"{name}_refresh", "src.download_repos", args)
+    server.shutdown()
+
+    print(f"{'name':<36}{'repos/s':>10}{'calls/repo':>12}{'dl/repo':>9}{'MB':>8}")
+    for r in results:
+        print(
+            f"{r['name']:<36}{r['repos_per_s']:>10}{r['api_calls_per_repo']:>12}"
+            + f"{r['downloads_per_repo']:>9}{r['peak_mb']:>8}"
+        )
+    if output:
+        with open(output, "a") as fp:
+            for r in results:
+                fp.write(json.dumps(r | {"config": config.__dict__}) + "\n")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    fire.Fire(main)
@@ -0,0 +1,352 @@
+"""Benchmark of the analysis hot paths of src/navigate.py and src/static.py
+
+Each function is timed on each case and reported with its nodes per second,
+files per second and peak memory (traced by tracemalloc in a separate run):
++ parse: ast.parse of the source
++ flatten, node_types (type codes of the flattened nodes)
++ find_all: all functions, by the module-level filter over the nodes,
+    find_all_types: by ModuleNavigator.find_all on the type codes,
+    find_all_root: the same under each class (root=)
++ get_path_to (to all functions), collect_funcs
++ analyze_source: the whole analysis of a file by static.py
+
+Cases are synthetic modules of controlled size, nesting depth and number of
+test methods (SYNTHETIC, see make_module), and the python files of a sample
+of repos of data/meta pinned to a revision (REAL_REPOS), read from the directories
+or archives <repo>@<revision> under root. Repos that are not there are skipped,
+--fetch downloads their archives.
+
+Results are compared to a stored baseline, a function slower or using more memory
+than its baseline by more than threshold is a regression and fails the run:
+
+    python3 -m src.bench_static --save  # store the baseline
+    python3 -m src.bench_static  # compare to it
+"""
+
+import os
+import ast
+import sys
+import json
+import timeit
+import logging
+import tarfile
+import platform
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Optional
+import fire
+from src.common import wrap_repo
+from returns.pipeline import is_successful
+from src.download_repos import download_archive
+from src.navigate import ModuleNavigator, decode_source, find_all, flatten, node_types
+from src.static import analyze_source, collect_funcs, collect_py_files
+
+
+@dataclass(frozen=True)
+class ModuleSpec:
+    """shape of a synthetic module, see make_module"""
+
+    # test classes, each with tests test methods
+    classes: int = 10
+    tests: int = 10
+    # functions outside classes
+    helpers: int = 10
+    # nesting of the blocks in each function, with statements per block
+    depth: int = 2
+    statements: int = 4
+
+
+SYNTHETIC = {
+    "small": ModuleSpec(classes=2, tests=5, helpers=2, depth=1, statements=3),
+    "large": ModuleSpec(classes=40, tests=20, helpers=200, depth=2, statements=5),
+    "deep": ModuleSpec(classes=2, tests=2, helpers=4, depth=60, statements=2),
+    "tests": ModuleSpec(classes=200, tests=40, helpers=0, depth=0, statements=2),
+}
+
+# a sample of data/meta/oss_fuzz_python_filtered.jsonl, small to large,
+# repo -> release tag, results are stored by repo@revision
+REAL_REPOS = {
+    "tkem/cachetools": "v5.3.3",
+    "tqdm/tqdm": "v4.66.4",
+    "more-itertools/more-itertools": "v10.2.0",
+    "pallets/click": "8.1.7",
+    "pyparsing/pyparsing": "3.1.2",
+    "pygments/pygments": "2.18.0",
+}
+
+
+def make_block(depth: int, statements: int, indent: int) -> list[str]:
+    """statements nested depth times in for and if blocks"""
+    pad = "    " * indent
+    lines = [f"{pad}x{i} = (y + {i}) * [z, {i}][0]" for i in range(statements)]
+    if depth > 0:
+        header = "for y in range(3):" if depth % 2 else "if y > z:"
+        lines.append(pad + header)
+        lines += make_block(depth - 1, statements, indent + 1)
+    return lines
+
+
+def make_module(spec: ModuleSpec) -> str:
+    """source of a module shaped by spec, every fifth test is property-based"""
+    lines = ["import unittest", "from hypothesis import given, strategies as st", ""]
+    for h in range(spec.helpers):
+        lines += [f"def helper{h}(y, z):"]
+        lines += make_block(spec.depth, spec.statements, 1)
+        lines += ["    return y", ""]
+    for c in range(spec.classes):
+        lines += [f"class TestCase{c}(unittest.TestCase):"]
+        for t in range(spec.tests):
+            if t % 5 == 4:
+                lines += ["    @given(st.integers())", f"    def test{t}(self, y):"]
+            else:
+                lines += [f"    def test{t}(self, y=1):"]
+            lines += ["        z = 0"]
+            lines += make_block(spec.depth, spec.statements, 2)
+            lines += ["        self.assertEqual(y, y)", ""]
+        lines += ["    pass", ""]
+    return "\n".join(lines) + "\n"
+
+
+def pinned_name(repo_id: str, revision: Optional[str] = None) -> str:
+    """<repo>@<revision>, the name of a repo at revision under root"""
+    name: str = wrap_repo(repo_id)
+    return name + (f"@{revision}" if revision else "")
+
+
+def read_repo(
+    root: str, repo_id: str, revision: Optional[str] = None
+) -> Optional[list[str]]:
+    """sources of the python files of a downloaded repo, None if it is not"""
+    repo_path = os.path.join(root, pinned_name(repo_id, revision))
+    if os.path.isdir(repo_path):
+        sources = []
+        for path in sorted(collect_py_files(repo_path)):
+            with open(path, "rb") as fp:
+                sources.append(decode_source(fp.read()))
+        return sources
+    if os.path.exists(repo_path + ".tar.gz"):
+        with tarfile.open(repo_path + ".tar.gz", "r|gz") as tp:
+            return [
+                decode_source(tp.extractfile(m).read())  # type: ignore[union-attr]
+                for m in tp
+                if m.isfile() and m.name.endswith(".py")
+            ]
+    return None
+
+
+def fetch_repos(root: str, timeout: int = 60):
+    """download the archives of REAL_REPOS at their revision that are not in root"""
+    os.makedirs(root, exist_ok=True)
+    for repo_id, revision in REAL_REPOS.items():
+        path = os.path.join(root, pinned_name(repo_id, revision))
+        if os.path.isdir(path) or os.path.exists(path + ".tar.gz"):
+            continue
+        url = f"https://github.com/{repo_id}/archive/{revision}.tar.gz"
+        if not is_successful(download_archive(path + ".tar.gz", url, timeout)):
+            logging.warning(f"Failed to download {url}")
+
+
+class Case:
+    """files of a case, parsed once beforehand for the functions after parse"""
+
+    def __init__(self, name: str, sources: list[str]):
+        self.name = name
+        # only the files that parse, like in the analysis
+        self.sources = [s for s in sources if ModuleNavigator.build("", s)]
+        self.trees = [ast.parse(s) for s in self.sources]
+        self.navs = [ModuleNavigator("", s) for s in self.sources]
+        self.funcs = [nav.find_all(ast.FunctionDef) for nav in self.navs]
+        self.classes = [nav.find_all(ast.ClassDef) for nav in self.navs]
+        self.n_nodes = sum(len(nav.nodes) for nav in self.navs)
+
+
+def run_parse(case: Case):
+    for source in case.sources:
+        ast.parse(source)
+
+
+def run_flatten(case: Case):
+    for tree in case.trees:
+        flatten(tree)
+
+
+def run_node_types(case: Case):
+    for nav in case.navs:
+        node_types(nav.nodes)
+
+
+def run_find_all(case: Case):
+    for nav in case.navs:
+        find_all(nav.ast, ast.FunctionDef, nav.nodes)
+
+
+def run_find_all_types(case: Case):
+    # the type codes of each module are computed once, when the Case is made
+    for nav in case.navs:
+        nav.find_all(ast.FunctionDef)
+
+
+def run_find_all_root(case: Case):
+    for nav, classes in zip(case.navs, case.classes):
+        for cls in classes:
+            nav.find_all(ast.FunctionDef, root=cls)
+
+
+def run_get_path_to(case: Case):
+    for nav, funcs in zip(case.navs, case.funcs):
+        for func in funcs:
+            nav.get_path_to(func)
+
+
+def run_collect_funcs(case: Case):
+    for nav in case.navs:
+        collect_funcs(nav)
+
+
+def run_analyze_source(case: Case):
+    for source in case.sources:
+        analyze_source("", source)
+
+
+# function name -> a run of it on all files of a case
+FUNCTIONS: dict[str, Callable[[Case], None]] = {
+    "parse": run_parse,
+    "flatten": run_flatten,
+    "node_types": run_node_types,
+    "find_all": run_find_all,
+    "find_all_types": run_find_all_types,
+    "find_all_root": run_find_all_root,
+    "get_path_to": run_get_path_to,
+    "collect_funcs": run_collect_funcs,
+    "analyze_source": run_analyze_source,
+}
+
+
+def bench(case: Case, func: Callable[[Case], None], repeat: int = 3) -> dict:
+    """best throughput of repeat runs of at least 0.2s, and peak memory of one"""
+    timer = timeit.Timer(lambda: func(case))
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat, number)) / number
+    tracemalloc.start()
+    func(case)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "files": len(case.sources),
+        "nodes": case.n_nodes,
+        "files_per_s": round(len(case.sources) / seconds, 2),
+        "nodes_per_s": round(case.n_nodes / seconds),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def compare(
+    results: dict, baseline: dict, threshold: float, min_kb: float = 64
+) -> list[str]:
+    """regressions of results from baseline (case/function -> bench results),
+    memory growths under min_kb are ignored
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        slowdown = 1 - result["nodes_per_s"] / base["nodes_per_s"]
+        if slowdown > threshold:
+            regressions.append(f"{key}: {slowdown:.0%} slower")
+        growth = result["peak_kb"] / max(base["peak_kb"], 1) - 1
+        if growth > threshold and result["peak_kb"] - base["peak_kb"] > min_kb:
+            regressions.append(f"{key}: {growth:.0%} more memory")
+    return regressions
+
+
+def environment() -> dict:
+    return {"python": platform.python_version(), "machine": platform.machine()}
+
+
+def main(
+    root: str = "data/repos/",
+    baseline: str = "data/bench/static_baseline.json",
+    threshold: float = 0.25,
+    save: bool = False,
+    cases: Optional[tuple[str, ...] | str] = None,
+    functions: Optional[tuple[str, ...] | str] = None,
+    repeat: int = 3,
+    fetch: bool = False,
+):
+    """benchmark the analysis functions, and compare them to baseline
+
+    Args:
+        root (str): where the repos of REAL_REPOS are downloaded, as <repo>@<revision>.
+        baseline (str): json of stored results to compare to.
+        threshold (float): slowdown (or memory growth) from the baseline of a function
+            considered a regression, 0.25 is 25% slower.
+        save (bool): store the results as the baseline instead of comparing.
+        cases, functions: only run these, all by default.
+        repeat (int): timed runs of each function, the best one is kept.
+        fetch (bool): download the archives of REAL_REPOS missing from root first.
+    """
+    if fetch:
+        fetch_repos(root)
+    all_cases = [*SYNTHETIC, *REAL_REPOS]
+    selected = [cases] if isinstance(cases, str) else cases or all_cases
+    names = [functions] if isinstance(functions, str) else functions or FUNCTIONS
+
+    results: dict[str, dict] = {}
+    for case_name in selected:
+        if case_name in SYNTHETIC:
+            label = case_name
+            sources: Optional[list[str]] = [make_module(SYNTHETIC[case_name])]
+        else:
+            label = f"{case_name}@{REAL_REPOS[case_name]}"
+            sources = read_repo(root, case_name, REAL_REPOS[case_name])
+        if not sources:
+            logging.warning(f"Skipped {label}, not found in {root}")
+            continue
+        case = Case(label, sources)
+        for name in names:
+            results[f"{label}/{name}"] = bench(case, FUNCTIONS[name], repeat)
+            logging.info(f"{label}/{name}: {results[f'{label}/{name}']}")
+
+    stored: dict = {}
+    if os.path.exists(baseline):
+        with open(baseline, "r") as fp:
+            stored = json.load(fp)
+
+    print(
+        f"{'case/function':<56}{'files/s':>12}{'nodes/s':>14}{'peak KB':>12}{'vs':>8}"
+    )
+    for key, r in results.items():
+        base = stored.get("results", {}).get(key)
+        change = f"{r['nodes_per_s'] / base['nodes_per_s']:.2f}x" if base else ""
+        print(
+            f"{key:<56}{r['files_per_s']:>12}{r['nodes_per_s']:>14}"
+            + f"{r['peak_kb']:>12}{change:>8}"
+        )
+
+    if save:
+        # results of the cases not run are kept
+        stored = {
+            "environment": environment(),
+            "results": stored.get("results", {}) | results,
+        }
+        os.makedirs(os.path.dirname(baseline) or ".", exist_ok=True)
+        with open(baseline, "w") as fp:
+            json.dump(stored, fp, indent=2)
+        logging.info(f"Saved the baseline to {baseline}")
+        return
+    if not stored:
+        logging.warning(f"No baseline in {baseline}, run with --save to store one")
+        return
+    if stored["environment"] != environment():
+        logging.warning(f"Baseline from another environment: {stored['environment']}")
+    regressions = compare(results, stored["results"], threshold)
+    for regression in regressions:
+        logging.error(f"Regression {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    fire.Fire(main)
@@ -0,0 +1,122 @@
+"""on-disk cache of per-file analysis results"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Optional
+from functools import lru_cache
+
+
+def content_hash(source: str) -> str:
+    return hashlib.blake2b(source.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class AnalysisCache:
+    """cache analysis results keyed by (content hash, analyzer version)
+
+    Each entry also records the last path it was seen at,
+    so entries whose source is gone can be evicted by prune.
+    Writes and access times are buffered until flush,
+    several processes can share the same database file.
+    """
+
+    def __init__(self, path: str, version: str, flush_every: int = 256):
+        self.path = path
+        self.version = version
+        self.flush_every = flush_every
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS results (
+                digest TEXT NOT NULL,
+                version TEXT NOT NULL,
+                path TEXT NOT NULL,
+                result TEXT NOT NULL,
+                used_at REAL NOT NULL,
+                PRIMARY KEY (digest, version)
+            )""")
+        self.conn.commit()
+        self._puts: list[tuple[str, str, str, str, float]] = []
+        self._hits: list[tuple[float, str, str]] = []
+
+    def get(self, digest: str) -> Optional[dict]:
+        row = self.conn.execute(
+            "SELECT result FROM results WHERE digest = ? AND version = ?",
+            (digest, self.version),
+        ).fetchone()
+        if row is None:
+            return None
+        self._hits.append((time.time(), digest, self.version))
+        self._maybe_flush()
+        result: dict = json.loads(row[0])
+        return result
+
+    def put(self, digest: str, path: str, result: dict):
+        self._puts.append((digest, self.version, path, json.dumps(result), time.time()))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._puts) + len(self._hits) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._puts and not self._hits:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", self._puts
+            )
+            self.conn.executemany(
+                "UPDATE results SET used_at = ? WHERE digest = ? AND version = ?",
+                self._hits,
+            )
+        self._puts.clear()
+        self._hits.clear()
+
+    def prune(self, max_entries: int = -1) -> int:
+        """evict entries of other versions and entries whose source is gone,
+        then the least recently used ones beyond max_entries
+
+        Returns: number of evicted entries
+        """
+        self.flush()
+        rows = self.conn.execute("SELECT rowid, path FROM results").fetchall()
+        gone = [(rowid,) for rowid, path in rows if not os.path.exists(path)]
+        with self.conn:
+            self.conn.executemany("DELETE FROM results WHERE rowid = ?", gone)
+            n_evicted = len(gone)
+            n_evicted += self.conn.execute(
+                "DELETE FROM results WHERE version != ?", (self.version,)
+            ).rowcount
+            if max_entries >= 0:
+                n_evicted += self.conn.execute(
+                    """DELETE FROM results WHERE rowid NOT IN (
+                        SELECT rowid FROM results ORDER BY used_at DESC LIMIT ?
+                    )""",
+                    (max_entries,),
+                ).rowcount
+        return n_evicted
+
+    def __len__(self) -> int:
+        count: int = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return count
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def open_cache(path: str, version: str) -> AnalysisCache:
+    """one cache connection per process, never shared with forked workers"""
+    return _open_cache(path, version, os.getpid())
+
+
+@lru_cache(maxsize=None)
+def _open_cache(
+    path: str, version: str, pid: int  # pylint: disable=unused-argument
+) -> AnalysisCache:
+    return AnalysisCache(path, version)
@@ -15,13 +15,20 @@ https://docs.github.com/en/graphql/reference/objects#repository
 """
 
 from datetime import datetime
-import os
 from typing import Callable, Optional
 import fire
 import json
 import logging
+from funcy import chunks
 from funcy_chain import Chain
-from src.common import get_graphql_data, RepoMetadata, get_access_token
+from src.common import (
+    get_graphql_data,
+    graphql_client,
+    RepoMetadata,
+    TokenPool,
+)
+from src.metadata import MetadataStore
+from src.tracing import span
 
 
 #### Requirement Callables ####
@@ -53,13 +60,111 @@ def req_language(metadata: RepoMetadata, language: str = "python") -> bool:
 
 #### End Requirement Callables ####
 
+# fields of RepoMetadata
+REPO_FIELDS = """
+fragment RepoFields on Repository {
+    id
+    owner {
+        login
+    }
+    name
+    url
+    isArchived
+    isFork
+    isMirror
+    primaryLanguage {
+        name
+    }
+    pushedAt
+    stargazerCount
+    object(expression: "HEAD:") {
+        ... on Tree {
+            entries {
+                name
+                type
+            }
+        }
+    }
+}
+"""
+
+
+def batch_query(
+    repos: list[str], fields: str = "...RepoFields", fragments: str = REPO_FIELDS
+) -> str:
+    """one query for the fields of all repos, repos[i] is aliased as r<i>"""
+    aliases = "\n".join(
+        f'r{i}: repository(owner: "{owner}", name: "{name}") {{ {fields} }}'
+        for i, (owner, name) in enumerate(repo.split("/", 1) for repo in repos)
+    )
+    rate = "rateLimit { cost limit remaining resetAt }"
+    return f"query {{\n{rate}\n{aliases}\n}}\n{fragments}"
+
+
+def fetch_batched(
+    repos: list[str],
+    access_token: str | TokenPool,
+    fields: str = "...RepoFields",
+    fragments: str = REPO_FIELDS,
+    batch_size: int = 50,
+    retries: int = 2,
+) -> dict[str, Optional[dict]]:
+    """fields of repos fetched batch_size repos per query (see batch_query),
+    the repos failed for other reasons than not existing are retried in new batches
+
+    Returns: repo -> its fields, None if it failed
+    """
+    results: dict[str, Optional[dict]] = {repo: None for repo in repos}
+    pending = list(results)
+    for _ in range(retries + 1):
+        failed: list[str] = []
+        for batch in chunks(batch_size, pending):
+            query = batch_query(batch, fields, fragments)
+            response = get_graphql_data(query, access_token) or {}
+            data = response.get("data") or {}
+            not_found = {
+                error["path"][0]
+                for error in response.get("errors", [])
+                if error.get("type") == "NOT_FOUND" and error.get("path")
+            }
+            for i, repo in enumerate(batch):
+                if data.get(f"r{i}") is not None:
+                    results[repo] = data[f"r{i}"]
+                elif f"r{i}" in not_found:
+                    logging.warning(f"Repo {repo} is not found")
+                else:
+                    failed.append(repo)
+        if not failed:
+            break
+        logging.warning(f"Fetching {len(failed)} repos failed, retrying")
+        pending = failed
+    return results
+
+
+def fetch_metadata(
+    repos: list[str],
+    access_token: str | TokenPool,
+    batch_size: int = 50,
+    retries: int = 2,
+) -> dict[str, Optional[RepoMetadata]]:
+    """metadata of repos fetched in batches, None if it failed"""
+    with span("fetch_metadata", repos=len(repos)):
+        fetched = fetch_batched(
+            repos, access_token, batch_size=batch_size, retries=retries
+        )
+    return {
+        repo: RepoMetadata.from_dict(data) if data is not None else None
+        for repo, data in fetched.items()
+    }
+
 
 def check_requirements(
     repo: str,
     requirements: list[Callable[[RepoMetadata, str], bool]],
     reqs: list[str],
-    access_token: str,
+    access_token: str | TokenPool,
     repo_data: Optional[RepoMetadata] = None,
+    store: Optional[MetadataStore] = None,
 ) -> bool:
     """Checks if Github repository meets requirements
 
@@ -69,6 +174,8 @@ def check_requirements(
             if repo meets requirement
         reqs (list[str]): List of values to check against for each callable
             - each req will be called with the callable of the same index in requirements
+        store (MetadataStore, optional): where the metadata of passing repos are saved,
+            and looked up before querying
 
     Returns:
         bool: True if repo meets requirements, False otherwise
@@ -81,35 +188,15 @@ def check_requirements(
     query {
         rateLimit {
             cost
+            limit
             remaining
             resetAt
         }
         repository(name:"%s", owner:"%s"){
-            id
-            owner {
-                login
-            }
-            name
-            url
-            isArchived
-            isFork
-            isMirror
-            primaryLanguage {
-                name
-            }
-            pushedAt
-            stargazerCount
-            object(expression: "HEAD:") {
-                ... on Tree {
-                    entries {
-                        name
-                        type
-                    }
-                }
-            }
+            ...RepoFields
         }
     }
-    """
+    """ + REPO_FIELDS
     # Example of format of metadata:
     # {
     #   'data': {
@@ -121,6 +208,8 @@ def check_requirements(
     #       }
     #   }
     # }
+    if repo_data is None and store is not None:
+        repo_data = store.get(repo)
     if repo_data is None:  # Query if metadata is not provided
         metadata = get_graphql_data(
             gql_format % (repo_query[1], repo_query[0]), access_token
@@ -157,21 +246,9 @@ def check_requirements(
             )
             return False
 
-    # Save metadata to file to avoid repeat queries for repos that pass checks
-    # print("Saving metadata")
-    for key, value in repo_data.__dict__.items():
-        meta_key_path = f"data/meta/{key}.json"
-        if not os.path.exists(meta_key_path):
-            os.system(f"touch {meta_key_path}")
-
-        with open(f"data/meta/{key}.json", "r") as fp:
-            try:
-                dic = json.load(fp)
-            except ValueError:
-                dic = {}
-        dic[repo] = value
-        with open(meta_key_path, "w") as fp:
-            json.dump(dic, fp)
+    # Save metadata to avoid repeat queries for repos that pass checks
+    if store is not None:
+        store.put(repo, repo_data)
 
     return True
 
@@ -190,6 +267,8 @@ def main(
     input_repo_list_path: str = "data/meta/oss_fuzz_python.jsonl",
     output_filter_result: str = "data/meta/oss_fuzz_python_filtered.jsonl",
     token: str = "oauth",
+    batch_size: int = 50,
+    metadata_db: str = "data/meta/metadata.db",
 ):
     """Pass checks_list and reqs with this : --checks_list='<list>' --reqs='<list>'
         Ex. --reqs='["0", "2020-1-1"]'template
@@ -201,6 +280,9 @@ def main(
         checks_list (list[str], optional): _description_. Defaults to ["stars", "latest commit"].
         reqs (list[str], optional): _description_.
             Defaults to ["10", "2020-1-1"]. Year format should be <year>-<month>-<day>
+        batch_size (int, optional): number of repos queried at once. Defaults to 50.
+        metadata_db (str, optional): store of the metadata of passing repos,
+            they are not queried again. Defaults to "data/meta/metadata.db".
     """
 
     # explicit None check to avoid dangerous-default-value caused by lists
@@ -215,16 +297,30 @@ def main(
     with open(input_repo_list_path, "r") as fp:
         repo_id_list: list[str] = [line.strip() for line in fp.readlines()]
 
-    access_token = get_access_token(token)
+    # queries are spread over the tokens in the file, one per line
+    access_token = TokenPool.load(token)
 
     checks = [CHECK_MAP[check] for check in checks_list]
-    test_eval_repos = (
-        Chain(repo_id_list)
-        .map(json.loads)
-        .filter(lambda r: check_requirements(r["repo_id"], checks, reqs, access_token))
-        .map(json.dumps)
-        .value
-    )
+    repos = [json.loads(line) for line in repo_id_list]
+    store = MetadataStore(metadata_db)
+    repo_ids = [r["repo_id"] for r in repos]
+    metadata: dict[str, Optional[RepoMetadata]] = dict(store.get_many(repo_ids))
+    logging.info(f"Found metadata of {len(metadata)} repos in {metadata_db}")
+    missing = [repo_id for repo_id in repo_ids if repo_id not in metadata]
+    metadata.update(fetch_metadata(missing, access_token, batch_size))
+
+    def is_valid(repo: dict) -> bool:
+        repo_data = metadata[repo["repo_id"]]
+        if repo_data is None:
+            logging.error(f"Fetching repo metadata error: {repo['repo_id']}")
+            return False
+        return check_requirements(
+            repo["repo_id"], checks, reqs, access_token, repo_data, store
+        )
+
+    test_eval_repos = Chain(repos).filter(is_valid).map(json.dumps).value
+    store.close()
+    logging.info(f"GraphQL latency (s): {graphql_client(access_token).stats()}")
     with open(output_filter_result, "w") as fp:
         fp.write("\n".join(test_eval_repos))
 
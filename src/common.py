@@ -1,15 +1,34 @@
 """common functions for scripts"""
 
+import os
+import math
+import random
 import requests
+import requests.adapters
 import time
 import logging
 import json
 import signal
+import threading
+import contextvars
+import multiprocessing
+import multiprocessing.connection
 import datetime
 import contextlib
+from resource import (
+    RLIMIT_AS,
+    RLIMIT_CORE,
+    RLIMIT_CPU,
+    RUSAGE_SELF,
+    getrlimit,
+    getrusage,
+    setrlimit,
+)
 from typing import Optional, Callable
+from functools import lru_cache
 from dataclasses import dataclass
 from dacite import from_dict
+from src.tracing import span
 
 # Functions from github ranking repo:
 # https://github.com/EvanLi/Github-Ranking/blob/master/source/
@@ -42,72 +61,274 @@ def get_access_token(oauth_path: str):
     return access_token
 
 
-def get_graphql_data(gql: str, access_token: str) -> Optional[dict]:
-    """use graphql to get data
+class RateLimiter:
+    """budget of a GitHub rate limit resource shared by threads,
+    updated from the X-RateLimit-* headers and GraphQL rateLimit of responses
 
+    acquire never waits while the budget lasts,
+    once it runs out it sleeps until the reset time of the limit.
+    """
 
-    Args:
-        gql (str): graph ql query
-        access_token: access token to GitHub
+    def __init__(self, resource: str, reserve: int = 0):
+        self.resource = resource
+        self.reserve = reserve
+        self.lock = threading.Lock()
+        # unknown until the first response
+        self.remaining: Optional[int] = None
+        self.limit: Optional[int] = None
+        self.reset_at = 0.0
+
+    def acquire(self, cost: int = 1):
+        """take cost from the budget, sleep until the reset if there is not enough"""
+        with self.lock:
+            if (
+                self.remaining is not None
+                and self.remaining - cost < self.reserve
+                and time.time() < self.reset_at
+            ):
+                wait = self.reset_at - time.time() + 1
+                logging.warning(
+                    f"GitHub {self.resource} rate limit exhausted, "
+                    + f"sleeping {wait:.0f}s until reset"
+                )
+                # other threads wait on the lock meanwhile
+                time.sleep(wait)
+                self.remaining = None
+            if self.remaining is not None:
+                self.remaining -= cost
+
+    def update(self, remaining: int, limit: int, reset_at: float):
+        """record the state reported by a response, reset_at is a unix timestamp"""
+        with self.lock:
+            if reset_at == self.reset_at and self.remaining is not None:
+                # responses of the same window may come out of order
+                remaining = min(remaining, self.remaining)
+            elif reset_at < self.reset_at:
+                return
+            self.remaining, self.limit, self.reset_at = remaining, limit, reset_at
+
+    def update_from_graphql(self, rate: dict):
+        """record the rateLimit { remaining resetAt } of a GraphQL response"""
+        reset_at = datetime.datetime.fromisoformat(
+            rate["resetAt"].replace("Z", "+00:00")
+        )
+        self.update(rate["remaining"], rate.get("limit", -1), reset_at.timestamp())
+
+    def budget(self) -> tuple[float, float]:
+        """budget left, then how soon it resets (to compare limiters)"""
+        if self.remaining is None or time.time() >= self.reset_at:
+            return math.inf, 0.0
+        return self.remaining - self.reserve, -self.reset_at
+
+    def __str__(self):
+        return f"{self.remaining}/{self.limit}"
+
+
+# GitHub rate limit resources, see
+# https://docs.github.com/en/rest/rate-limit/rate-limit
+RESOURCES = ("core", "graphql", "search")
+
+
+def update_rate_limit(headers, limits: dict[str, RateLimiter]) -> None:
+    """update limits (resource -> its limiter) from the X-RateLimit-* headers
+    of a response if any
+    """
+    if "X-RateLimit-Remaining" not in headers:
+        return
+    resource = headers.get("X-RateLimit-Resource", "core")
+    if resource not in limits:
+        limits[resource] = RateLimiter(resource)
+    limits[resource].update(
+        int(headers["X-RateLimit-Remaining"]),
+        int(headers.get("X-RateLimit-Limit", -1)),
+        float(headers.get("X-RateLimit-Reset", 0)),
+    )
+
+
+def get_access_tokens(oauth_path: str) -> list[str]:
+    """tokens in oauth_path, one per line"""
+    with open(oauth_path, "r") as f:
+        return [line.strip() for line in f if line.strip() and line[0] != "#"]
 
-    Returns:
-        (dict): response from GitHub
+
+class TokenPool:
+    """GitHub tokens and their rate limits, shared by threads
+
+    acquire gives the token with the most budget left,
+    so that n tokens make about n times the requests of one.
+    The empty token stands for anonymous requests.
     """
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.113 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
-        "Accept-Language": "zh-CN,zh;q=0.9",
-        "Authorization": f"bearer {access_token}",
-    }
-    # s = requests.session()
-    # s.keep_alive = False  # don't keep the session
-    graphql_api = "https://api.github.com/graphql"
-    for _ in range(5):
-        time.sleep(2)  # not get so fast
+
+    def __init__(self, tokens: list[str]):
+        if not tokens:
+            raise ValueError("TokenPool needs at least one token")
+        self.tokens = list(dict.fromkeys(tokens))
+        self.limits = {
+            token: {resource: RateLimiter(resource) for resource in RESOURCES}
+            for token in self.tokens
+        }
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def load(oauth_path: str, anonymous: bool = False) -> "TokenPool":
+        """tokens in oauth_path, or anonymous if allowed and there is none"""
         try:
-            # # disable InsecureRequestWarning of verify=False,
-            # requests.packages.urllib3.disable_warnings()
-            r = requests.post(
-                url=graphql_api, json={"query": gql}, headers=headers, timeout=30
-            )
-            if r.status_code != 200:
-                logging.warning(
-                    f"Can not retrieve from {gql}.\n"
-                    + f"Response status is {r.status_code},\n"
-                    + f"content is {r.content.decode('utf-8')}."
-                )
-            else:
+            tokens = get_access_tokens(oauth_path)
+        except OSError:
+            if not anonymous:
+                raise
+            tokens = []
+        return TokenPool((tokens or [""]) if anonymous else tokens)
+
+    def acquire(self, resource: str = "core", cost: int = 1) -> str:
+        """take cost from the token with the most budget left and return it,
+        waiting for the earliest reset if all are exhausted
+        """
+        with self.lock:
+            token = max(self.tokens, key=lambda t: self.limits[t][resource].budget())
+        self.limits[token][resource].acquire(cost)
+        return token
+
+    def update(self, token: str, headers) -> None:
+        update_rate_limit(headers, self.limits[token])
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __str__(self):
+        """remaining/limit of the core resource summed over the tokens"""
+        limiters = [limits["core"] for limits in self.limits.values()]
+        remaining = sum(l.remaining or 0 for l in limiters)
+        return f"{remaining}/{sum(l.limit or 0 for l in limiters)}"
+
+
+def auth_headers(token: str) -> dict[str, str]:
+    return {"Authorization": f"bearer {token}"} if token else {}
+
+
+# overridden to query a stand-in of the GitHub API
+GITHUB_API = os.environ.get("GITHUB_API", "https://api.github.com")
+GRAPHQL_API = os.environ.get("GITHUB_GRAPHQL_API", f"{GITHUB_API}/graphql")
+
+
+class GraphQLClient:
+    """GitHub GraphQL client keeping its connections alive between queries
+
+    Failed queries are retried with exponential backoff and jitter,
+    or after the Retry-After of the response (secondary rate limits).
+    The latency of each request is kept for stats.
+    """
+
+    # responses that are not worth retrying
+    FATAL_STATUS = {400, 401, 404, 422}
+
+    def __init__(
+        self,
+        access_token: str | TokenPool,
+        api: str = GRAPHQL_API,
+        retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        timeout: float = 30.0,
+        pool_size: int = 10,
+    ):
+        self.api = api
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.113 Safari/537.36",
+                "Accept-Language": "zh-CN,zh;q=0.9",
+            }
+        )
+        if isinstance(access_token, str):
+            access_token = TokenPool([access_token])
+        self.tokens = access_token
+        self.latencies: list[float] = []
+
+    def backoff_time(self, attempt: int) -> float:
+        """exponential backoff of the attempt-th retry with equal jitter"""
+        cap = min(self.max_backoff, self.backoff * 2.0**attempt)
+        return cap / 2 + random.uniform(0, cap / 2)
+
+    def query(self, gql: str) -> Optional[dict]:
+        """response of the query, None if all attempts failed"""
+        for attempt in range(self.retries):
+            token = self.tokens.acquire("graphql")
+            start = time.perf_counter()
+            try:
+                with span("graphql_query", attempt=attempt):
+                    r = self.session.post(
+                        self.api,
+                        json={"query": gql},
+                        headers=auth_headers(token),
+                        timeout=self.timeout,
+                    )
+            except requests.RequestException as e:
+                logging.warning(e)
+                time.sleep(self.backoff_time(attempt))
+                continue
+            self.latencies.append(time.perf_counter() - start)
+            self.tokens.update(token, r.headers)
+            if r.status_code == 200:
                 response: dict = r.json()
+                rate = (response.get("data") or {}).get("rateLimit")
+                if rate:
+                    self.tokens.limits[token]["graphql"].update_from_graphql(rate)
                 return response
+            logging.warning(
+                f"Can not retrieve from {gql}.\n"
+                + f"Response status is {r.status_code},\n"
+                + f"content is {r.content.decode('utf-8', errors='replace')}."
+            )
+            if r.status_code in self.FATAL_STATUS:
+                return None
+            # an exhausted primary rate limit is waited for by self.tokens
+            retry_after = r.headers.get("Retry-After")
+            if retry_after is not None and retry_after.isdigit():
+                time.sleep(int(retry_after))
+            else:
+                time.sleep(self.backoff_time(attempt))
+        return None
 
-        except Exception as e:
-            logging.warning(e)
-            time.sleep(5)
-
-    return None
+    def stats(self) -> dict:
+        """count, mean, median, p95 and max of the request latencies in seconds"""
+        if not self.latencies:
+            return {"count": 0}
+        latencies = sorted(self.latencies)
+        return {
+            "count": len(latencies),
+            "mean": sum(latencies) / len(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "max": latencies[-1],
+        }
 
 
-class Timing:
-    """providing timing as context or functions"""
+@lru_cache(maxsize=None)
+def graphql_client(access_token: str | TokenPool) -> GraphQLClient:
+    """the GraphQLClient shared by all queries with access_token (or token pool)"""
+    return GraphQLClient(access_token)
 
-    queue: list = []
 
-    def __enter__(self):
-        self.tic()
-        return self
+def get_graphql_data(gql: str, access_token: str | TokenPool) -> Optional[dict]:
+    """use graphql to get data
 
-    def __exit__(self, *args):
-        self.tac()
 
-    @staticmethod
-    def tic():
-        Timing.queue.append(time.time())
+    Args:
+        gql (str): graph ql query
+        access_token: access token to GitHub, or a TokenPool
 
-    @staticmethod
-    def tac():
-        assert Timing.queue, "Call Timing.tic before"
-        start_at = Timing.queue.pop()
-        print(f"Elapsed {datetime.timedelta(seconds=time.time() - start_at)}")
+    Returns:
+        (dict): response from GitHub
+    """
+    return graphql_client(access_token).query(gql)
 
 
 def log_or_skip(path: Optional[str] = None, handler=json.dumps, **kwargs):
@@ -132,17 +353,207 @@ class TimeoutException(Exception):
     pass  # pylint: disable=unnecessary-pass
 
 
-@contextlib.contextmanager
-def time_limit(seconds: float):
-    def signal_handler(signum, frame):
+# end (time.monotonic) of the innermost time_limit of the running thread or task
+_DEADLINE: contextvars.ContextVar[float] = contextvars.ContextVar(
+    "deadline", default=math.inf
+)
+
+
+def remaining_time() -> float:
+    """seconds left before the innermost time_limit, inf if there is none"""
+    return _DEADLINE.get() - time.monotonic()
+
+
+def check_deadline():
+    """raise TimeoutException if the innermost time_limit is over"""
+    if remaining_time() <= 0:
+        raise TimeoutException("Timed out!")
+
+
+def _alarm_handler(signum, frame):
+    # a timer of a limit that is not over (eg. after a nested one) is re-armed
+    remaining = remaining_time()
+    if remaining <= 0:
         raise TimeoutException("Timed out!")
+    if remaining != math.inf:
+        signal.setitimer(signal.ITIMER_REAL, remaining)
 
-    signal.setitimer(signal.ITIMER_REAL, seconds)
-    signal.signal(signal.SIGALRM, signal_handler)
+
+@contextlib.contextmanager
+def time_limit(seconds: float, preempt: Optional[bool] = None):
+    """raise TimeoutException after seconds
+
+    Limits nest, an inner limit never extends an outer one,
+    and they are kept per thread (and per asyncio task).
+    With preempt (the default in the main thread), SIGALRM interrupts the work
+    once the limit is over. Otherwise the work has to call check_deadline,
+    or bound its blocking calls with remaining_time,
+    see run_in_subprocess to kill work that cannot.
+    """
+    if preempt is None:
+        preempt = threading.current_thread() is threading.main_thread()
+    deadline = min(_DEADLINE.get(), time.monotonic() + seconds)
+    token = _DEADLINE.set(deadline)
+    if preempt:
+        previous = signal.signal(signal.SIGALRM, _alarm_handler)
+        signal.setitimer(signal.ITIMER_REAL, max(remaining_time(), 1e-6))
     try:
         yield
     finally:
-        signal.setitimer(signal.ITIMER_REAL, 0)
+        _DEADLINE.reset(token)
+        if preempt:
+            outer = remaining_time()
+            if outer == math.inf:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, previous or signal.SIG_DFL)
+            else:
+                signal.setitimer(signal.ITIMER_REAL, max(outer, 1e-6))
+
+
+def _run_child(conn, func: Callable, args: tuple, kwargs: dict):
+    try:
+        result = (True, func(*args, **kwargs))
+    except Exception as e:  # pylint: disable=broad-except
+        result = (False, e)
+    try:
+        conn.send(result)
+    except Exception as e:  # pylint: disable=broad-except
+        # unpicklable result or exception
+        conn.send((False, RuntimeError(f"{func.__name__} failed to return: {e}")))
+    finally:
+        conn.close()
+
+
+def run_in_subprocess(func: Callable, *args, timeout: float = -1, **kwargs):
+    """run func in a forked process, killed once timeout seconds
+    (or the innermost time_limit) are over
+
+    Returns: what func returns, exceptions of func are raised again,
+        TimeoutException if it was killed, RuntimeError if it crashed.
+    """
+    budget = min(timeout if timeout > 0 else math.inf, remaining_time())
+    ctx = multiprocessing.get_context("fork")
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_child, args=(send, func, args, kwargs))
+    proc.start()
+    send.close()
+    try:
+        if not recv.poll(None if budget == math.inf else max(budget, 0)):
+            raise TimeoutException("Timed out!")
+        success, result = recv.recv()
+    except EOFError as e:
+        proc.join()
+        raise RuntimeError(f"{func.__name__} exited with {proc.exitcode}") from e
+    finally:
+        if proc.is_alive():
+            proc.kill()
+        proc.join()
+        recv.close()
+    if not success:
+        raise result
+    return result
+
+
+class LimitedWorker:
+    """a forked process calling func for each call, with cpu_time seconds of CPU time
+    per call and memory_limit MB of address space, restarted once a call kills it
+
+    Unlike run_in_subprocess, one process serves many calls. It is forked with
+    os.fork, so it also works from daemonic processes such as pool workers.
+    """
+
+    def __init__(self, func: Callable, cpu_time: float = -1, memory_limit: int = -1):
+        self.func = func
+        self.cpu_time = cpu_time
+        self.memory_limit = memory_limit
+        self.pid = 0
+        self.conn: Optional[multiprocessing.connection.Connection] = None
+
+    def start(self):
+        conn, child = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:  # in the child
+            conn.close()
+            code = 1
+            try:
+                self._serve(child)
+                code = 0
+            finally:
+                os._exit(code)  # pylint: disable=protected-access
+        child.close()
+        self.pid, self.conn = pid, conn
+
+    def _serve(self, conn):
+        # no core dump when the CPU time is over
+        setrlimit(RLIMIT_CORE, (0, 0))
+        if self.memory_limit > 0:
+            _, hard = getrlimit(RLIMIT_AS)
+            setrlimit(RLIMIT_AS, (self.memory_limit << 20, hard))
+        while True:
+            try:
+                args, kwargs = conn.recv()
+            except EOFError:  # closed by the parent
+                return
+            if self.cpu_time > 0:  # SIGXCPU once the call used cpu_time
+                usage = getrusage(RUSAGE_SELF)
+                used = usage.ru_utime + usage.ru_stime
+                _, hard = getrlimit(RLIMIT_CPU)
+                soft = math.ceil(used + self.cpu_time)
+                setrlimit(RLIMIT_CPU, (soft, hard))
+            try:
+                result = (True, self.func(*args, **kwargs))
+            except MemoryError:  # the heap may be left unusable, start over
+                conn.send((False, MemoryError()))
+                return
+            except Exception as e:  # pylint: disable=broad-except
+                result = (False, e)
+            try:
+                conn.send(result)
+            except Exception as e:  # pylint: disable=broad-except
+                conn.send((False, RuntimeError(f"Failed to return: {e}")))
+
+    def close(self) -> int:
+        """stop the process, returns its exit code (negative if it was killed)"""
+        if self.conn is None:
+            return 0
+        self.conn.close()
+        self.conn = None
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(self.pid, signal.SIGKILL)
+        _, status = os.waitpid(self.pid, 0)
+        return os.waitstatus_to_exitcode(status)
+
+    def __call__(self, *args, **kwargs):
+        """func(*args, **kwargs) in the process, exceptions of func are raised again
+
+        Raises: TimeoutException if the call used up its CPU time
+            (or its wall time, twice the CPU time and 5 more seconds),
+            MemoryError if it ran out of memory, RuntimeError if the process died.
+        """
+        if self.conn is None:
+            self.start()
+        assert self.conn is not None
+        wall = 2 * self.cpu_time + 5 if self.cpu_time > 0 else None
+        reply, hung = None, False
+        try:
+            self.conn.send((args, kwargs))
+            hung = not self.conn.poll(wall)
+            if not hung:
+                reply = self.conn.recv()
+        except (EOFError, OSError):  # the process died during the call
+            pass
+        if reply is not None:
+            success, result = reply
+            if success:
+                return result
+            if not isinstance(result, MemoryError):
+                raise result
+        code = self.close()
+        if reply is not None:
+            raise MemoryError(f"Out of {self.memory_limit} MB")
+        if hung or code == -signal.SIGXCPU:
+            raise TimeoutException("Timed out!")
+        raise RuntimeError(f"Worker exited with {code}")
 
 
 def timestamp(fmt="%Y-%m-%d %H:%M:%S"):
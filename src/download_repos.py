@@ -1,11 +1,18 @@
 """Script to download repos from GitHub"""
 
 import os
+import glob
 import fire
+import threading
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
 import time
 import random
 import tarfile
+import json
+import hashlib
 import requests
+from requests.structures import CaseInsensitiveDict
 from tqdm import tqdm
 from github import Github, Auth
 from github.Repository import Repository
@@ -13,18 +20,27 @@ from github.Commit import Commit
 from github.GitRelease import GitRelease
 from github.Tag import Tag
 from github.GithubException import GithubException
-from typing import Tuple, Optional
+from typing import Any, Callable, Iterator, Tuple, Optional
+from returns.pipeline import is_successful
 from returns.result import Result, Success, Failure
 from enum import IntEnum
 import logging
 
+from src.check_repo_stats import fetch_batched
 from src.common import (
     log_or_skip,
     wrap_repo,
     time_limit,
+    remaining_time,
+    check_deadline,
     TimeoutException,
-    get_access_token,
+    auth_headers,
+    TokenPool,
+    RateLimiter,
+    update_rate_limit,
+    GITHUB_API,
 )
+from src.tracing import span, traced
 
 
 class DownloadErrorCode(IntEnum):
@@ -37,107 +53,431 @@ class DownloadErrorCode(IntEnum):
 
 
 def fetch_repo(
-    repo_id: str, timeout: int, hub: Optional[Github]
+    repo_id: str,
+    timeout: int,
+    hub: Optional[Github],
+    limits: Optional[dict[str, RateLimiter]] = None,
 ) -> Result[Repository, DownloadErrorCode]:
-    """fetch a repo"""
-    hub = hub if hub is not None else Github()
+    """fetch a repo
+
+    PyGithub cannot be interrupted outside the main thread, so a request is only
+    bounded by the socket timeout of hub (timeout for the hub made here),
+    the innermost time_limit is checked once it returns.
+    The request counts in limits (the rate limits of the token of hub) if given,
+    which are updated from the headers of its response.
+    """
+    hub = hub if hub is not None else make_hub("", timeout)
     try:
-        with time_limit(timeout):
-            repo = hub.get_repo(repo_id)
+        spend(limits)
+        repo = hub.get_repo(repo_id)
+        if limits is not None:
+            # PyGithub keeps the response headers in lower case
+            update_rate_limit(CaseInsensitiveDict(repo.raw_headers), limits)
+        check_deadline()
         return Success(repo)
-    except (GithubException, TimeoutException):
+    # PyGithub raises the errors of requests as is, eg. a read timeout
+    except (GithubException, TimeoutException, requests.RequestException):
         return Failure(DownloadErrorCode.FETCH_ARCHIVE_FAILED)
 
 
 RepoArchive = GitRelease | Tag | Commit
 
 
+def spend(limits: Optional[dict[str, RateLimiter]], cost: int = 1):
+    """count a REST request in limits if any, see TokenPool.limits"""
+    if limits is not None:
+        limits["core"].acquire(cost)
+
+
 def fetch_archive(
-    repo: Repository,
+    repo: Repository, limits: Optional[dict[str, RateLimiter]] = None
 ) -> Result[tuple[RepoArchive, str], DownloadErrorCode]:
-    """fetch the archive of a repo
-    try: latest release -> latest tag -> latest commit
+    """fetch the archive of a repo, see latest_archive
 
     Returns: (archive, its tarball url)
     """
+    try:
+        return Success(latest_archive(repo, limits))
+    except (GithubException, StopIteration, requests.RequestException):
+        return Failure(DownloadErrorCode.FETCH_ARCHIVE_FAILED)
+
+
+def latest_archive(
+    repo: Repository, limits: Optional[dict[str, RateLimiter]] = None
+) -> tuple[RepoArchive, str]:
+    """try: latest release -> latest tag -> latest commit, a request each
+    a request that fails (eg. timed out) is raised instead of trying the next one
+    """
     # try latest release
     try:
+        spend(limits)
         latest_release = repo.get_latest_release()
-        return Success((latest_release, latest_release.tarball_url))
+        return latest_release, latest_release.tarball_url
     except GithubException:
         pass
 
-    # try latest tag
+    # try latest tag, the first page only (totalCount would be another request)
     try:
-        tags = repo.get_tags()
-        if tags.totalCount > 0:
-            latest_tag: Tag = next(iter(tags))
-            return Success((latest_tag, latest_tag.tarball_url))
+        spend(limits)
+        tags: list[Tag] = repo.get_tags().get_page(0)
+        if tags:
+            return tags[0], tags[0].tarball_url
     except GithubException:
         pass
 
     # try latest commit
-    try:
-        commit = next(iter(repo.get_commits()))
-        tarball_url = f"https://api.github.com/repos/{repo.owner.login}/{repo.name}/tarball/{commit.sha}"
-        return Success((commit, tarball_url))
-    except GithubException:
-        return Failure(DownloadErrorCode.FETCH_ARCHIVE_FAILED)
+    spend(limits)
+    commit = next(iter(repo.get_commits()))
+    tarball_url = (
+        f"{GITHUB_API}/repos/{repo.owner.login}/{repo.name}/tarball/{commit.sha}"
+    )
+    return commit, tarball_url
+
 
+# bytes read and written at a time by download_archive
+CHUNK_SIZE = 1 << 20
+# minimum average speed (bytes/s) of a download once past its timeout
+MIN_SPEED = 16 << 10
+# error responses a download is retried after, others fail it at once
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
+
+@traced("download")
 def download_archive(
-    path: str, url: str, timeout: int
+    path: str,
+    url: str,
+    timeout: int,
+    min_speed: int = MIN_SPEED,
+    retries: int = 3,
+    chunk_size: int = CHUNK_SIZE,
+    headers: Optional[dict[str, str]] = None,
+    backoff: float = 1.0,
 ) -> Result[None, DownloadErrorCode]:
-    """download file from url to path with timeout limit"""
-    try:
-        with time_limit(timeout):
-            resp = requests.get(url, timeout=None)  # use self-defined time_limit
-            resp.raise_for_status()
-    except (TimeoutError, TimeoutException):
-        return Failure(DownloadErrorCode.DOWNLOAD_ARCHIVE_FAILED)
+    """stream url to path chunk by chunk
 
-    with open(path, "wb") as outfile:
-        outfile.write(resp.content)
+    The download goes to a ".part" file renamed to path once complete,
+    an interrupted download or one answered with a RETRY_STATUS is resumed
+    (up to retries times, backoff doubling between them, or by the next call)
+    with a Range request if the server supports it.
+    The part files left by earlier urls of path are removed once it is complete.
+    It is aborted when no data comes for timeout seconds,
+    when its average speed is below min_speed after the first timeout seconds,
+    or when the innermost time_limit is over.
+    headers are sent with each request, eg. auth_headers.
+    """
+    # the part file is specific to url, a new archive never resumes an old one
+    url_digest = hashlib.blake2b(url.encode(), digest_size=4).hexdigest()
+    part_path = f"{path}.{url_digest}.part"
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            time.sleep(max(0, min(backoff * 2.0 ** (attempt - 1), remaining_time())))
+        if remaining_time() <= 0:
+            return Failure(DownloadErrorCode.DOWNLOAD_ARCHIVE_FAILED)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        range_headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            read_timeout = min(timeout, remaining_time())
+            with requests.get(
+                url,
+                headers=(headers or {}) | range_headers,
+                stream=True,
+                timeout=read_timeout,
+            ) as resp:
+                if resp.status_code == 416:  # nothing left after offset
+                    break
+                resp.raise_for_status()
+                # the server may ignore Range and send the whole file
+                mode = "ab" if resp.status_code == 206 else "wb"
+                with open(part_path, mode) as outfile:
+                    start, received = time.monotonic(), 0
+                    for chunk in resp.iter_content(chunk_size):
+                        check_deadline()
+                        outfile.write(chunk)
+                        received += len(chunk)
+                        elapsed = time.monotonic() - start
+                        if elapsed > timeout and received < min_speed * elapsed:
+                            raise TimeoutException("Download too slow!")
+            break
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in RETRY_STATUS:
+                return Failure(DownloadErrorCode.DOWNLOAD_ARCHIVE_FAILED)
+        except (requests.RequestException, TimeoutException):
+            continue
+    else:
+        return Failure(DownloadErrorCode.DOWNLOAD_ARCHIVE_FAILED)
 
+    os.replace(part_path, path)
+    for stale_path in glob.glob(f"{glob.escape(path)}.*.part"):
+        with contextlib.suppress(OSError):
+            os.remove(stale_path)
     return Success(None)
 
 
+# which members of an archive to extract, None to skip extraction
+EXTRACT_FILTERS: dict[str, Optional[Callable[[tarfile.TarInfo], bool]]] = {
+    "all": lambda _: True,
+    "py": lambda member: member.isfile() and member.name.endswith(".py"),
+    "none": None,
+}
+
+
+@traced("extract")
+def extract_archive(tar_path: str, path: str, extract: str = "all"):
+    """extract the members of the archive selected by EXTRACT_FILTERS[extract]"""
+    member_filter = EXTRACT_FILTERS[extract]
+    if member_filter is None:
+        return
+    with tarfile.open(tar_path) as tp:
+        tp.extractall(path, members=list(filter(member_filter, tp.getmembers())))
+
+
+def archive_entry(p: tuple[RepoArchive, str]) -> dict:
+    """manifest fields of an archive: its url, kind and identifier"""
+    archive, url = p
+    if isinstance(archive, GitRelease):
+        kind, archive_id = "release", archive.tag_name
+    elif isinstance(archive, Tag):
+        kind, archive_id = "tag", archive.name
+    else:
+        kind, archive_id = "commit", archive.sha
+    return {"archive": url, "kind": kind, "archive_id": archive_id}
+
+
 def download_repo(
-    hub: Github, repo_id: str, path: str, fetch_timeout: int, download_timeout: int
+    hub: Github,
+    repo_id: str,
+    path: str,
+    fetch_timeout: int,
+    download_timeout: int,
+    min_speed: int = MIN_SPEED,
+    token: str = "",
+    limits: Optional[dict[str, RateLimiter]] = None,
 ):
+    """resolve the archive of a repo with hub and download it to path,
+    each request (up to 5) counts in limits, the rate limits of token (that of hub)
+    """
 
     def download_archive_to_path(p: tuple[RepoArchive, str]):
         _, url = p
-        return download_archive(path, url, download_timeout).map(lambda _: p)
+        spend(limits)
+        return download_archive(
+            path, url, download_timeout, min_speed, headers=auth_headers(token)
+        ).map(lambda _: p)
+
+    with span("resolve_archive"):
+        resolved = fetch_repo(repo_id, fetch_timeout, hub, limits).bind(
+            lambda repo: fetch_archive(repo, limits)
+        )
+    return resolved.bind(download_archive_to_path).map(archive_entry)
+
+
+# for each kind of archive, the endpoint of the latest one and its identifier
+PROBES: dict[str, tuple[str, Callable[[Any], str]]] = {
+    "release": ("releases/latest", lambda r: r["tag_name"]),
+    "tag": ("tags?per_page=1", lambda r: r[0]["name"]),
+    "commit": ("commits?per_page=1", lambda r: r[0]["sha"]),
+}
+
+
+@traced("probe")
+def probe_archive(
+    session: requests.Session,
+    repo_id: str,
+    entry: dict,
+    timeout: int,
+    tokens: Optional[TokenPool] = None,
+) -> Optional[str]:
+    """check if the archive in a manifest entry is still the latest of its kind,
+    with a conditional request on its etag (a 304 does not count in the rate limit)
+
+    Returns: the etag of the latest archive if unchanged, None otherwise
+    """
+    endpoint, get_archive_id = PROBES[entry["kind"]]
+    etag = entry.get("etag")
+    headers = {"If-None-Match": etag} if etag else {}
+    token = tokens.acquire("core") if tokens is not None else ""
+    headers |= auth_headers(token)
+    try:
+        resp = session.get(
+            f"{GITHUB_API}/repos/{repo_id}/{endpoint}", headers=headers, timeout=timeout
+        )
+    except requests.RequestException:
+        return None
+    if tokens is not None:
+        tokens.update(token, resp.headers)
+    if resp.status_code == 304:
+        return etag
+    if resp.status_code != 200:
+        return None
+    try:
+        latest = get_archive_id(resp.json())
+    except (ValueError, LookupError, TypeError):
+        return None
+    return resp.headers.get("ETag", "") if latest == entry["archive_id"] else None
+
+
+def load_manifest(path: Optional[str]) -> dict[str, dict]:
+    """repo_id -> its last entry in the manifest (jsonl) at path"""
+    manifest: dict[str, dict] = {}
+    if path and os.path.exists(path):
+        with open(path, "r") as fp:
+            for line in fp:
+                if line.strip():
+                    entry = json.loads(line)
+                    manifest[entry["repo_id"]] = entry
+    return manifest
+
+
+# latest release, most recent tag and head commit of a repo, see resolve_archives
+ARCHIVE_FIELDS = """
+latestRelease { tagName }
+refs(
+    refPrefix: "refs/tags/", first: 1,
+    orderBy: {field: TAG_COMMIT_DATE, direction: DESC}
+) {
+    nodes { name }
+}
+defaultBranchRef { target { oid } }
+"""
 
-    return (
-        fetch_repo(repo_id, timeout=fetch_timeout, hub=hub)
-        .bind(fetch_archive)
-        .bind(download_archive_to_path)
-    )
+
+def archive_of(repo_id: str, data: Optional[dict]) -> Result[dict, DownloadErrorCode]:
+    """the archive (see archive_entry) of a repo given its ARCHIVE_FIELDS,
+    latest release -> latest tag -> latest commit as in fetch_archive
+    """
+    if data is None:
+        return Failure(DownloadErrorCode.FETCH_REPO_FAILED)
+    if data.get("latestRelease"):
+        kind, archive_id = "release", data["latestRelease"]["tagName"]
+    elif (data.get("refs") or {}).get("nodes"):
+        kind, archive_id = "tag", data["refs"]["nodes"][0]["name"]
+    elif data.get("defaultBranchRef"):
+        kind, archive_id = "commit", data["defaultBranchRef"]["target"]["oid"]
+    else:
+        return Failure(DownloadErrorCode.FETCH_ARCHIVE_FAILED)
+    url = f"{GITHUB_API}/repos/{repo_id}/tarball/{archive_id}"
+    return Success({"archive": url, "kind": kind, "archive_id": archive_id})
+
+
+def resolve_archives(
+    repo_ids: list[str], tokens: TokenPool, batch_size: int = 50
+) -> dict[str, Result[dict, DownloadErrorCode]]:
+    """archives of repos with batch_size repos per GraphQL query"""
+    with span("resolve_archives", repos=len(repo_ids)):
+        fetched = fetch_batched(repo_ids, tokens, ARCHIVE_FIELDS, "", batch_size)
+    return {repo_id: archive_of(repo_id, data) for repo_id, data in fetched.items()}
+
+
+# attempts after the first of a failed PyGithub request, its default of 10 made
+# a timed out request take up to 11 times the timeout of the hub
+HUB_RETRIES = 1
+
+
+def make_hub(token: str, timeout: int = 15) -> Github:
+    """github object authorized by token, anonymous if it is empty"""
+    # token is provided for rate limit:
+    # https://docs.github.com/en/rest/overview/resources-in-the-rest-api?apiVersion=2022-11-28#rate-limiting
+    # 5k calls per hours if authorized, otherwise, 60 calls or some
+    auth = Auth.Token(token) if token else None
+    return Github(auth=auth, base_url=GITHUB_API, timeout=timeout, retry=HUB_RETRIES)
+
+
+def extract_downloaded(
+    repo_id: str, result: Result, repo_path: str, extract: str
+) -> dict:
+    """extract the archive of a download_repo result (see archive_entry),
+    unless it is an unchanged archive already extracted the same way
+
+    Returns: the record to log
+    """
+    tar_path = repo_path + ".tar.gz"
+    match result:
+        case Success(entry):
+            record = {"repo_id": repo_id, **entry, "download": tar_path}
+            if entry.get("unchanged") and entry.get("extract") == extract:
+                return record
+            record |= {"extract": extract, "extracted": repo_path}
+            try:
+                extract_archive(tar_path, repo_path, extract)
+            except tarfile.ReadError:
+                record["error_code"] = DownloadErrorCode.TARFILE_EXTRACT_FAILED
+            return record
+        case Failure(status):
+            return {"repo_id": repo_id, "error_code": status}
+    raise TypeError(f"Unexpected result {result}")
 
 
 def main(
     input_repo_list_path: str = "data/meta/oss_fuzz_python_filtered.txt",
     fetch_timeout: int = 30,
-    download_timeout: int = 300,
+    download_timeout: int = 60,
+    min_speed: int = MIN_SPEED,
     delay: Tuple[int, int] | int = -1,
     oroot: str = "data/repos/",
     log: Optional[str] = "download_log.jsonl",
+    manifest: Optional[str] = "manifest.jsonl",
     limits: int = -1,
     oauth: str = "oauth",
+    extract: str = "all",
+    workers: int = 1,
+    extract_workers: int = 1,
+    resolver: str = "graphql",
+    batch_size: int = 50,
+    repo_timeout: int = -1,
 ):
+    """download the archive of each repo to <oroot>/<repo>.tar.gz
+
+    Args:
+        download_timeout (int): seconds without any data before a download fails,
+            it also fails if slower than min_speed (bytes/s) after download_timeout.
+        fetch_timeout (int): seconds a GitHub API request may wait for data,
+            a timed out request is tried again HUB_RETRIES times.
+        repo_timeout (int): seconds for the whole download of a repo, no limit if <= 0,
+            checked between the API requests of a repo (each one is only bounded
+            by fetch_timeout) and during the download of its archive.
+        extract (str): what to extract from the archives,
+            "all", "py" (only python files) or "none"
+            (static.py can read the archives directly with --archives).
+        delay (int | tuple): seconds to pause after each repo that is downloaded
+            (not after the unchanged ones), random in [a, b] if a tuple (a, b),
+            with either resolver, outside of repo_timeout.
+        workers (int): number of repos downloaded at the same time,
+            delay is then the pause of each worker between two repos.
+        extract_workers (int): number of archives extracted at the same time,
+            extraction runs apart from downloading when workers > 1.
+        manifest (str): jsonl in oroot recording the archive of each repo,
+            repos whose archive is unchanged since are skipped.
+        resolver (str): how the archive of each repo is found,
+            "graphql": batch_size repos per query, needs a token,
+            "rest": a few REST calls per repo (and a conditional one for the manifest).
+    """
+    if extract not in EXTRACT_FILTERS:
+        raise ValueError(f"extract should be one of {list(EXTRACT_FILTERS)}")
     if log:
         log = os.path.join(oroot, log)
-    # declare github object
-    # oauth is provided for rate limit:
-    # https://docs.github.com/en/rest/overview/resources-in-the-rest-api?apiVersion=2022-11-28#rate-limiting
-    # 5k calls per hours if authorized, otherwise, 60 calls or some
-    hub: Github
-    try:
-        hub = Github(auth=Auth.Token(get_access_token(oauth)))
-    except GithubException:
-        hub = Github()
+    if manifest:
+        manifest = os.path.join(oroot, manifest)
+    entries = load_manifest(manifest)
+    # tokens in oauth, one per line, each request uses the one with most budget left
+    tokens = TokenPool.load(oauth, anonymous=True)
+    logging.info(f"Loaded {len(tokens)} GitHub tokens")
+    # PyGithub objects are not thread-safe, each thread has its own for each token
+    local = threading.local()
+
+    def thread_hub(token: str) -> Github:
+        if not hasattr(local, "hubs"):
+            local.hubs = {}
+        hubs: dict[str, Github] = local.hubs
+        if token not in hubs:
+            hubs[token] = make_hub(token, fetch_timeout)
+        return hubs[token]
+
+    def thread_session() -> requests.Session:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        session: requests.Session = local.session
+        return session
+
     # if repo_id_list is a file then load lines
     # otherwise it is the id of a specific repo
     with open(input_repo_list_path, "r") as fp:
@@ -146,45 +486,125 @@ def main(
     if limits >= 0:
         repo_id_list = repo_id_list[:limits]
 
-    logging.info(f"Loaded {len(repo_id_list)} repos to be downloaded")
-    failed = [0, 0, 0, 0]
-    for repo_id in (pbar := tqdm(repo_id_list)):
-        # log repo_id and rate limits
-        rate = hub.get_rate_limit()
-        pbar.set_description(
-            f"Downloading {repo_id}, Rate: {rate.core.remaining}/{rate.core.limit}"
-        )
+    archives: Optional[dict[str, Result]] = None
+    if resolver == "graphql" and tokens.tokens == [""]:
+        logging.warning("GraphQL needs a token, resolving archives with REST")
+    elif resolver == "graphql":
+        archives = resolve_archives(repo_id_list, tokens, batch_size)
+        logging.info(f"Resolved the archives of {len(archives)} repos")
 
-        # download repo
-        repo_path = os.path.join(oroot, wrap_repo(repo_id))
-        tar_path = repo_path + ".tar.gz"
-        match download_repo(hub, repo_id, tar_path, fetch_timeout, download_timeout):
-            case Success((_, url)):
-                try:
-                    with tarfile.open(tar_path) as tp:
-                        tp.extractall(repo_path)
-                    log_or_skip(
-                        log,
-                        repo_id=repo_id,
-                        archive=url,
-                        download=tar_path,
-                    )
-                except tarfile.ReadError:
-                    log_or_skip(
-                        log,
-                        repo_id=repo_id,
-                        archive=url,
-                        download=tar_path,
-                        error_code=DownloadErrorCode.TARFILE_EXTRACT_FAILED,
-                    )
-                    failed[DownloadErrorCode.TARFILE_EXTRACT_FAILED] += 1
-            case Failure(status):
-                failed[status] += 1
-                log_or_skip(log, repo_id=repo_id, error_code=status)
-        # delay
+    def download_resolved(repo_id: str, resolved: Result) -> Result:
+        tar_path = os.path.join(oroot, wrap_repo(repo_id)) + ".tar.gz"
+        entry = entries.get(repo_id)
+        match resolved:
+            case Success(archive) if (
+                entry is not None
+                and os.path.exists(entry["download"])
+                and entry.get("kind") == archive["kind"]
+                and entry.get("archive_id") == archive["archive_id"]
+            ):
+                return Success(entry | {"unchanged": True})
+
+        def download_to_path(archive: dict) -> Result:
+            # the tarball endpoint counts in the core rate limit of the token
+            token = tokens.acquire("core")
+            downloaded: Result = download_archive(
+                tar_path,
+                archive["archive"],
+                download_timeout,
+                min_speed,
+                headers=auth_headers(token),
+            )
+            return downloaded.map(lambda _: archive)
+
+        return resolved.bind(download_to_path)
+
+    def download(repo_id: str) -> Result:
+        with span("download_repo", repo=repo_id):
+            result = download_limited(repo_id)
+        # delay, after the repos downloaded again with either resolver
+        unchanged = is_successful(result) and result.unwrap().get("unchanged")
         sleep_time = delay if isinstance(delay, int) else random.randint(*delay)
-        if sleep_time > 0:
+        if sleep_time > 0 and not unchanged:
             time.sleep(sleep_time)
+        return result
+
+    def download_limited(repo_id: str) -> Result:
+        if repo_timeout <= 0:
+            return download_unlimited(repo_id)
+        try:
+            with time_limit(repo_timeout):
+                return download_unlimited(repo_id)
+        except TimeoutException:
+            return Failure(DownloadErrorCode.DOWNLOAD_ARCHIVE_FAILED)
+
+    def download_unlimited(repo_id: str) -> Result:
+        if archives is not None:
+            return download_resolved(repo_id, archives[repo_id])
+        tar_path = os.path.join(oroot, wrap_repo(repo_id)) + ".tar.gz"
+        entry = entries.get(repo_id)
+        if entry is not None and os.path.exists(entry["download"]):
+            etag = probe_archive(
+                thread_session(), repo_id, entry, fetch_timeout, tokens
+            )
+            if etag is not None:
+                return Success(entry | {"etag": etag, "unchanged": True})
+        # the token with the most budget, each request then counts in its limits
+        token = tokens.acquire("core", 0)
+        result: Result = download_repo(
+            thread_hub(token),
+            repo_id,
+            tar_path,
+            fetch_timeout,
+            download_timeout,
+            min_speed,
+            token,
+            tokens.limits[token],
+        )
+        return result
+
+    def extract_repo(repo_id: str, result: Result) -> dict:
+        repo_path = os.path.join(oroot, wrap_repo(repo_id))
+        return extract_downloaded(repo_id, result, repo_path, extract)
+
+    logging.info(f"Loaded {len(repo_id_list)} repos to be downloaded")
+    failed = [0, 0, 0, 0]
+    pools: list[ThreadPoolExecutor] = []
+    with contextlib.ExitStack() as stack:
+        records: Iterator[dict]
+        if workers > 1:
+            download_pool = stack.enter_context(ThreadPoolExecutor(workers))
+            extract_pool = stack.enter_context(ThreadPoolExecutor(extract_workers))
+            pools = [download_pool, extract_pool]
+
+            def pipeline(repo_id: str) -> Future:
+                # the download thread is free again once extraction is queued
+                return extract_pool.submit(extract_repo, repo_id, download(repo_id))
+
+            futures = [download_pool.submit(pipeline, r) for r in repo_id_list]
+            records = (future.result().result() for future in futures)
+        else:
+            records = (extract_repo(r, download(r)) for r in repo_id_list)
+
+        try:
+            # records come in the order of repo_id_list, logged from this thread only
+            for repo_id, record in zip(
+                repo_id_list, pbar := tqdm(records, total=len(repo_id_list))
+            ):
+                # log repo_id and rate limits
+                pbar.set_description(f"Downloaded {repo_id}, Rate: {tokens}")
+                if "error_code" in record:
+                    failed[record["error_code"]] += 1
+                log_or_skip(log, **record)
+                entry = {k: v for k, v in record.items() if k != "unchanged"}
+                if "error_code" not in record and entry != entries.get(repo_id):
+                    log_or_skip(manifest, **entry)
+        except BaseException:
+            # stopped early (error or interrupt), drop the queued repos
+            # instead of downloading all of them before the error comes out
+            for pool in pools:
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
 
     if sum(failed):
         failed_types = ["repo", "archive", "download", "extract"]
@@ -12,7 +12,12 @@ from src.check_repo_stats import check_requirements, CHECK_MAP
 from src.common import RepoMetadata, get_access_token, get_graphql_data
 from typing import Optional
 import json
-from funcy import lfilter
+from itertools import chain
+from funcy import lchunks, lfilter, lmap
+from pathos.multiprocessing import ProcessPool
+
+# libyaml's loader is much faster, when pyyaml is built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 
 def save_repos_to_file(language: str, repos_list: list[str]) -> None:
@@ -36,24 +41,109 @@ def save_repos_to_file(language: str, repos_list: list[str]) -> None:
             file.write(f"{repo}\n")
 
 
-def load_proj_config(proj_path: str) -> Optional[dict]:
+def read_proj_yaml(proj_path: str) -> Optional[dict]:
+    """the project.yaml of a project, None if it is missing or invalid
+
+    Values that are not json types (eg. dates) are converted to strings,
+    so that the config is the same whether it is read or loaded from the cache.
+    """
+    config_path = os.path.join(proj_path, "project.yaml")
+    try:
+        with open(config_path, "r") as fp:
+            config = yaml.load(fp, Loader=YamlLoader)
+    except (OSError, yaml.YAMLError) as e:
+        logging.warning(f"Failed to load {config_path}: {e}")
+        return None
+    if not isinstance(config, dict):
+        return None
+    normalized: dict = json.loads(json.dumps(config, default=str))
+    return normalized
+
+
+def count_fuzz_targets(proj_path: str) -> int:
+    """python fuzz targets are the .py files of the project"""
+    return len([s for s in os.listdir(proj_path) if s.endswith(".py")])
+
+
+def load_proj_config(
+    proj_path: str, language: Optional[str] = None, config: Optional[dict] = None
+) -> Optional[dict]:
     """load a project's configuration to dict
 
     Args:
         proj_path (str): path to the oss-fuzz supported project
+        language (str, optional): only load projects in this language
+        config (dict, optional): its project.yaml if already read (see scan_projects),
+            read with read_proj_yaml if not given
 
     Returns:
         Optional[dict]: configuration, None if key "language" not in it
+            or it is not in language
     """
-    config_path = os.path.join(proj_path, "project.yaml")
-    with open(config_path, "r") as fp:
-        config: dict[str, str | int] = yaml.safe_load(fp)
-
-    config["#fuzz_target"] = len(
-        [s for s in os.listdir(proj_path) if s.endswith(".py")]
-    )
-
-    return config if "language" in config else None
+    if config is None:
+        config = read_proj_yaml(proj_path)
+    if config is None or "language" not in config:
+        return None
+    if language is not None and config["language"] != language:
+        return None
+    return config | {"#fuzz_target": count_fuzz_targets(proj_path)}
+
+
+def project_mtime(proj_path: str) -> list[int]:
+    """mtimes of a project directory and its project.yaml, the directory changes
+    when files are added or removed, eg. fuzz targets
+    """
+    mtimes = [os.stat(proj_path).st_mtime_ns]
+    try:
+        mtimes.append(os.stat(os.path.join(proj_path, "project.yaml")).st_mtime_ns)
+    except OSError:
+        mtimes.append(-1)
+    return mtimes
+
+
+def read_proj_yamls(proj_paths: list[str], workers: int = 1) -> list[Optional[dict]]:
+    """read_proj_yaml of each project, with workers processes if more than one"""
+    if workers <= 1:
+        return [read_proj_yaml(p) for p in proj_paths]
+    pool = ProcessPool(nodes=workers)
+    try:
+        chunks = pool.imap(lambda c: lmap(read_proj_yaml, c), lchunks(64, proj_paths))
+        configs: list[Optional[dict]] = list(chain.from_iterable(chunks))
+        return configs
+    finally:
+        pool.close()
+        pool.join()
+        pool.clear()
+
+
+def scan_projects(
+    projects_dir: str, cache_path: Optional[str] = None, workers: int = 1
+) -> dict[str, Optional[dict]]:
+    """project name -> its project.yaml (None if invalid), for all projects
+
+    The yaml files are cached in cache_path with the mtimes of their project,
+    only the projects changed since are read again.
+    """
+    cache: dict[str, dict] = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, "r") as fp:
+            cache = json.load(fp)
+
+    names = os.listdir(projects_dir)
+    mtimes = {name: project_mtime(os.path.join(projects_dir, name)) for name in names}
+    stale = [n for n in names if n not in cache or cache[n]["mtime"] != mtimes[n]]
+    logging.info(f"Read {len(stale)} changed projects of {len(names)}")
+    configs = read_proj_yamls([os.path.join(projects_dir, n) for n in stale], workers)
+    for name, config in zip(stale, configs):
+        cache[name] = {"mtime": mtimes[name], "config": config}
+
+    if cache_path is not None and stale:
+        # removed projects are dropped
+        cache = {name: cache[name] for name in names}
+        with open(cache_path + ".tmp", "w") as fp:
+            json.dump(cache, fp)
+        os.replace(cache_path + ".tmp", cache_path)
+    return {name: cache[name]["config"] for name in names}
 
 
 def to_repo_json(config: dict[str, str]):
@@ -63,16 +153,24 @@ def to_repo_json(config: dict[str, str]):
     return j
 
 
-def get_oss_fuzz_projects(language: str = "python") -> list[str]:
+def get_oss_fuzz_projects(
+    language: str = "python", cache_path: Optional[str] = None, workers: int = 1
+) -> list[str]:
+    """projects in language of the oss-fuzz checkout, see scan_projects"""
     oss_fuzz_dir = os.path.join(os.environ["WORKDIR"], "oss-fuzz")
     projects_dir = os.path.join(oss_fuzz_dir, "projects")
 
+    def proj_config(name_config: tuple[str, Optional[dict]]) -> Optional[dict]:
+        name, config = name_config
+        if config is None:  # not loaded again from the yaml
+            return None
+        return load_proj_config(os.path.join(projects_dir, name), language, config)
+
+    # only the projects in language are listed for their fuzz targets
     proj_list: list[str] = (
-        Chain(os.listdir(projects_dir))
-        .map(lambda p: os.path.join(projects_dir, p))
-        .map(load_proj_config)
-        .filter(None)
-        .filter(lambda config: config["language"] == language)
+        Chain(scan_projects(projects_dir, cache_path, workers).items())
+        .map(proj_config)
+        .filter(lambda config: config is not None)
         .map(to_repo_json)
         .map(json.dumps)
         .value
@@ -84,8 +182,23 @@ def get_oss_fuzz_projects(language: str = "python") -> list[str]:
 # Pass checks_list and reqs with this template: --checks_list='<list>' --reqs='<list>'
 # Ex. --reqs='["0", "2020-1-1"]'
 # If checking Rust fuzz path, put null in place of where the req should be in the reqs list
-def main(language: str = "python", output_file: str = "output.jsonl"):
-    oss_fuzz_projects = get_oss_fuzz_projects(language.lower())
+def main(
+    language: str = "python",
+    output_file: str = "output.jsonl",
+    cache: Optional[str] = "data/meta/oss_fuzz_projects.json",
+    workers: Optional[int] = None,
+):
+    """find the projects in language from the oss-fuzz checkout in $WORKDIR
+
+    Args:
+        cache (str, optional): json caching the project.yaml of each project,
+            only the projects changed since are read again. None to read all.
+        workers (int, optional): number of processes reading the yaml files.
+            Defaults to $CORES (see env.sh), 1 reads serially.
+    """
+    if workers is None:
+        workers = int(os.environ.get("CORES", 1))
+    oss_fuzz_projects = get_oss_fuzz_projects(language.lower(), cache, workers)
     logging.info(f"Find {len(oss_fuzz_projects)} projects in OSS-Fuzz projects")
     with open(output_file, "w") as fp:
         fp.write("\n".join(oss_fuzz_projects))
@@ -0,0 +1,381 @@
+"""Offline stand-in of the GitHub API for benchmarks and load tests
+
+Serves what the crawl scripts use, for any owner/name:
++ POST /graphql: the repository fields of RepoMetadata or download_repos.ARCHIVE_FIELDS
+    (aliased or not) and rateLimit
++ GET /repos/<owner>/<name>: the repo
++ GET /repos/<owner>/<name>/releases/latest, /tags, /commits
++ GET /repos/<owner>/<name>/tarball/<ref>: a synthetic python package, Range supported
+
+Repos are synthesized from the hash of their id, names starting with "missing" do not
+exist. Each response can be delayed (latency), fail with a 502 (failure_rate)
+and counts in the rate limit of its token, sent back in X-RateLimit-* headers.
+Point the scripts to it with GITHUB_API=http://<host>:<port>.
+"""
+
+import io
+import re
+import json
+import time
+import random
+import tarfile
+import hashlib
+import logging
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlsplit
+import fire
+
+
+@dataclass
+class StubConfig:
+    latency: float = 0.0  # seconds before each response
+    failure_rate: float = 0.0  # probability of a 502
+    rate_limit: int = 5000  # requests of each token per rate_window
+    rate_window: int = 3600  # seconds
+    archive_files: int = 10  # modules (and as many test files) per archive
+    seed: int = 0
+
+
+def repo_digest(repo_id: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(repo_id.encode(), digest_size=8).digest(), "big"
+    )
+
+
+def repo_sha(repo_id: str) -> str:
+    return hashlib.sha1(repo_id.encode()).hexdigest()
+
+
+def repo_kind(repo_id: str) -> str:
+    """kind of the latest archive of a repo"""
+    return ("release", "tag", "commit")[repo_digest(repo_id) % 3]
+
+
+def repo_metadata(repo_id: str) -> dict:
+    """fields of RepoMetadata"""
+    owner, name = repo_id.split("/", 1)
+    digest = repo_digest(repo_id)
+    return {
+        "id": f"R_{digest:x}",
+        "owner": {"login": owner},
+        "name": name,
+        "url": f"https://github.com/{repo_id}",
+        "isArchived": digest % 50 == 0,
+        "isFork": digest % 40 == 1,
+        "isMirror": False,
+        "primaryLanguage": {"name": "Python" if digest % 10 else "C"},
+        "pushedAt": f"20{18 + digest % 6}-0{1 + digest % 9}-1{digest % 10}T00:00:00Z",
+        "stargazerCount": digest % 5000,
+        "object": {
+            "entries": [
+                {"name": "setup.py", "type": "blob"},
+                {"name": "tests", "type": "tree"},
+            ]
+        },
+    }
+
+
+def repo_tag(repo_id: str) -> str:
+    return f"v{repo_digest(repo_id) % 10}.0"
+
+
+def repo_archive(repo_id: str) -> dict:
+    """fields of download_repos.ARCHIVE_FIELDS"""
+    kind = repo_kind(repo_id)
+    tag = {"name": repo_tag(repo_id)}
+    return {
+        "latestRelease": {"tagName": repo_tag(repo_id)} if kind == "release" else None,
+        "refs": {"nodes": [tag] if kind != "commit" else []},
+        "defaultBranchRef": {"target": {"oid": repo_sha(repo_id)}},
+    }
+
+
+@lru_cache(maxsize=256)
+def make_archive(repo_id: str, ref: str, n_files: int) -> bytes:
+    """tar.gz of a synthetic python package with tests, deterministic"""
+    root = f"{repo_id.replace('/', '-')}-{ref[:7]}"
+    files = {}
+    for i in range(n_files):
+        files[f"{root}/pkg/mod_{i}.py"] = "".join(
+            f"def func_{j}(x):\n    return x + {j}\n\n\n" for j in range(20)
+        )
+        files[f"{root}/tests/test_mod_{i}.py"] = f"from pkg.mod_{i} import *\n\n\n" + (
+            "".join(
+                f"def test_func_{j}():\n    assert func_{j}(0) == {j}\n\n\n"
+                for j in range(20)
+            )
+        )
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz", compresslevel=1) as tp:
+        for path, content in files.items():
+            data = content.encode()
+            info = tarfile.TarInfo(path)
+            info.size, info.mtime = len(data), 0
+            tp.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class StubServer(ThreadingHTTPServer):
+    """the stand-in server, counts the requests by endpoint in calls"""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], config: StubConfig):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.calls: Counter = Counter()
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        # (token, resource) -> (start of its window, requests in it)
+        self.usage: dict[tuple[str, str], tuple[float, int]] = {}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        host = host.decode() if isinstance(host, bytes) else host
+        return f"http://{host}:{port}"
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.config.failure_rate
+
+    def spend(self, token: str, resource: str, cost: int) -> dict[str, str]:
+        """count cost for token, return its rate limit headers"""
+        with self.lock:
+            now = time.time()
+            start, used = self.usage.get((token, resource), (now, 0))
+            if now >= start + self.config.rate_window:
+                start, used = now, 0
+            used += cost
+            self.usage[(token, resource)] = (start, used)
+        return {
+            "X-RateLimit-Limit": str(self.config.rate_limit),
+            "X-RateLimit-Remaining": str(max(0, self.config.rate_limit - used)),
+            "X-RateLimit-Reset": str(int(start + self.config.rate_window)),
+            "X-RateLimit-Used": str(used),
+            "X-RateLimit-Resource": resource,
+        }
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """answer one request of the GitHub API"""
+
+    server: StubServer
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    REPO_PATH = re.compile(r"^/repos/([^/]+/[^/]+)(/.*)?$")
+    ALIASED_REPO = re.compile(
+        r'(?:(\w+):\s*)?repository\(\s*(\w+):\s*"([^"]*)",\s*(\w+):\s*"([^"]*)"\s*\)'
+    )
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.debug(format, *args)
+
+    def send(
+        self,
+        status: int,
+        body: bytes = b"",
+        headers: Optional[dict[str, str]] = None,
+        content_type: str = "application/json",
+    ):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, headers: dict[str, str], status: int = 200):
+        body = json.dumps(data).encode()
+        etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            # like GitHub, not modified responses do not count in the rate limit
+            token = self.token()
+            headers = self.server.spend(token, headers["X-RateLimit-Resource"], -1)
+            self.send(304, headers=headers | {"ETag": etag})
+            return
+        self.send(status, body, headers | {"ETag": etag})
+
+    def token(self) -> str:
+        """token of the request, whatever its scheme ("token" or "bearer")"""
+        return self.headers.get("Authorization", "").split(" ")[-1]
+
+    def begin(self, endpoint: str, resource: str) -> Optional[dict[str, str]]:
+        """common part of all requests, the rate limit headers or None if answered"""
+        with self.server.lock:
+            self.server.calls[endpoint] += 1
+        config = self.server.config
+        if config.latency > 0:
+            time.sleep(config.latency)
+        if self.server.should_fail():
+            self.send(502, b'{"message": "Server Error"}')
+            return None
+        token = self.token()
+        headers = self.server.spend(token, resource, 1)
+        if int(headers["X-RateLimit-Used"]) > self.server.config.rate_limit:
+            self.send(403, b'{"message": "API rate limit exceeded"}', headers)
+            return None
+        return headers
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlsplit(self.path).path not in ("/graphql", "/api/graphql"):
+            self.send(404, b'{"message": "Not Found"}')
+            return
+        headers = self.begin("graphql", "graphql")
+        if headers is None:
+            return
+        query = json.loads(body)["query"]
+        data: dict = {}
+        errors = []
+        for alias, key1, value1, _, value2 in self.ALIASED_REPO.findall(query):
+            owner, name = (value1, value2) if key1 == "owner" else (value2, value1)
+            alias = alias or "repository"
+            if name.startswith("missing"):
+                data[alias] = None
+                errors.append({"type": "NOT_FOUND", "path": [alias]})
+            elif "latestRelease" in query:
+                data[alias] = repo_archive(f"{owner}/{name}")
+            else:
+                data[alias] = repo_metadata(f"{owner}/{name}")
+        if "rateLimit" in query:
+            data["rateLimit"] = {
+                "cost": 1,
+                "limit": int(headers["X-RateLimit-Limit"]),
+                "remaining": int(headers["X-RateLimit-Remaining"]),
+                "resetAt": time.strftime(
+                    "%Y-%m-%dT%H:%M:%SZ",
+                    time.gmtime(int(headers["X-RateLimit-Reset"])),
+                ),
+            }
+        response = {"data": data} | ({"errors": errors} if errors else {})
+        self.send(200, json.dumps(response).encode(), headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        match = self.REPO_PATH.match(path)
+        if match is None:
+            if path == "/rate_limit":
+                self.get_rate_limit()
+            else:
+                self.send(404, b'{"message": "Not Found"}')
+            return
+        repo_id, rest = match.group(1), match.group(2) or ""
+        endpoint = rest.split("/")[1] if rest else "repo"
+        headers = self.begin(endpoint, "core")
+        if headers is None:
+            return
+        if repo_id.split("/")[1].startswith("missing"):
+            self.send(404, b'{"message": "Not Found"}', headers)
+            return
+        base = f"http://{self.headers['Host']}"
+        repo_url = f"{base}/repos/{repo_id}"
+        kind, sha = repo_kind(repo_id), repo_sha(repo_id)
+        tag = repo_tag(repo_id)
+        commit = {"sha": sha, "url": f"{repo_url}/commits/{sha}"}
+        if not rest:
+            owner, name = repo_id.split("/")
+            self.send_json(
+                {
+                    "id": repo_digest(repo_id) % 10**9,
+                    "name": name,
+                    "full_name": repo_id,
+                    "owner": {"login": owner, "url": f"{base}/users/{owner}"},
+                    "url": repo_url,
+                },
+                headers,
+            )
+        elif rest == "/releases/latest":
+            if kind != "release":
+                self.send(404, b'{"message": "Not Found"}', headers)
+                return
+            self.send_json(
+                {
+                    "tag_name": tag,
+                    "url": f"{repo_url}/releases/1",
+                    "tarball_url": f"{repo_url}/tarball/{tag}",
+                },
+                headers,
+            )
+        elif rest == "/tags":
+            tags = [] if kind == "commit" else [{"name": tag, "commit": commit}]
+            for t in tags:
+                t["tarball_url"] = f"{repo_url}/tarball/{tag}"
+            self.send_json(tags, headers)
+        elif rest == "/commits":
+            self.send_json([commit], headers)
+        elif rest.startswith("/tarball/"):
+            self.get_tarball(repo_id, rest[len("/tarball/") :], headers)
+        else:
+            self.send(404, b'{"message": "Not Found"}', headers)
+
+    def get_tarball(self, repo_id: str, ref: str, headers: dict[str, str]):
+        data = make_archive(repo_id, ref, self.server.config.archive_files)
+        headers = headers | {"ETag": f'"{repo_sha(repo_id + ref)}"'}
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if match is None:
+            self.send(200, data, headers, "application/x-gzip")
+            return
+        start = int(match.group(1))
+        if start >= len(data):
+            self.send(416, headers=headers)
+            return
+        headers["Content-Range"] = f"bytes {start}-{len(data) - 1}/{len(data)}"
+        self.send(206, data[start:], headers, "application/x-gzip")
+
+    def get_rate_limit(self):
+        # free, but counted so that the requests of clients for it show up
+        with self.server.lock:
+            self.server.calls["rate_limit"] += 1
+        token = self.token()
+        headers = self.server.spend(token, "core", 0)
+        rate = {
+            "limit": int(headers["X-RateLimit-Limit"]),
+            "remaining": int(headers["X-RateLimit-Remaining"]),
+            "reset": int(headers["X-RateLimit-Reset"]),
+            "used": int(headers["X-RateLimit-Used"]),
+        }
+        resources = {resource: rate for resource in ("core", "graphql", "search")}
+        self.send_json({"resources": resources, "rate": rate}, headers)
+
+
+def main(
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    latency: float = 0.0,
+    failure_rate: float = 0.0,
+    rate_limit: int = 5000,
+    rate_window: int = 3600,
+    archive_files: int = 10,
+    seed: int = 0,
+):
+    """serve the stand-in until interrupted"""
+    config = StubConfig(
+        latency, failure_rate, rate_limit, rate_window, archive_files, seed
+    )
+    server = StubServer((host, port), config)
+    logging.info(f"Serving the GitHub stand-in at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info(f"Calls: {dict(server.calls)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    fire.Fire(main)
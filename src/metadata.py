@@ -0,0 +1,69 @@
+"""on-disk store of the metadata of repos passing check_repo_stats"""
+
+import os
+import json
+import sqlite3
+import dataclasses
+from typing import Iterable, Optional
+from src.common import RepoMetadata
+
+
+class MetadataStore:
+    """RepoMetadata keyed by repo_id in sqlite, one row (and write) per repo
+
+    Several processes can write to the same database file.
+    """
+
+    def __init__(self, path: str = "data/meta/metadata.db"):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS metadata (
+                repo_id TEXT PRIMARY KEY,
+                metadata TEXT NOT NULL
+            )""")
+        self.conn.commit()
+
+    def get(self, repo_id: str) -> Optional[RepoMetadata]:
+        row = self.conn.execute(
+            "SELECT metadata FROM metadata WHERE repo_id = ?", (repo_id,)
+        ).fetchone()
+        return RepoMetadata.from_dict(json.loads(row[0])) if row else None
+
+    def get_many(self, repo_ids: Iterable[str]) -> dict[str, RepoMetadata]:
+        """metadata of the repo_ids in the store"""
+        found: dict[str, RepoMetadata] = {}
+        repo_ids = list(repo_ids)
+        # stay below the limit of sqlite variables per statement
+        for i in range(0, len(repo_ids), 500):
+            batch = repo_ids[i : i + 500]
+            rows = self.conn.execute(
+                "SELECT repo_id, metadata FROM metadata WHERE repo_id IN "
+                + f"({', '.join('?' * len(batch))})",
+                batch,
+            )
+            for repo_id, metadata in rows:
+                found[repo_id] = RepoMetadata.from_dict(json.loads(metadata))
+        return found
+
+    def put(self, repo_id: str, metadata: RepoMetadata):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                (repo_id, json.dumps(dataclasses.asdict(metadata))),
+            )
+
+    def __contains__(self, repo_id: str) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM metadata WHERE repo_id = ?", (repo_id,)
+        ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        count: int = self.conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+        return count
+
+    def close(self):
+        self.conn.close()
@@ -1,96 +1,227 @@
 """util functions to navigate in python repo"""
 
+import io
+import os
 import ast
+from array import array
+from functools import cached_property, lru_cache
 from typing import Optional, Callable, List, Union
+from src.parsers import PARSERS
+from src.tracing import span
 
 
 class ModuleNavigator:
     """provide utils function using ast"""
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, source: Optional[str] = None, parser: str = "ast"):
+        """parser is the name of a backend in src.parsers.PARSERS"""
         self.path = path
-        with open(path, "r", errors="replace") as fp:
-            self.ast = ast.parse(fp.read())
-        self.nodes, self.parents = flatten(self.ast)
+        if source is None:
+            with span("read"):
+                source = read_source(path)
+        with span("parse"):
+            self.ast = PARSERS[parser](source)
+        with span("flatten"):
+            self.nodes, self.parents = flatten(self.ast)
 
     @staticmethod
-    def build(path: str):
+    def build(path: str, source: Optional[str] = None, parser: str = "ast"):
+        """None if the module fails to parse, a parser that cannot be loaded
+        is not a parse failure and raises src.parsers.ParserUnavailable
+        """
         try:
-            nav = ModuleNavigator(path)
+            nav = ModuleNavigator(path, source, parser)
             return nav
-        except SyntaxError:
+        except (SyntaxError, RecursionError):
             return None
 
-    def find_all(self, ntype: Union[type, Callable], root: Optional[ast.AST] = None):
+    @cached_property
+    def index(self) -> dict[int, int]:
+        """node identity -> pre-order index, computed on demand"""
+        return build_index(self.nodes)
+
+    @cached_property
+    def ends(self) -> array:
+        """the subtree of nodes[i] is nodes[i:ends[i]], computed on demand"""
+        return subtree_ends(self.parents)
+
+    @cached_property
+    def types(self) -> array:
+        """type codes of nodes, computed on demand"""
+        return node_types(self.nodes)
+
+    @cached_property
+    def qualnames(self) -> dict[str, ast.AST]:
+        """name of each class and function prefixed by the classes around it,
+        eg. "Cls::Inner::func" as in dump_ast_func -> the first node with it
+        """
+        names: dict[str, ast.AST] = {}
+        # innermost class of each node and the qualified names of classes
+        scope_cls = [-1] * len(self.nodes)
+        cls_names: dict[int, str] = {}
+        for idx, node in enumerate(self.nodes):
+            parent = self.parents[idx]
+            outer = scope_cls[parent] if parent >= 0 else -1
+            scope_cls[idx] = outer
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                name = node.name if outer < 0 else f"{cls_names[outer]}::{node.name}"
+                names.setdefault(name, node)
+                if isinstance(node, ast.ClassDef):
+                    scope_cls[idx], cls_names[idx] = idx, name
+        return names
+
+    def subtree(self, root: Optional[ast.AST] = None) -> list[ast.AST]:
+        """nodes under root in pre-order, sliced from the flattened module"""
         if root is None:
-            root, nodes = self.ast, self.nodes
-        else:
-            nodes = None
-        return find_all(root, ntype, nodes=nodes)
+            return self.nodes
+        idx = self.index.get(id(root))
+        if idx is None:  # not a node of this module
+            return flatten(root)[0]
+        return self.nodes[idx : self.ends[idx]]
 
-    def find_by_name(self, name: str, root: Optional[ast.AST] = None):
+    def subtree_span(self, root: Optional[ast.AST] = None) -> Optional[tuple[int, int]]:
+        """pre-order index range of the subtree at root, None if not in the module"""
         if root is None:
-            root, nodes = self.ast, self.nodes
-        else:
-            nodes = None
-        return find_by_name(root, name, nodes=nodes)
+            return 0, len(self.nodes)
+        idx = self.index.get(id(root))
+        if idx is None:
+            return None
+        return idx, self.ends[idx]
+
+    def find_all(self, ntype: Union[type, Callable], root: Optional[ast.AST] = None):
+        root = root if root is not None else self.ast
+        subtree_span = self.subtree_span(root)
+        if subtree_span is None or not isinstance(ntype, type):
+            return find_all(root, ntype, nodes=self.subtree(root))
+        # filter by type codes, no need to touch the node objects
+        # self.types registers the types of this module before type_codes
+        types, nodes = self.types, self.nodes
+        codes = type_codes(ntype)
+        return [nodes[i] for i in range(*subtree_span) if types[i] in codes]
+
+    def find_by_name(self, name: str, root: Optional[ast.AST] = None):
+        root = root if root is not None else self.ast
+        return find_by_name(root, name, nodes=self.subtree(root))
 
     def get_path_to(self, node: ast.AST):
-        return get_path_to(node, self.nodes, self.parents)
+        return get_path_to(node, self.nodes, self.parents, index=self.index)
 
     def postorder(self, root: Optional[ast.AST] = None):
-        nodes = []
-
-        def walk(n):
-            children: list[ast.AST] = []
-            for f in getattr(n, "_fields", []):
-                field = getattr(n, f, [])
-                if isinstance(field, (tuple, list)):
-                    children.extend(field)
-                else:
-                    children.append(field)
-            for child in children:
-                walk(child)
-            nodes.append(n)
-
-        walk(root if root is not None else self.ast)
-        return nodes
+        root = root if root is not None else self.ast
+        subtree_span = self.subtree_span(root)
+        if subtree_span is None:
+            nodes, parents = flatten(root)
+            return postorder(nodes, subtree_ends(parents))
+        return postorder(self.nodes, self.ends, *subtree_span)
 
     @property
     def total_lines(self) -> int:
-        line_numbers = {
-            node.lineno for node in ast.walk(self.ast) if hasattr(node, "lineno")
-        }
+        line_numbers = {node.lineno for node in self.nodes if hasattr(node, "lineno")}
         return len(line_numbers)
 
     def __str__(self):
         return ast.dump(self.ast)
 
 
-def flatten(root: ast.AST):
-    """flatten an ast pre-order"""
-    nodes: list[ast.AST] = []
-    parents: list[int] = []
+def read_source(path: str) -> str:
+    with open(path, "r", errors="replace") as fp:
+        return fp.read()
 
-    def walk(n, p=None):
+
+def decode_source(data: bytes) -> str:
+    """decode the content of a file the same way as read_source"""
+    with io.TextIOWrapper(io.BytesIO(data), errors="replace") as fp:
+        return fp.read()
+
+
+# type of ast nodes <-> int code in flattened arrays
+NODE_TYPES: list[type] = []
+_TYPE_CODES: dict[type, int] = {}
+
+
+def type_code(ntype: type) -> int:
+    code = _TYPE_CODES.get(ntype)
+    if code is None:
+        code = _TYPE_CODES[ntype] = len(NODE_TYPES)
+        NODE_TYPES.append(ntype)
+    return code
+
+
+def type_codes(ntype: type) -> set[int]:
+    """codes of all registered types that are subclasses of ntype"""
+    return {code for code, t in enumerate(NODE_TYPES) if issubclass(t, ntype)}
+
+
+def flatten(root: ast.AST) -> tuple[list[ast.AST], array]:
+    """flatten an ast pre-order with an explicit stack, values of fields that are
+    not ast nodes (names, constants, None) are left out
+
+    Returns: (nodes, parents),
+        parents is an int32 array, parents[i] is the index of the parent of nodes[i]
+        and -1 for root.
+    """
+    nodes: list[ast.AST] = []
+    parents = array("i")
+    # nodes to visit with the index of their parent
+    stack: list[tuple[ast.AST, int]] = [(root, -1)]
+    while stack:
+        node, parent = stack.pop()
         nidx = len(nodes)
-        nodes.append(n)
-        parents.append(p)
-        children: list[ast.AST] = []
-        for f in getattr(n, "_fields", []):
-            field = getattr(n, f, [])
-            if isinstance(field, (tuple, list)):
-                children.extend(field)
-            else:
-                children.append(field)
-        for child in children:
-            walk(child, nidx)
-
-    walk(root)
-    assert len(nodes) == len(parents)
+        nodes.append(node)
+        parents.append(parent)
+        # push children reversed so that they are popped in field order
+        for f in reversed(node._fields):
+            field = getattr(node, f, None)
+            if isinstance(field, list):
+                for child in reversed(field):
+                    if isinstance(child, ast.AST):
+                        stack.append((child, nidx))
+            elif isinstance(field, ast.AST):
+                stack.append((field, nidx))
     return nodes, parents
 
 
+def node_types(nodes: list[ast.AST]) -> array:
+    """int32 type codes of the flattened nodes, see type_code"""
+    types = list(map(type, nodes))
+    for ntype in set(types):
+        type_code(ntype)
+    return array("i", map(_TYPE_CODES.__getitem__, types))
+
+
+def postorder(nodes: list[ast.AST], ends, start: int = 0, stop: int = -1):
+    """post-order of the pre-order flattened nodes[start:stop]
+    where ends are the subtree ends (see subtree_ends)
+    """
+    stop = stop if stop >= 0 else len(nodes)
+    result: list[ast.AST] = []
+    opened: list[int] = []
+    for idx in range(start, stop):
+        while opened and ends[opened[-1]] <= idx:
+            result.append(nodes[opened.pop()])
+        opened.append(idx)
+    result.extend(nodes[idx] for idx in reversed(opened))
+    return result
+
+
+def build_index(nodes: list[ast.AST]) -> dict[int, int]:
+    """map the identity of each ast node to its first index in nodes"""
+    index: dict[int, int] = {}
+    for idx, node in enumerate(nodes):
+        index.setdefault(id(node), idx)
+    return index
+
+
+def subtree_ends(parents) -> array:
+    """end (exclusive) of each node's subtree in a pre-order flattened ast"""
+    ends = array("i", range(1, len(parents) + 1))
+    for idx in range(len(parents) - 1, 0, -1):
+        parent = parents[idx]
+        if ends[idx] > ends[parent]:
+            ends[parent] = ends[idx]
+    return ends
+
+
 def find_all(
     root: ast.AST,
     condition: Union[type, Callable],
@@ -119,16 +250,26 @@ def find_by_name(root: ast.AST, name: str, nodes: Optional[List[ast.AST]] = None
 def get_path_to(
     target: ast.AST,
     nodes: list[ast.AST],
-    parents: list[int],
+    parents,
+    index: Optional[dict[int, int]] = None,
 ):
+    """path from the root to target, None if target is not in nodes
+    parents[root] is -1 (see flatten),
+    index (see build_index) avoids a linear search for target
+    """
 
     # find the path to target bottom-up
-    try:
-        target_idx = nodes.index(target)
-    except ValueError:
-        return None
+    if index is not None:
+        if id(target) not in index:
+            return None
+        target_idx = index[id(target)]
+    else:
+        try:
+            target_idx = nodes.index(target)
+        except ValueError:
+            return None
     path = []
-    while target_idx is not None:
+    while target_idx >= 0:
         path.append(nodes[target_idx])
         target_idx = parents[target_idx]
     return path[::-1]
@@ -141,9 +282,11 @@ def dump_ast_func(
     ancestors: Optional[List[ast.AST]] = None,
     return_nav: Optional[bool] = False,
 ):
-    """converts an ast node of function into string"""
+    """converts an ast node of function into string
+    func is looked up in the navigator of load_ast_func if nav is not given
+    """
     if nav is None:
-        nav = ModuleNavigator(path)
+        nav = cached_navigator(path)
     if ancestors is None:
         ancestors = nav.get_path_to(func)
     classes = [n.name for n in ancestors if isinstance(n, ast.ClassDef)]
@@ -158,19 +301,61 @@ def load_ast_func(
     nav: Optional[ModuleNavigator] = None,
     return_nav: Optional[bool] = False,
 ):
-    """convert a string to an ast node of function"""
-    ancestors, node = func_id.split("::"), None
-    path = ancestors.pop(0)
+    """convert a string to an ast node of function
+    navigators are shared with load_ast_funcs, see cached_navigator
+    """
+    path, _, qualname = func_id.partition("::")
     if nav is None:
-        nav = ModuleNavigator(path)
-    while ancestors:
-        node_id = ancestors.pop(0)
-        node = nav.find_by_name(node_id, root=node)
+        nav = cached_navigator(path)
+    node = find_by_qualname(nav, qualname)
     if not return_nav:
         return node
     return node, nav
 
 
+def load_ast_funcs(func_ids: List[str]) -> List[Optional[ast.AST]]:
+    """load_ast_func for many func_ids, each file is parsed once
+    (as long as it stays in cached_navigator), None if the file failed to parse
+    """
+    by_path: dict[str, list[int]] = {}
+    for i, func_id in enumerate(func_ids):
+        by_path.setdefault(func_id.partition("::")[0], []).append(i)
+    nodes: List[Optional[ast.AST]] = [None] * len(func_ids)
+    for path, indices in by_path.items():
+        try:
+            nav = cached_navigator(path)
+        except (SyntaxError, RecursionError):
+            continue
+        for i in indices:
+            nodes[i] = find_by_qualname(nav, func_ids[i].partition("::")[2])
+    return nodes
+
+
+def cached_navigator(path: str) -> ModuleNavigator:
+    """ModuleNavigator of the recently used files, parsed again once modified"""
+    stat = os.stat(path)
+    return _cached_navigator(path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=8)
+def _cached_navigator(
+    path: str, mtime_ns: int, size: int  # pylint: disable=unused-argument
+) -> ModuleNavigator:
+    return ModuleNavigator(path)
+
+
+def find_by_qualname(nav: ModuleNavigator, qualname: str) -> Optional[ast.AST]:
+    """find a node by its qualified name (see ModuleNavigator.qualnames),
+    or by searching each "::" segment in the previous one if there is none
+    """
+    node = nav.qualnames.get(qualname)
+    if node is not None:
+        return node
+    for name in qualname.split("::") if qualname else []:
+        node = nav.find_by_name(name, root=node)
+    return node
+
+
 def is_assert(node: ast.AST):
     """tell if a node is an assertion"""
     if isinstance(node, ast.Assert):
@@ -0,0 +1,279 @@
+"""parser backends producing python ast for ModuleNavigator
+
++ "ast": the builtin ast.parse, the default
++ "tree_sitter": tree-sitter's error-tolerant C parser, converted to ast,
+    also works on python 2 files or syntax newer than the interpreter
++ "fallback": ast.parse, and tree-sitter for the files it fails on
+
+The tree-sitter conversion only keeps what the static analysis needs:
+function/class definitions with their names, parameters, decorators, bases and
+keywords, assertions, calls with their callee (names and attributes) and arguments,
+and line numbers.
+Any other syntax becomes a TSNode holding its children.
+"""
+
+import os
+import ast
+from typing import Any, Callable, Iterator, Optional
+from functools import lru_cache
+
+TREE_SITTER_LIB = os.environ.get("TREE_SITTER_LIB", "build/tree_sitter_python.so")
+TREE_SITTER_GRAMMAR = os.environ.get("TREE_SITTER_GRAMMAR", "vendor/tree-sitter-python")
+
+
+class TSNode(ast.AST):
+    """a tree-sitter node without an ast counterpart, kind is its node type"""
+
+    _fields = ("children",)
+    _attributes = ("lineno", "col_offset", "end_lineno", "end_col_offset")
+
+    def __init__(self, kind: str, children: list, **kwargs):
+        super().__init__(**kwargs)
+        self.kind = kind
+        self.children = children
+
+
+class ParserUnavailable(Exception):
+    """the tree-sitter python grammar cannot be loaded"""
+
+
+@lru_cache(maxsize=None)
+def tree_sitter_parser(lib: str = TREE_SITTER_LIB, grammar: str = TREE_SITTER_GRAMMAR):
+    """load (and build if needed) the python grammar for tree-sitter
+
+    The grammar is built from a checkout of
+    https://github.com/tree-sitter/tree-sitter-python (a release for tree-sitter 0.20)
+    Raises ParserUnavailable if tree-sitter is not installed or neither the library
+    nor the grammar can be loaded, see $TREE_SITTER_LIB and $TREE_SITTER_GRAMMAR.
+    """
+    try:
+        # pylint: disable-next=import-outside-toplevel
+        from tree_sitter import Language, Parser
+
+        if not os.path.exists(lib):
+            if not os.path.isdir(grammar):
+                raise FileNotFoundError(
+                    f"Neither tree-sitter library {lib} nor grammar {grammar} exists"
+                )
+            Language.build_library(lib, [grammar])
+        parser = Parser()
+        parser.set_language(Language(lib, "python"))
+    except (ImportError, OSError) as e:
+        raise ParserUnavailable(
+            f"Cannot load the tree-sitter python grammar: {e}"
+        ) from e
+    return parser
+
+
+def parse_ast(source: str) -> ast.Module:
+    return ast.parse(source)
+
+
+def parse_tree_sitter(source: str) -> ast.Module:
+    """parse with tree-sitter, never raises SyntaxError"""
+    data = source.encode("utf-8", "surrogatepass")
+    tree = tree_sitter_parser().parse(data)
+    module = to_ast(tree.root_node, data)
+    assert isinstance(module, ast.Module)
+    return module
+
+
+def parse_fallback(source: str) -> ast.Module:
+    try:
+        return parse_ast(source)
+    except (SyntaxError, ValueError):
+        return parse_tree_sitter(source)
+
+
+PARSERS: dict[str, Callable[[str], ast.Module]] = {
+    "ast": parse_ast,
+    "tree_sitter": parse_tree_sitter,
+    "fallback": parse_fallback,
+}
+
+# parsed as a single node, eg. lines inside a multi-line string do not count
+_LEAF_TYPES = {"string", "concatenated_string", "integer", "float"}
+_SKIPPED_TYPES = {"comment"}
+
+
+def to_ast(root, data: bytes) -> ast.AST:
+    """convert a tree-sitter tree to ast, iteratively in post-order"""
+    # frames of (node, its remaining named children, converted children)
+    stack: list[tuple[Any, Iterator, list]] = [(root, iter(root.named_children), [])]
+    while True:
+        node, children, converted = stack[-1]
+        child = next(children, None)
+        if child is not None:
+            if child.type in _SKIPPED_TYPES:
+                continue
+            if child.type in _LEAF_TYPES:
+                converted.append(_located(TSNode(child.type, []), child))
+                continue
+            stack.append((child, iter(child.named_children), []))
+            continue
+        stack.pop()
+        result = _convert(node, converted, data)
+        if not hasattr(result, "lineno"):  # decorated definitions keep their own
+            _located(result, node)
+        if not stack:
+            return result
+        stack[-1][2].append(result)
+
+
+def _located(result: ast.AST, node) -> ast.AST:
+    if "lineno" in result._attributes:
+        result.lineno, result.col_offset = node.start_point[0] + 1, node.start_point[1]
+        result.end_lineno = node.end_point[0] + 1
+        result.end_col_offset = node.end_point[1]
+    return result
+
+
+def _body(block: Optional[ast.AST]) -> list:
+    """statements of a converted block"""
+    if isinstance(block, TSNode) and block.kind == "block":
+        return block.children
+    return [block] if block is not None else []
+
+
+def _name(node: Optional[ast.AST]) -> str:
+    return node.id if isinstance(node, ast.Name) else ""
+
+
+def _convert(node, children: list, data: bytes) -> ast.AST:
+    """convert a tree-sitter node given its converted (named) children"""
+    kind = node.type
+    if kind == "module":
+        return ast.Module(body=children, type_ignores=[])
+    if kind == "identifier":
+        return ast.Name(
+            id=data[node.start_byte : node.end_byte].decode(errors="replace"),
+            ctx=ast.Load(),
+        )
+    if kind == "attribute" and len(children) >= 2:
+        return ast.Attribute(
+            value=children[0], attr=_name(children[-1]), ctx=ast.Load()
+        )
+    if kind == "call" and children:
+        # callee, argument list (or a single generator expression)
+        arguments = children[1:]
+        if len(arguments) == 1 and _is_kind(arguments[0], "argument_list"):
+            arguments = arguments[0].children
+        args, keywords = _call_arguments(arguments)
+        return ast.Call(func=children[0], args=args, keywords=keywords)
+    if kind == "assert_statement":
+        return ast.Assert(
+            test=children[0] if children else TSNode("expression", []),
+            msg=children[1] if len(children) > 1 else None,
+        )
+    if kind == "function_definition" and children:
+        # name, parameters, [return type], body
+        is_async = node.children[0].type == "async"
+        func_type = ast.AsyncFunctionDef if is_async else ast.FunctionDef
+        params = [c for c in children[1:-1] if _is_kind(c, "parameters")]
+        returns = [c for c in children[1:-1] if _is_kind(c, "type")]
+        return func_type(
+            name=_name(children[0]),
+            args=_arguments(params[0].children if params else []),
+            body=_body(children[-1]) if len(children) > 1 else [],
+            decorator_list=[],
+            returns=returns[0] if returns else None,
+            type_comment=None,
+        )
+    if kind == "class_definition" and children:
+        # name, [superclasses], body
+        superclasses = children[1].children if len(children) > 2 else []
+        bases, keywords = _call_arguments(superclasses)
+        return ast.ClassDef(
+            name=_name(children[0]),
+            bases=bases,
+            keywords=keywords,
+            body=_body(children[-1]) if len(children) > 1 else [],
+            decorator_list=[],
+        )
+    if kind == "decorator" and children:
+        expr: ast.AST = children[0]
+        return expr
+    if kind == "decorated_definition" and children:
+        definition = children[-1]
+        if isinstance(
+            definition, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+        ):
+            definition.decorator_list = children[:-1]
+            return definition
+    return TSNode(kind, children)
+
+
+def _is_kind(node: ast.AST, kind: str) -> bool:
+    return isinstance(node, TSNode) and node.kind == kind
+
+
+def _call_arguments(children: list) -> tuple[list, list[ast.keyword]]:
+    """positional and keyword arguments of the converted arguments of a call"""
+    args: list = []
+    keywords: list[ast.keyword] = []
+    for child in children:
+        if _is_kind(child, "keyword_argument") and len(child.children) == 2:
+            name, value = child.children
+            keyword = ast.keyword(arg=_name(name) or None, value=value)
+            keywords.append(ast.copy_location(keyword, child))
+        elif _is_kind(child, "dictionary_splat") and len(child.children) == 1:
+            keyword = ast.keyword(arg=None, value=child.children[0])
+            keywords.append(ast.copy_location(keyword, child))
+        else:
+            args.append(child)
+    return args, keywords
+
+
+# converted parameter -> (parameter, [annotation], [default]) by kind
+_PARAMETER_PARTS = {
+    "typed_parameter": ("parameter", "annotation"),
+    "default_parameter": ("parameter", "default"),
+    "typed_default_parameter": ("parameter", "annotation", "default"),
+}
+
+
+def _arguments(params: list) -> ast.arguments:
+    """ast arguments of the converted children of a parameters node"""
+    arguments = ast.arguments(
+        posonlyargs=[],
+        args=[],
+        vararg=None,
+        kwonlyargs=[],
+        kw_defaults=[],
+        kwarg=None,
+        defaults=[],
+    )
+    keyword_only = False
+    for param in params:
+        if _is_kind(param, "positional_separator"):  # /
+            arguments.posonlyargs, arguments.args = arguments.args, []
+            continue
+        if _is_kind(param, "keyword_separator"):  # bare *
+            keyword_only = True
+            continue
+        parts: dict = {"parameter": param}
+        kind = param.kind if isinstance(param, TSNode) else ""
+        if kind in _PARAMETER_PARTS and len(param.children) == len(
+            _PARAMETER_PARTS[kind]
+        ):
+            parts = dict(zip(_PARAMETER_PARTS[kind], param.children))
+        name = parts["parameter"]
+        splat = name.kind if isinstance(name, TSNode) else ""
+        if splat in ("list_splat_pattern", "dictionary_splat_pattern"):
+            name = name.children[0] if name.children else None
+        arg = ast.arg(arg=_name(name), annotation=parts.get("annotation"))
+        if name is not None:
+            ast.copy_location(arg, name)
+        if splat == "list_splat_pattern":
+            arguments.vararg = arg
+            keyword_only = True
+        elif splat == "dictionary_splat_pattern":
+            arguments.kwarg = arg
+        elif keyword_only:
+            arguments.kwonlyargs.append(arg)
+            arguments.kw_defaults.append(parts.get("default"))
+        else:
+            arguments.args.append(arg)
+            if "default" in parts:
+                arguments.defaults.append(parts["default"])
+    return arguments
@@ -1,20 +1,30 @@
 """Script to collect dataset wit static analysis"""
 
 import os
+import sys
 import fire
 from tqdm import tqdm
 import json
 import logging
 import ast
-from src.common import wrap_repo
-from src.navigate import ModuleNavigator
-from funcy import group_by, lmap, lfilter
+from src.common import LimitedWorker, TimeoutException, wrap_repo
+from src.navigate import ModuleNavigator, read_source, decode_source
+from src.parsers import ParserUnavailable, tree_sitter_parser
+from src.cache import content_hash, open_cache
+from src.tracing import span, traced
+from funcy import lchunks
 from pathlib import Path
 from funcy_chain import Chain
 import csv
-from functools import reduce
+import tarfile
+from typing import Iterator, Optional
+from functools import lru_cache
+from itertools import groupby
+from dataclasses import dataclass, asdict, fields
+from pathos.multiprocessing import ProcessPool
 
 
+@traced("walk")
 def collect_py_files(root: str) -> list[str]:
     py_files: list[str] = []
     for parent, _, files in os.walk(root):
@@ -24,87 +34,148 @@ def collect_py_files(root: str) -> list[str]:
     return py_files
 
 
-def collect_funcs(
-    nav: ModuleNavigator,
-) -> dict[bool, list[ast.FunctionDef]]:
-    """collect testing functions from the target file"""
+def is_test_cls(node: ast.ClassDef) -> bool:
+    """a class may be a test class if
+    1.1 class name starts with Test
+    1.2 inherit from unittest.TestCase
+    it is a test class only if it also has no init function, see collect_funcs
+    """
+    test_prefix = node.name.startswith("Test")
+    inherit_unittest_attr = any(
+        isinstance(base, ast.Attribute) and base.attr == "TestCase"
+        for base in node.bases
+    )
+    inherit_unittest_name = any(
+        isinstance(base, ast.Name) and base.id == "TestCase" for base in node.bases
+    )
+    return any([test_prefix, inherit_unittest_name, inherit_unittest_attr])
 
-    def is_test_cls(node: ast.AST):
-        """is a test class if
-        1.1 class name starts with Test
-        1.2 inherit from unittest.TestCase
-        2. a static class without a init function
-        """
-        if not isinstance(node, ast.ClassDef):
-            return False
-        # if not node.name.startswith('Test'): return False
-        test_prefix = node.name.startswith("Test")
-        inherit_unittest_attr = any(
-            isinstance(base, ast.Attribute) and base.attr == "TestCase"
-            for base in node.bases
-        )
-        inherit_unittest_name = any(
-            isinstance(base, ast.Name) and base.id == "TestCase" for base in node.bases
-        )
-        if not any([test_prefix, inherit_unittest_name, inherit_unittest_attr]):
-            return False
-        cls_funcs = nav.find_all(ast.FunctionDef, root=node)
-        return not any(func.name == "__init__" for func in cls_funcs)
-
-    def has_assert(func: ast.AST):
-        # builtin assertion
-        if len(nav.find_all(ast.Assert, root=func)) > 0:
-            return True
-        # Testcase in unittest, eg. self.assertEqual
-        for call in nav.find_all(ast.Call, root=func):
-            if isinstance(call.func, ast.Attribute) and call.func.attr.startswith(
-                "assert"
-            ):
-                return True
-        return False
 
-    def is_test_outside_cls(func: ast.FunctionDef):
-        """decide if the function is a testing function outside a class
-        return true if its name starts with "test"
-        """
-        return func.name.startswith("test")
+def is_test_assert(node: ast.AST) -> bool:
+    """builtin assertion or Testcase assertion in unittest, eg. self.assertEqual"""
+    if isinstance(node, ast.Assert):
+        return True
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and node.func.attr.startswith("assert")
+    )
 
-    def is_test_inside_cls(func: ast.FunctionDef, path: list[ast.AST]):
-        """decide if the function is a testing function inside a class
-        return true if its class is prefixed by "Test" and either
-        + it is prefixed by "test"
-        + it is decorated with @staticmethod and @classmethods
-        """
-        # keep only the node in path whose name is prefixed by "Test"
-        cls_path = [n for n in path if is_test_cls(n)]
-        if len(cls_path) == 0:
-            return False
-        if func.name.startswith("test"):
-            return True
-        decorators = getattr(func, "decorator_list", [])
-        return any(
-            isinstance(d, ast.Name) and d.id in ("staticmethod", "classmethods")
-            for d in decorators
-        )
 
-    def _is_test_fn(func: ast.FunctionDef):
-        path = nav.get_path_to(func)
-        is_cls = [isinstance(n, ast.ClassDef) for n in path]
-        is_test = False
-        is_test |= any(is_cls) and is_test_inside_cls(func, path)
-        is_test |= not any(is_cls) and is_test_outside_cls(func)
-        is_test &= has_assert(func)
-        return is_test
+@dataclass
+class ModuleScan:
+    """metrics of a module collected by scan_module"""
+
+    # testing functions (True) and other functions (False)
+    funcs: dict[bool, list[ast.FunctionDef]]
+    # testing functions that are property-based, see is_property_based
+    property_based: list[ast.FunctionDef]
+    line_numbers: set[int]
+
+
+def scan_module(nav: ModuleNavigator) -> ModuleScan:
+    """collect testing functions and other metrics from the target file
+
+    A function is a test if it contains an assertion and either
+    + it is outside any class and its name starts with "test"
+    + some class around it is a test class (is_test_cls without __init__),
+      and it is prefixed by "test" or decorated with @staticmethod/@classmethods
 
-    funcs: list[ast.FunctionDef] = nav.find_all(ast.FunctionDef)
-    d: dict[bool, list[ast.FunctionDef]] = group_by(_is_test_fn, funcs)
-    return d
+    All functions are classified in a single pass over the flattened module,
+    tracking the innermost function and class around each node.
+    """
+    nodes, parents = nav.nodes, nav.parents
+    # index of the innermost FunctionDef/ClassDef containing a node, -1 if none
+    scope_func = [-1] * len(nodes)
+    scope_cls = [-1] * len(nodes)
+    funcs: dict[int, ast.FunctionDef] = {}
+    classes: dict[int, ast.ClassDef] = {}
+    has_assert: set[int] = set()
+    has_given: set[int] = set()
+    has_init: set[int] = set()
+    line_numbers: set[int] = set()
 
+    for idx, node in enumerate(nodes):
+        parent = parents[idx]
+        if parent >= 0:
+            scope_func[idx], scope_cls[idx] = scope_func[parent], scope_cls[parent]
+        lineno = getattr(node, "lineno", None)
+        if lineno is not None:
+            line_numbers.add(lineno)
+        if isinstance(node, ast.FunctionDef):
+            if node.name == "__init__" and scope_cls[idx] >= 0:
+                has_init.add(scope_cls[idx])
+            if any(map(is_given_decorator, node.decorator_list)):
+                has_given.add(idx)
+            scope_func[idx] = idx
+            funcs[idx] = node
+        elif isinstance(node, ast.ClassDef):
+            scope_cls[idx] = idx
+            classes[idx] = node
+        elif scope_func[idx] >= 0 and is_test_assert(node):
+            has_assert.add(scope_func[idx])
 
-def merge_dict(
-    d1: dict[bool, list[ast.AST]], d2: dict[bool, list[ast.AST]]
-) -> dict[bool, list[ast.AST]]:
-    return {True: d1[True] + d2[True], False: d1[False] + d2[False]}
+    # an assertion, @given or __init__ also counts for the outer functions or classes,
+    # children come after their parents in pre-order so propagate in reverse
+    for idx in reversed(funcs):
+        outer = scope_func[parents[idx]]
+        if outer >= 0:
+            if idx in has_assert:
+                has_assert.add(outer)
+            if idx in has_given:
+                has_given.add(outer)
+    for idx in reversed(classes):
+        outer = scope_cls[parents[idx]]
+        if idx in has_init and outer >= 0:
+            has_init.add(outer)
+
+    # whether a class or any class around it is a test class
+    in_test_cls: dict[int, bool] = {}
+    for idx, cls in classes.items():
+        outer = scope_cls[parents[idx]]
+        in_test_cls[idx] = (
+            is_test_cls(cls) and idx not in has_init
+        ) or in_test_cls.get(outer, False)
+
+    d: dict[bool, list[ast.FunctionDef]] = {True: [], False: []}
+    property_based: list[ast.FunctionDef] = []
+    for idx, func in funcs.items():
+        outer_cls = scope_cls[idx]
+        if outer_cls < 0:
+            is_test = func.name.startswith("test")
+        else:
+            decorators = getattr(func, "decorator_list", [])
+            is_test = in_test_cls[outer_cls] and (
+                func.name.startswith("test")
+                or any(
+                    isinstance(dec, ast.Name)
+                    and dec.id in ("staticmethod", "classmethods")
+                    for dec in decorators
+                )
+            )
+        is_test = is_test and idx in has_assert
+        d[is_test].append(func)
+        if is_test and idx in has_given:
+            property_based.append(func)
+    return ModuleScan(funcs=d, property_based=property_based, line_numbers=line_numbers)
+
+
+def collect_funcs(
+    nav: ModuleNavigator,
+) -> dict[bool, list[ast.FunctionDef]]:
+    """collect testing functions from the target file, see scan_module"""
+    return scan_module(nav).funcs
+
+
+def is_given_decorator(decorator: ast.expr) -> bool:
+    """tell if a decorator is a call to hypothesis' given"""
+    if not isinstance(decorator, ast.Call):
+        return False
+    return (  # @given is an ast.Name
+        isinstance(decorator.func, ast.Name) and decorator.func.id == "given"
+    ) or (  # @given() is an ast.Attribute
+        isinstance(decorator.func, ast.Attribute) and decorator.func.attr == "given"
+    )
 
 
 def is_property_based(func: ast.FunctionDef) -> bool:
@@ -115,18 +186,8 @@ def is_property_based(func: ast.FunctionDef) -> bool:
 
         def visit_FunctionDef(self, node):
             if not self.found_given_decorator:
-                for decorator in node.decorator_list:
-                    # Check if the decorator is a call to 'given'
-                    if isinstance(decorator, ast.Call):
-                        if (  # @given is an ast.Name
-                            isinstance(decorator.func, ast.Name)
-                            and decorator.func.id == "given"
-                        ) or (  # @given() is an ast.Attribute
-                            isinstance(decorator.func, ast.Attribute)
-                            and decorator.func.attr == "given"
-                        ):
-                            self.found_given_decorator = True
-                            break
+                if any(map(is_given_decorator, node.decorator_list)):
+                    self.found_given_decorator = True
             self.generic_visit(node)
 
     finder = HypothesisGivenDecoratorFinder()
@@ -134,41 +195,390 @@ def is_property_based(func: ast.FunctionDef) -> bool:
     return finder.found_given_decorator
 
 
+@dataclass
+class FileStats:
+    """static metrics of python files, summed up for a repo"""
+
+    files: int = 0
+    # files skipped: failed to parse, over max_file_size,
+    # over file_timeout or memory_limit (see AnalysisConfig),
+    # plus one for an archive that failed to read to the end
+    failed: int = 0
+    too_large: int = 0
+    timed_out: int = 0
+    out_of_memory: int = 0
+    lines: int = 0
+    funcs: int = 0
+    unit: int = 0
+    property_based: int = 0
+
+    def __add__(self, other: "FileStats") -> "FileStats":
+        return FileStats(
+            **{
+                f.name: getattr(self, f.name) + getattr(other, f.name)
+                for f in fields(self)
+            }
+        )
+
+
+# bump it whenever the metrics of a file change, to invalidate the cache
+ANALYZER_VERSION = "1"
+
+
+@dataclass(frozen=True)
+class AnalysisConfig:
+    """how files are analyzed, sent along with each task to the workers"""
+
+    # sqlite file caching the results of each file, see AnalysisCache
+    cache_path: Optional[str] = None
+    # parser backend, see src.parsers.PARSERS
+    parser: str = "ast"
+    # paths are .tar.gz archives of repos, analyzed without extraction
+    archives: bool = False
+    # files larger than max_file_size bytes are skipped
+    max_file_size: int = -1
+    # files are parsed in a worker process (see parse_worker) if any is set,
+    # with file_timeout seconds of CPU time per file and memory_limit MB of memory
+    file_timeout: float = -1
+    memory_limit: int = -1
+
+    @property
+    def version(self) -> str:
+        """cached results are only valid for the same version,
+        and the same limits since a file analyzed under some could fail under others
+        """
+        limits = f"{self.max_file_size}-{self.file_timeout}-{self.memory_limit}"
+        return f"{ANALYZER_VERSION}-{self.parser}-{limits}"
+
+
+def analyze_file(path: str, config: AnalysisConfig = AnalysisConfig()) -> FileStats:
+    """collect the metrics of a single python file
+    a file failed to parse only counts in #files and #failed
+
+    Results are looked up by the hash of the file content in the cache if configured,
+    files over max_file_size are skipped before being read.
+    """
+    skipped = skip_large(path, os.path.getsize(path), config)
+    if skipped is not None:
+        return skipped
+    if config.cache_path is None:
+        return analyze_limited(path, None, config)
+    return analyze_cached(path, read_source(path), config)
+
+
+def analyze_archive(path: str, config: AnalysisConfig = AnalysisConfig()) -> FileStats:
+    """collect the metrics of the python files in a .tar.gz archive,
+    streaming them from the archive without extracting anything
+    """
+    stats = FileStats()
+    if not os.path.exists(path):
+        return stats
+    try:
+        with tarfile.open(path, "r|gz") as tp:
+            for member in tp:
+                if not (member.isfile() and member.name.endswith(".py")):
+                    continue
+                skipped = skip_large(member.name, member.size, config)
+                if skipped is not None:
+                    stats += skipped
+                    continue
+                fp = tp.extractfile(member)
+                assert fp is not None
+                source = decode_source(fp.read())
+                if config.cache_path is None:
+                    stats += analyze_limited(member.name, source, config)
+                else:  # cached entries are kept as long as the archive exists
+                    stats += analyze_cached(path, source, config)
+    except (tarfile.TarError, EOFError, OSError) as e:
+        # the files read so far are kept, the failure shows in the counts
+        logging.warning(f"Failed to read {path}: {e}")
+        stats += FileStats(failed=1)
+    return stats
+
+
+def analyze_cached(path: str, source: str, config: AnalysisConfig) -> FileStats:
+    """analyze_source with the results cached by content, path is the file
+    whose existence keeps the entry in cache
+    """
+    assert config.cache_path is not None
+    cache = open_cache(config.cache_path, config.version)
+    digest = content_hash(source)
+    cached = cache.get(digest)
+    if cached is not None:
+        return FileStats(**cached)
+    stats = analyze_limited(path, source, config)
+    # timed out files may not be next time, they are tried again on later runs
+    if not (stats.timed_out or stats.out_of_memory):
+        cache.put(digest, path, asdict(stats))
+    return stats
+
+
+def parse_worker(parser: str, file_timeout: float, memory_limit: int) -> LimitedWorker:
+    """one worker process running analyze_source per process, see LimitedWorker"""
+    return _parse_worker(parser, file_timeout, memory_limit, os.getpid())
+
+
+@lru_cache(maxsize=None)
+def _parse_worker(
+    parser: str,
+    file_timeout: float,
+    memory_limit: int,
+    pid: int,  # pylint: disable=unused-argument
+) -> LimitedWorker:
+    return LimitedWorker(analyze_source, file_timeout, memory_limit)
+
+
+def skip_large(path: str, size: int, config: AnalysisConfig) -> Optional[FileStats]:
+    """stats of a file skipped for its size in bytes, None if it is not too large"""
+    if 0 <= config.max_file_size < size:
+        logging.warning(f"Skipped {path}: {size} bytes")
+        return FileStats(files=1, too_large=1)
+    return None
+
+
+def analyze_limited(
+    path: str, source: Optional[str], config: AnalysisConfig
+) -> FileStats:
+    """analyze_source within the time and memory limits of config,
+    a skipped file counts in #files and the reason it was skipped
+    """
+    if config.file_timeout <= 0 and config.memory_limit <= 0:
+        return analyze_source(path, source, config.parser)
+    worker = parse_worker(config.parser, config.file_timeout, config.memory_limit)
+    try:
+        # the parse spans are recorded by the worker process
+        with span("wait_worker"):
+            stats: FileStats = worker(path, source, config.parser)
+        return stats
+    except TimeoutException:
+        logging.warning(f"Skipped {path}: over {config.file_timeout}s")
+        return FileStats(files=1, timed_out=1)
+    except MemoryError:
+        logging.warning(f"Skipped {path}: over {config.memory_limit} MB")
+        return FileStats(files=1, out_of_memory=1)
+    except RuntimeError as e:  # the worker crashed, eg. a stack overflow
+        logging.warning(f"Skipped {path}: {e}")
+        return FileStats(files=1, failed=1)
+
+
+def analyze_source(
+    path: str, source: Optional[str] = None, parser: str = "ast"
+) -> FileStats:
+    nav = ModuleNavigator.build(path, source, parser)
+    if nav is None:
+        return FileStats(files=1, failed=1)
+    # only the counts are kept, the tree is dropped once the file is done
+    with span("classify"):
+        scan = scan_module(nav)
+    tests = scan.funcs[True]
+    n_property_based = len(scan.property_based)
+    return FileStats(
+        files=1,
+        lines=len(scan.line_numbers),
+        funcs=len(scan.funcs[False]),
+        unit=len(tests) - n_property_based,
+        property_based=n_property_based,
+    )
+
+
+def analyze_chunk(task: tuple[int, list[str], AnalysisConfig]) -> tuple[int, FileStats]:
+    """analyze a chunk of files from the repo_idx-th repo, runs in pool workers"""
+    repo_idx, paths, config = task
+    analyze = analyze_archive if config.archives else analyze_file
+    with span("analyze_chunk", repo=repo_idx, files=len(paths)):
+        stats = sum((analyze(path, config) for path in paths), FileStats())
+    if config.cache_path is not None:
+        open_cache(config.cache_path, config.version).flush()
+    return repo_idx, stats
+
+
+CSV_FIELDS = [
+    "repo_id",
+    "#files",
+    "#lines",
+    "#funcs",
+    "#unit",
+    "#property_based",
+    "#fuzz_target",
+    "#failed",
+    "#too_large",
+    "#timed_out",
+    "#out_of_memory",
+]
+
+
+def to_csv_row(repo: dict, stats: FileStats) -> dict:
+    return {
+        "repo_id": repo["repo_id"],
+        "#files": stats.files,
+        "#lines": stats.lines,
+        "#funcs": stats.funcs,
+        "#unit": stats.unit,
+        "#property_based": stats.property_based,
+        "#fuzz_target": repo["#fuzz_target"],
+        "#failed": stats.failed,
+        "#too_large": stats.too_large,
+        "#timed_out": stats.timed_out,
+        "#out_of_memory": stats.out_of_memory,
+    }
+
+
+def analyze_repos(
+    repo_list: list[dict],
+    root: str,
+    workers: int = 1,
+    chunk_size: int = 64,
+    cache_path: Optional[str] = None,
+    parser: str = "ast",
+    archives: bool = False,
+    max_file_size: int = -1,
+    file_timeout: float = -1,
+    memory_limit: int = -1,
+) -> Iterator[dict]:
+    """yield a csv row for each repo, in the order of repo_list
+
+    Files of each repo are split into chunks of at most chunk_size,
+    so that small repos are a single task and huge repos spread over the pool.
+    Results of unchanged files are reused from cache_path (see AnalysisCache).
+    With archives, each repo is read from its downloaded <repo>.tar.gz in one task.
+    Files over the limits are skipped and counted, see AnalysisConfig.
+    """
+    config = AnalysisConfig(
+        cache_path, parser, archives, max_file_size, file_timeout, memory_limit
+    )
+
+    def tasks():
+        for repo_idx, repo in enumerate(repo_list):
+            repo_root = os.path.join(root, wrap_repo(repo["repo_id"]))
+            if archives:
+                yield repo_idx, [repo_root + ".tar.gz"], config
+                continue
+            all_files = collect_py_files(repo_root)
+            # an empty repo still needs one task to get its row
+            for chunk in lchunks(chunk_size, all_files) or [[]]:
+                yield repo_idx, chunk, config
+
+    pool: Optional[ProcessPool] = None
+    if workers > 1:
+        pool = ProcessPool(nodes=workers)
+        results = pool.imap(analyze_chunk, tasks())
+    else:
+        results = map(analyze_chunk, tasks())
+
+    done = False
+    try:
+        for repo_idx, chunk_results in groupby(results, key=lambda r: r[0]):
+            stats = sum((s for _, s in chunk_results), FileStats())
+            yield to_csv_row(repo_list[repo_idx], stats)
+        done = True
+    finally:
+        if pool is not None:
+            # stopped early (error, interrupt or close), drop the queued tasks
+            if not done:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+            pool.clear()
+
+
 def main(
     input_repo_list_path: str = "data/meta/oss_fuzz_python_filtered.jsonl",
     root: str = "data/repos/",
     output_csv_file: str = "output.csv",
+    workers: Optional[int] = None,
+    chunk_size: int = 64,
+    cache: Optional[str] = "data/static_cache.db",
+    cache_size: int = 1_000_000,
+    resume: bool = False,
+    parser: str = "ast",
+    archives: bool = False,
+    max_file_size: int = 10 << 20,
+    file_timeout: float = 60,
+    memory_limit: int = 4096,
 ):
+    """collect static metrics of repos into a csv file
+
+    Args:
+        workers (int, optional): number of processes to analyze files.
+            Defaults to $CORES (see env.sh), 1 runs serially.
+        chunk_size (int): max number of files per task sent to a worker.
+        cache (str, optional): sqlite file caching the results of each file,
+            None to analyze all files from scratch.
+        cache_size (int): max number of files kept in the cache.
+        resume (bool): append to output_csv_file and skip the repos already in it.
+        parser (str): "ast", "tree_sitter" or "fallback" (tree-sitter for files
+            ast fails to parse), see src/parsers.py.
+        archives (bool): read the python files from the downloaded <repo>.tar.gz
+            under root instead of the extracted directories.
+        max_file_size (int): files larger than this many bytes are skipped.
+        file_timeout (float): seconds of CPU time to analyze a file before it is skipped.
+        memory_limit (int): MB of memory to analyze a file before it is skipped.
+            Files are analyzed in separate processes if file_timeout or memory_limit
+            is positive, -1 disables both.
+    """
+    if workers is None:
+        workers = int(os.environ.get("CORES", 1))
+    if parser != "ast":
+        # fail before any work rather than in the middle of the repos
+        try:
+            tree_sitter_parser()
+        except ParserUnavailable as e:
+            logging.error(f"Parser {parser} is unavailable: {e}")
+            sys.exit(1)
     with open(input_repo_list_path, "r") as fp:
         repo_list = Chain(fp.read().splitlines()).map(json.loads).value
 
+    append = resume and os.path.exists(output_csv_file)
+    if append:
+        done = load_done_repos(output_csv_file)
+        repo_list = [r for r in repo_list if r["repo_id"] not in done]
+        logging.info(f"Resume: skip {len(done)} repos in {output_csv_file}")
+
     root = os.path.abspath(root)
-    rows = []
-    for repo in tqdm(repo_list):
-        repo_id = repo["repo_id"]
-        repo_root = os.path.join(root, wrap_repo(repo_id))
-        all_files = collect_py_files(repo_root)
-        navs = lfilter(None, lmap(ModuleNavigator.build, all_files))
-        func_ds = lmap(collect_funcs, navs)
-        func_dict = reduce(merge_dict, func_ds)
-
-        n_tests = len(func_dict[True])
-        n_property_based = len(lfilter(is_property_based, func_dict[True]))
-        csv_row = {
-            "repo_id": repo_id,
-            "#files": len(all_files),
-            "#lines": sum(m.total_lines for m in navs),
-            "#funcs": len(func_dict[False]),
-            "#unit": n_tests - n_property_based,
-            "#property_based": n_property_based,
-            "#fuzz_target": repo["#fuzz_target"],
-        }
-        rows.append(csv_row)
-
-    with open(output_csv_file, "w") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=rows[0].keys())
-        writer.writeheader()
-        writer.writerows(rows)
+    # rows are written as soon as a repo is done, so a crash keeps finished repos
+    with open(output_csv_file, "a" if append else "w") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=CSV_FIELDS)
+        if csvfile.tell() == 0:
+            writer.writeheader()
+        for row in tqdm(
+            analyze_repos(
+                repo_list,
+                root,
+                workers,
+                chunk_size,
+                cache,
+                parser,
+                archives,
+                max_file_size,
+                file_timeout,
+                memory_limit,
+            ),
+            total=len(repo_list),
+        ):
+            with span("write_csv"):
+                writer.writerow(row)
+                csvfile.flush()
+
+    if cache is not None:
+        version = AnalysisConfig(
+            cache, parser, archives, max_file_size, file_timeout, memory_limit
+        ).version
+        n_evicted = open_cache(cache, version).prune(cache_size)
+        logging.info(f"Evicted {n_evicted} entries from {cache}")
+
+
+def load_done_repos(csv_path: str) -> set[str]:
+    """repo_ids already written to csv_path, a partially written last row is truncated"""
+    with open(csv_path, "r+", newline="") as csvfile:
+        content = csvfile.read()
+        if content and not content.endswith("\n"):
+            content = content[: content.rfind("\n") + 1]
+            csvfile.seek(0)
+            csvfile.write(content)
+            csvfile.truncate()
+    with open(csv_path, "r", newline="") as csvfile:
+        return {row["repo_id"] for row in csv.DictReader(csvfile)}
 
 
 if __name__ == "__main__":
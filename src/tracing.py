@@ -0,0 +1,231 @@
+"""Nested timing of the pipeline stages
+
+    with span("download", url=url):
+        ...
+
+Spans nest per thread (and asyncio task). Each process appends its spans to
+spans-<pid>.jsonl in $TRACE_DIR, so the spans of forked and pool workers are kept too.
+Without $TRACE_DIR, spans record nothing.
+
+    TRACE_DIR=data/trace python3 src/static.py ...
+    python3 src/tracing.py data/trace
+
+writes data/trace/summary.json, the count, total and self time (without nested spans)
+of each label, and data/trace/trace.json, a Chrome trace for chrome://tracing
+or https://ui.perfetto.dev.
+"""
+
+import os
+import glob
+import json
+import time
+import atexit
+import logging
+import threading
+import contextlib
+import contextvars
+from dataclasses import dataclass
+from functools import lru_cache, wraps
+from typing import Callable, Iterator, Optional
+import fire
+
+
+@dataclass
+class Span:
+    label: str
+    pid: int
+    tid: int
+    # ns spent in the nested spans of the same thread
+    nested: int = 0
+
+
+# open spans of the running thread or task, innermost last
+_SPANS: contextvars.ContextVar[tuple[Span, ...]] = contextvars.ContextVar(
+    "spans", default=()
+)
+
+
+class SpanRecorder:
+    """spans of a process, appended to spans-<pid>.jsonl in directory
+    each time an outermost span of a thread ends
+    """
+
+    # spans kept in memory at most before they are written
+    MAX_BUFFER = 1000
+
+    def __init__(self, directory: str):
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f"spans-{self.pid}.jsonl")
+        self.lock = threading.Lock()
+        self.buffer: list[str] = []
+        atexit.register(self.flush)
+
+    def add(self, record: dict, flush: bool = False):
+        with self.lock:
+            self.buffer.append(json.dumps(record, default=str))
+            if flush or len(self.buffer) >= self.MAX_BUFFER:
+                self._write()
+
+    def flush(self):
+        # the handler is inherited by forked children, which have their own
+        if os.getpid() == self.pid:
+            with self.lock:
+                self._write()
+
+    def _write(self):
+        if self.buffer:
+            with open(self.path, "a") as fp:
+                fp.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+
+
+def trace_dir() -> Optional[str]:
+    return os.environ.get("TRACE_DIR") or None
+
+
+def recorder() -> Optional[SpanRecorder]:
+    """recorder of the running process, None if not tracing"""
+    directory = trace_dir()
+    if directory is None:
+        return None
+    return _recorder(directory, os.getpid())
+
+
+@lru_cache(maxsize=None)
+def _recorder(
+    directory: str, pid: int  # pylint: disable=unused-argument
+) -> SpanRecorder:
+    os.makedirs(directory, exist_ok=True)
+    return SpanRecorder(directory)
+
+
+@contextlib.contextmanager
+def _record(label: str, args: dict, rec: SpanRecorder) -> Iterator[Span]:
+    outer = _SPANS.get()
+    current = Span(label, os.getpid(), threading.get_native_id())
+    token = _SPANS.set(outer + (current,))
+    start_at = time.time_ns()
+    start = time.perf_counter_ns()
+    try:
+        yield current
+    finally:
+        duration = time.perf_counter_ns() - start
+        _SPANS.reset(token)
+        parent = outer[-1] if outer else None
+        # spans opened before a fork or in another thread are not nested for timing
+        same_thread = (
+            parent is not None
+            and parent.pid == current.pid
+            and parent.tid == current.tid
+        )
+        if parent is not None and same_thread:
+            parent.nested += duration
+        record = {
+            "label": label,
+            "path": "/".join(s.label for s in outer + (current,)),
+            "start_us": start_at // 1000,
+            "total_us": duration // 1000,
+            "self_us": (duration - current.nested) // 1000,
+            "pid": current.pid,
+            "tid": current.tid,
+        }
+        if args:
+            record["args"] = args
+        rec.add(record, flush=not same_thread)
+
+
+_NOT_TRACING = contextlib.nullcontext()
+
+
+def span(label: str, **args) -> contextlib.AbstractContextManager:
+    """time the block as label, args are kept in the trace"""
+    rec = recorder()
+    if rec is None:
+        return _NOT_TRACING
+    return _record(label, args, rec)
+
+
+def traced(label: str) -> Callable[[Callable], Callable]:
+    """decorator timing each call of a function as label"""
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with span(label):
+                return func(*args, **kwargs)
+
+        return inner
+
+    return decorator
+
+
+def load_spans(directory: str) -> list[dict]:
+    """spans recorded in directory by all processes"""
+    spans: list[dict] = []
+    for path in sorted(glob.glob(os.path.join(directory, "spans-*.jsonl"))):
+        with open(path, "r") as fp:
+            spans.extend(json.loads(line) for line in fp if line.strip())
+    return spans
+
+
+def summarize(spans: list[dict]) -> dict[str, dict]:
+    """label -> count, total and self seconds, sorted by self time"""
+    summary: dict[str, dict] = {}
+    for s in spans:
+        stats = summary.setdefault(
+            s["label"], {"count": 0, "total_s": 0.0, "self_s": 0.0, "max_s": 0.0}
+        )
+        stats["count"] += 1
+        stats["total_s"] += s["total_us"] / 1e6
+        stats["self_s"] += s["self_us"] / 1e6
+        stats["max_s"] = max(stats["max_s"], s["total_us"] / 1e6)
+    ordered = sorted(summary.items(), key=lambda item: -item[1]["self_s"])
+    return {
+        label: {k: round(v, 6) for k, v in stats.items()} for label, stats in ordered
+    }
+
+
+def to_chrome_trace(spans: list[dict]) -> dict:
+    """spans as complete events of the Chrome trace event format"""
+    events = [
+        {
+            "name": s["label"],
+            "cat": s["path"],
+            "ph": "X",
+            "ts": s["start_us"],
+            "dur": s["total_us"],
+            "pid": s["pid"],
+            "tid": s["tid"],
+            "args": s.get("args", {}),
+        }
+        for s in spans
+    ]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def main(
+    directory: str,
+    summary: str = "summary.json",
+    trace: str = "trace.json",
+):
+    """export the spans recorded in directory ($TRACE_DIR of a run)
+
+    Args:
+        summary (str): json of the time spent by label, written in directory.
+        trace (str): Chrome trace of all spans, written in directory.
+    """
+    spans = load_spans(directory)
+    logging.info(f"Loaded {len(spans)} spans from {directory}")
+    stats = summarize(spans)
+    with open(os.path.join(directory, summary), "w") as fp:
+        json.dump(stats, fp, indent=2)
+    with open(os.path.join(directory, trace), "w") as fp:
+        json.dump(to_chrome_trace(spans), fp)
+    print(f"{'label':<24}{'count':>10}{'total (s)':>12}{'self (s)':>12}")
+    for label, s in stats.items():
+        print(f"{label:<24}{s['count']:>10}{s['total_s']:>12.3f}{s['self_s']:>12.3f}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    fire.Fire(main)
@@ -0,0 +1,57 @@
+import json
+import pytest
+from src.bench_static import (
+    FUNCTIONS,
+    Case,
+    ModuleSpec,
+    compare,
+    main,
+    make_module,
+    read_repo,
+)
+from src.static import analyze_source
+
+
+def test_make_module(tmp_path):
+    spec = ModuleSpec(classes=3, tests=10, helpers=4, depth=5, statements=2)
+    stats = analyze_source("", make_module(spec))
+    assert stats.failed == 0
+    assert stats.unit == 3 * 8 and stats.property_based == 3 * 2
+    assert stats.funcs == 4
+
+    (tmp_path / "owner+repo").mkdir()
+    (tmp_path / "owner+repo" / "a.py").write_text(make_module(spec))
+    assert read_repo(str(tmp_path), "owner/repo") == [make_module(spec)]
+    assert read_repo(str(tmp_path), "owner/missing") is None
+    (tmp_path / "owner+repo@v1").mkdir()
+    assert read_repo(str(tmp_path), "owner/repo", "v1") == []
+
+
+def test_compare():
+    base = {"a/parse": {"nodes_per_s": 1000, "peak_kb": 1000}}
+    assert not compare({"a/parse": {"nodes_per_s": 800, "peak_kb": 1200}}, base, 0.25)
+    assert compare({"a/parse": {"nodes_per_s": 700, "peak_kb": 1000}}, base, 0.25)
+    assert compare({"a/parse": {"nodes_per_s": 1000, "peak_kb": 2000}}, base, 0.25)
+    assert not compare({"b/parse": {"nodes_per_s": 1, "peak_kb": 1}}, base, 0.25)
+
+
+def test_find_all_functions():
+    spec = ModuleSpec(classes=3, tests=4, helpers=2, depth=1, statements=1)
+    case = Case("case", [make_module(spec)])
+    for name in ("node_types", "find_all", "find_all_types", "find_all_root"):
+        FUNCTIONS[name](case)
+    assert len(case.classes[0]) == 3 and len(case.funcs[0]) == 3 * 4 + 2
+
+
+def test_main_baseline(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    kwargs = dict(baseline=str(baseline), cases="small", functions="find_all")
+    main(save=True, repeat=1, **kwargs)
+    stored = json.loads(baseline.read_text())
+    assert list(stored["results"]) == ["small/find_all"]
+    main(threshold=0.9, repeat=1, **kwargs)
+
+    stored["results"]["small/find_all"]["nodes_per_s"] *= 100
+    baseline.write_text(json.dumps(stored))
+    with pytest.raises(SystemExit):
+        main(repeat=1, **kwargs)
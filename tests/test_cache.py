@@ -0,0 +1,39 @@
+from src.cache import AnalysisCache, content_hash
+
+
+def test_get_put(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.db"), version="1")
+    digest = content_hash("x = 1\n")
+    assert cache.get(digest) is None
+    cache.put(digest, "a.py", {"lines": 1})
+    cache.flush()
+    assert cache.get(digest) == {"lines": 1}
+    assert AnalysisCache(cache.path, version="2").get(digest) is None
+
+
+def test_prune(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.db"), version="1")
+    sources = []
+    for i in range(4):
+        source = tmp_path / f"{i}.py"
+        source.write_text(f"x = {i}\n")
+        sources.append(source)
+        cache.put(content_hash(source.read_text()), str(source), {"lines": i})
+    sources[0].unlink()
+    assert cache.prune() == 1 and len(cache) == 3
+    assert cache.prune(max_entries=2) == 1 and len(cache) == 2
+    assert cache.get(content_hash(sources[1].read_text())) is None
+
+
+def test_prune_versions(tmp_path):
+    path = str(tmp_path / "cache.db")
+    source = tmp_path / "a.py"
+    source.write_text("x = 1\n")
+    for version in ["1", "2"]:
+        cache = AnalysisCache(path, version=version)
+        cache.put(content_hash(source.read_text()), str(source), {"version": version})
+        cache.close()
+    cache = AnalysisCache(path, version="2")
+    assert len(cache) == 2
+    assert cache.prune() == 1 and len(cache) == 1
+    assert cache.get(content_hash(source.read_text())) == {"version": "2"}
@@ -0,0 +1,50 @@
+import re
+import src.check_repo_stats as check_repo_stats
+from src.check_repo_stats import batch_query, fetch_metadata
+
+
+def _repo_data(name: str) -> dict:
+    return {
+        "id": name,
+        "owner": {"login": "owner"},
+        "name": name,
+        "url": f"https://github.com/owner/{name}",
+        "isArchived": False,
+        "isFork": False,
+        "isMirror": False,
+        "primaryLanguage": {"name": "Python"},
+        "pushedAt": "2023-01-01T00:00:00Z",
+        "stargazerCount": 10,
+        "object": {},
+    }
+
+
+def test_batch_query():
+    query = batch_query(["a/x", "b/y"])
+    assert 'r0: repository(owner: "a", name: "x")' in query
+    assert 'r1: repository(owner: "b", name: "y")' in query
+    assert "fragment RepoFields on Repository" in query
+
+
+def test_fetch_metadata(monkeypatch):
+    queries = []
+
+    def fake_get_graphql_data(gql, access_token):
+        repos = re.findall(r'(r\d+): repository\(owner: "\w+", name: "(\w+)"\)', gql)
+        queries.append([name for _, name in repos])
+        if len(queries) == 2:  # the second batch fails once
+            return None
+        data = {alias: _repo_data(name) for alias, name in repos if name != "gone"}
+        errors = [
+            {"type": "NOT_FOUND", "path": [alias]}
+            for alias, name in repos
+            if name == "gone"
+        ]
+        return {"data": data, "errors": errors}
+
+    monkeypatch.setattr(check_repo_stats, "get_graphql_data", fake_get_graphql_data)
+    repos = ["owner/a", "owner/gone", "owner/b", "owner/c"]
+    metadata = fetch_metadata(repos, "token", batch_size=2)
+    assert queries == [["a", "gone"], ["b", "c"], ["b", "c"]]
+    assert metadata["owner/gone"] is None
+    assert [metadata[r].name for r in ["owner/a", "owner/b", "owner/c"]] == list("abc")
@@ -0,0 +1,206 @@
+import json
+import math
+import time
+import signal
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.common import (
+    GraphQLClient,
+    LimitedWorker,
+    RateLimiter,
+    TokenPool,
+    TimeoutException,
+    check_deadline,
+    remaining_time,
+    run_in_subprocess,
+    time_limit,
+)
+
+
+def test_rate_limiter(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    limiter = RateLimiter("core")
+    limiter.acquire()  # unknown budget, no wait
+    reset_at = time.time() + 100
+    limiter.update(3, 60, reset_at)
+    limiter.update(5, 60, reset_at)  # stale response of the same window
+    assert str(limiter) == "3/60"
+    limiter.acquire(2)
+    assert limiter.remaining == 1 and not sleeps
+    limiter.acquire(2)
+    assert len(sleeps) == 1 and 99 < sleeps[0] <= 101
+
+    limiter.update_from_graphql(
+        {"remaining": 4999, "limit": 5000, "resetAt": "2030-01-01T00:00:00Z"}
+    )
+    assert limiter.remaining == 4999 and limiter.reset_at > reset_at
+
+
+def test_token_pool(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    oauth = tmp_path / "oauth"
+    oauth.write_text("a\n# comment\nb\n\nc\n")
+    pool = TokenPool.load(str(oauth))
+    assert pool.tokens == ["a", "b", "c"]
+    reset_at = str(int(time.time()) + 100)
+    for token, remaining in [("a", "10"), ("b", "30"), ("c", "20")]:
+        pool.update(token, {})
+        pool.update(
+            token,
+            {
+                "X-RateLimit-Remaining": remaining,
+                "X-RateLimit-Limit": "5000",
+                "X-RateLimit-Reset": reset_at,
+                "X-RateLimit-Resource": "core",
+            },
+        )
+    assert str(pool) == "60/15000"
+    # the token with most budget left, until they are even
+    assert [pool.acquire("core", 10) for _ in range(3)] == ["b", "b", "c"]
+    assert pool.limits["a"]["graphql"].remaining is None
+    assert not sleeps
+
+    assert TokenPool.load(str(tmp_path / "missing"), anonymous=True).tokens == [""]
+
+
+def _stub_server(statuses):
+    """local GraphQL stub answering with statuses in turn, then 200"""
+    statuses = list(statuses)
+    clients = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            clients.add(self.client_address)
+            self.rfile.read(int(self.headers["Content-Length"]))
+            status = statuses.pop(0) if statuses else 200
+            body = json.dumps({"data": {"ok": True}}).encode()
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "3")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, clients
+
+
+def test_graphql_client(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    server, clients = _stub_server([429, 502, 200, 401])
+    api = f"http://127.0.0.1:{server.server_port}/graphql"
+    client = GraphQLClient("token", api=api, backoff=1.0)
+    try:
+        # Retry-After, then backoff with jitter
+        assert client.query("{ ok }") == {"data": {"ok": True}}
+        assert sleeps[0] == 3 and 1.0 <= sleeps[1] <= 2.0
+        # not retried
+        assert client.query("{ ok }") is None and len(sleeps) == 2
+        for _ in range(5):
+            client.query("{ ok }")
+    finally:
+        server.shutdown()
+    # one connection kept alive for all queries
+    assert len(clients) == 1
+    assert client.stats()["count"] == 9
+
+
+def test_time_limit_nested():
+    with time_limit(0.2):
+        assert remaining_time() <= 0.2
+        with time_limit(10):  # never extends the outer limit
+            assert remaining_time() <= 0.2
+        with pytest.raises(TimeoutException):
+            time.sleep(1)  # interrupted by SIGALRM in the main thread
+    assert remaining_time() == math.inf
+
+    with pytest.raises(TimeoutException):
+        with time_limit(10):
+            with time_limit(0.1):
+                time.sleep(1)
+    assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
+
+
+def test_time_limit_thread():
+    results = []
+
+    def work():
+        with time_limit(0.1):
+            try:
+                while True:
+                    check_deadline()
+                    time.sleep(0.01)
+            except TimeoutException:
+                results.append(remaining_time() <= 0)
+        results.append(remaining_time())
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count(True) == 4 and results.count(math.inf) == 4
+
+
+def _double(x):
+    return 2 * x
+
+
+def _fail():
+    raise ValueError("failed")
+
+
+def test_run_in_subprocess():
+    assert run_in_subprocess(_double, 21, timeout=10) == 42
+    with pytest.raises(ValueError):
+        run_in_subprocess(_fail)
+    start = time.monotonic()
+    with pytest.raises(TimeoutException):
+        run_in_subprocess(time.sleep, 10, timeout=0.2)
+    with pytest.raises(TimeoutException):
+        with time_limit(0.2, preempt=False):
+            run_in_subprocess(time.sleep, 10)
+    assert time.monotonic() - start < 2
+
+
+def _spin(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+    return seconds
+
+
+def _allocate(mb):
+    return len(bytearray(mb << 20))
+
+
+def test_limited_worker():
+    spin = LimitedWorker(_spin, cpu_time=1)
+    assert spin(0) == 0
+    pid = spin.pid
+    with pytest.raises(TimeoutException):
+        spin(10)  # killed by SIGXCPU
+    assert spin(0.1) == 0.1 and spin.pid != pid  # restarted
+    with pytest.raises(TimeoutException):
+        spin(10)
+    spin.close()
+
+    allocate = LimitedWorker(_allocate, memory_limit=1024)
+    assert allocate(1) == 1 << 20
+    with pytest.raises(MemoryError):
+        allocate(2048)
+    assert allocate(1) == 1 << 20
+    with pytest.raises(TypeError):  # exceptions of func
+        allocate("1")
+    allocate.close()
@@ -0,0 +1,365 @@
+import io
+import os
+import json
+import tarfile
+import sys
+import time
+import threading
+import pytest
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from returns.result import Success, Failure
+from src.bench_crawl import run_script
+from github import Auth, Github
+from src.common import TokenPool, time_limit
+from src import download_repos
+from src.download_repos import (
+    archive_of,
+    download_archive,
+    extract_archive,
+    download_repo,
+    extract_downloaded,
+    fetch_archive,
+    fetch_repo,
+    load_manifest,
+    probe_archive,
+    DownloadErrorCode,
+)
+from src.github_stub import StubConfig, StubServer, repo_kind
+
+
+def _make_archive(tmp_path):
+    src = tmp_path / "src" / "owner-repo-abc"
+    (src / "pkg").mkdir(parents=True)
+    (src / "pkg" / "mod.py").write_text("x = 1\n")
+    (src / "data.csv").write_text("a,b\n")
+    tar_path = tmp_path / "owner+repo.tar.gz"
+    with tarfile.open(tar_path, "w:gz") as tp:
+        tp.add(src, arcname=src.name)
+    return str(tar_path)
+
+
+def _files(root):
+    return sorted(
+        os.path.relpath(os.path.join(parent, f), root)
+        for parent, _, files in os.walk(root)
+        for f in files
+    )
+
+
+def test_extract_archive(tmp_path):
+    tar_path = _make_archive(tmp_path)
+    for extract, expected in [
+        ("all", ["owner-repo-abc/data.csv", "owner-repo-abc/pkg/mod.py"]),
+        ("py", ["owner-repo-abc/pkg/mod.py"]),
+        ("none", []),
+    ]:
+        out = tmp_path / extract
+        extract_archive(tar_path, str(out), extract)
+        assert _files(out) == expected
+
+
+def test_extract_downloaded(tmp_path):
+    tar_path = _make_archive(tmp_path)
+    repo_path = tar_path[: -len(".tar.gz")]
+    record = extract_downloaded(
+        "owner/repo", Success({"archive": "url"}), repo_path, "py"
+    )
+    assert record == {
+        "repo_id": "owner/repo",
+        "archive": "url",
+        "download": tar_path,
+        "extract": "py",
+        "extracted": repo_path,
+    }
+    assert _files(repo_path) == ["owner-repo-abc/pkg/mod.py"]
+
+    (tmp_path / "broken+repo.tar.gz").write_text("not a tarball")
+    record = extract_downloaded(
+        "broken/repo", Success({"archive": "url"}), str(tmp_path / "broken+repo"), "all"
+    )
+    assert record["error_code"] == DownloadErrorCode.TARFILE_EXTRACT_FAILED
+
+    failure = Failure(DownloadErrorCode.FETCH_REPO_FAILED)
+    record = extract_downloaded("gone/repo", failure, str(tmp_path / "gone"), "all")
+    assert record == {
+        "repo_id": "gone/repo",
+        "error_code": DownloadErrorCode.FETCH_REPO_FAILED,
+    }
+
+
+class _FakeResponse:
+    """serve data[start:], dropping the connection after fail_after bytes"""
+
+    def __init__(self, data, start, fail_after=None):
+        self.data, self.start, self.fail_after = data, start, fail_after
+        self.status_code = 206 if start else 200
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        data = self.data[self.start :]
+        for i in range(0, len(data), chunk_size):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise requests.ConnectionError("dropped")
+            yield data[i : i + chunk_size]
+
+
+def test_download_archive_resume(tmp_path, monkeypatch):
+    data = bytes(range(256)) * 64
+    ranges = []
+
+    def fake_get(url, headers, **kwargs):
+        start = int(headers["Range"][6:-1]) if "Range" in headers else 0
+        ranges.append(start)
+        return _FakeResponse(data, start, fail_after=None if ranges[1:] else 4096)
+
+    monkeypatch.setattr(requests, "get", fake_get)
+    path = str(tmp_path / "owner+repo.tar.gz")
+    result = download_archive(path, "url", timeout=10, chunk_size=1024, backoff=0)
+    assert result == Success(None)
+    assert ranges == [0, 4096]
+    with open(path, "rb") as fp:
+        assert fp.read() == data
+    assert os.listdir(tmp_path) == ["owner+repo.tar.gz"]
+
+
+def _error_response(status_code):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.raw = io.BytesIO(b"")
+    return resp
+
+
+def test_download_archive_retry_status(tmp_path, monkeypatch):
+    data = bytes(range(256))
+    statuses = [503, 429]
+
+    def fake_get(url, headers, **kwargs):
+        return _error_response(statuses.pop(0)) if statuses else _FakeResponse(data, 0)
+
+    monkeypatch.setattr(requests, "get", fake_get)
+    path = tmp_path / "owner+repo.tar.gz"
+    (tmp_path / "owner+repo.tar.gz.0123abcd.part").write_bytes(b"old")
+    assert download_archive(str(path), "url", timeout=10, backoff=0) == Success(None)
+    assert path.read_bytes() == data
+    assert os.listdir(tmp_path) == ["owner+repo.tar.gz"]
+
+    requested = []
+    monkeypatch.setattr(
+        requests, "get", lambda url, **_: requested.append(url) or _error_response(404)
+    )
+    result = download_archive(str(path), "gone", timeout=10, backoff=0)
+    assert result == Failure(DownloadErrorCode.DOWNLOAD_ARCHIVE_FAILED)
+    assert requested == ["gone"]
+
+
+class _FakeSession:
+    """answer 304 to matching etags, else the latest commit with its etag"""
+
+    def __init__(self, sha, etag):
+        self.sha, self.etag, self.urls = sha, etag, []
+
+    def get(self, url, headers, timeout):
+        self.urls.append(url)
+        resp = requests.Response()
+        resp.headers["ETag"] = self.etag
+        if headers.get("If-None-Match") == self.etag:
+            resp.status_code = 304
+        else:
+            resp.status_code = 200
+            resp._content = json.dumps([{"sha": self.sha}]).encode()
+        return resp
+
+
+def test_probe_archive(tmp_path):
+    entry = {"repo_id": "owner/repo", "kind": "commit", "archive_id": "abc"}
+    session = _FakeSession("abc", '"v1"')
+    assert probe_archive(session, "owner/repo", entry, 10) == '"v1"'
+    assert session.urls[0].endswith("/repos/owner/repo/commits?per_page=1")
+    assert probe_archive(session, "owner/repo", entry | {"etag": '"v1"'}, 10) == '"v1"'
+    session = _FakeSession("def", '"v2"')
+    assert probe_archive(session, "owner/repo", entry | {"etag": '"v1"'}, 10) is None
+
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text(
+        "\n".join(json.dumps(entry | {"archive_id": i}) for i in ["abc", "def"])
+    )
+    assert load_manifest(str(manifest)) == {"owner/repo": entry | {"archive_id": "def"}}
+    assert load_manifest(str(tmp_path / "missing.jsonl")) == {}
+
+
+def test_extract_unchanged(tmp_path):
+    entry = {"archive": "url", "extract": "py", "unchanged": True}
+    repo_path = str(tmp_path / "owner+repo")  # no archive to extract
+    record = extract_downloaded("owner/repo", Success(entry), repo_path, "py")
+    assert record["unchanged"] and not os.path.exists(repo_path)
+
+
+def test_archive_of():
+    commit = {"defaultBranchRef": {"target": {"oid": "abc"}}}
+    tag = {"refs": {"nodes": [{"name": "v1"}]}} | commit
+    release = {"latestRelease": {"tagName": "v2"}} | tag
+    for data, kind, archive_id in [
+        (release, "release", "v2"),
+        (tag, "tag", "v1"),
+        (commit, "commit", "abc"),
+    ]:
+        archive = archive_of("owner/repo", data).unwrap()
+        assert archive["kind"] == kind and archive["archive_id"] == archive_id
+        assert archive["archive"].endswith(f"/repos/owner/repo/tarball/{archive_id}")
+    empty = {"latestRelease": None, "refs": {"nodes": []}, "defaultBranchRef": None}
+    assert archive_of("owner/repo", empty) == Failure(
+        DownloadErrorCode.FETCH_ARCHIVE_FAILED
+    )
+    assert archive_of("owner/repo", None) == Failure(
+        DownloadErrorCode.FETCH_REPO_FAILED
+    )
+
+
+class SlowHub:
+    def get_repo(self, repo_id: str):
+        time.sleep(0.2)
+        return repo_id
+
+
+def test_fetch_repo_deadline():
+    def fetch(limit: float):
+        with time_limit(limit):
+            return fetch_repo("owner/repo", 30, SlowHub())
+
+    # not interrupted in a thread, the limit is checked once the request returns
+    with ThreadPoolExecutor(1) as executor:
+        assert executor.submit(fetch, 10).result() == Success("owner/repo")
+        assert executor.submit(fetch, 0.05).result() == Failure(
+            DownloadErrorCode.FETCH_ARCHIVE_FAILED
+        )
+
+
+def test_main_with_stub(tmp_path):
+    (tmp_path / "repos.txt").write_text("a/x1\na/x2\nb/missing0\n")
+    (tmp_path / "oauth").write_text("token0\n")
+    oroot = tmp_path / "repos"
+    oroot.mkdir()
+    server = StubServer(("127.0.0.1", 0), StubConfig(archive_files=2))
+    server.start()
+    # the API urls are read at import, the script runs in its own process
+    env = os.environ | {
+        "GITHUB_API": server.url,
+        "GITHUB_GRAPHQL_API": f"{server.url}/graphql",
+        "PYTHONPATH": os.pathsep.join(sys.path),
+    }
+    args = ["--input_repo_list_path", str(tmp_path / "repos.txt")]
+    args += ["--oroot", str(oroot), "--oauth", str(tmp_path / "oauth")]
+    args += ["--extract", "py"]
+    try:
+        run_script("src.download_repos", args + ["--workers", "2"], env, "/dev/null")
+        # refreshed with REST, the archives did not change since
+        run_script(
+            "src.download_repos", args + ["--resolver", "rest"], env, "/dev/null"
+        )
+    finally:
+        server.shutdown()
+
+    records = [json.loads(line) for line in (oroot / "download_log.jsonl").open()]
+    assert [r["repo_id"] for r in records] == ["a/x1", "a/x2", "b/missing0"] * 2
+    assert records[2]["error_code"] == DownloadErrorCode.FETCH_REPO_FAILED
+    for record in records[:2]:
+        assert record["extracted"] == str(oroot / record["repo_id"].replace("/", "+"))
+        assert "unchanged" not in record
+        assert _files(record["extracted"])[0].endswith(".py")
+    assert all(r["unchanged"] for r in records[3:5])
+    assert len(load_manifest(str(oroot / "manifest.jsonl"))) == 2
+    assert server.calls["tarball"] == 2 and "rate_limit" not in server.calls
+
+
+class TimedOutHub:
+    def get_repo(self, repo_id: str):
+        raise requests.exceptions.ReadTimeout(f"{repo_id} timed out")
+
+    def get_latest_release(self):
+        raise requests.exceptions.ConnectionError("connection reset")
+
+
+def test_fetch_timed_out():
+    failed = Failure(DownloadErrorCode.FETCH_ARCHIVE_FAILED)
+    assert fetch_repo("owner/repo", 30, TimedOutHub()) == failed
+    assert fetch_archive(TimedOutHub()) == failed
+
+
+def test_main_error_cancels(tmp_path, monkeypatch):
+    started = []
+    lock = threading.Lock()
+
+    def broken_download(hub, repo_id, *args):
+        with lock:
+            started.append(repo_id)
+        time.sleep(0.05)
+        raise RuntimeError(f"broken {repo_id}")
+
+    monkeypatch.setattr(download_repos, "download_repo", broken_download)
+    (tmp_path / "repos.txt").write_text("\n".join(f"a/x{i}" for i in range(50)))
+    with pytest.raises(RuntimeError):
+        download_repos.main(
+            str(tmp_path / "repos.txt"),
+            oroot=str(tmp_path),
+            oauth=str(tmp_path / "oauth"),
+            resolver="rest",
+            workers=2,
+        )
+    # the queued repos are dropped once the first one fails
+    assert len(started) <= 4
+
+
+def test_download_repo_rate_limit(tmp_path):
+    server = StubServer(("127.0.0.1", 0), StubConfig(archive_files=1))
+    server.start()
+    tokens = TokenPool(["token0"])
+    hub = Github(auth=Auth.Token("token0"), base_url=server.url)
+    # the repo, no release, its tags and the tarball
+    repo_id = next(f"a/x{i}" for i in range(10) if repo_kind(f"a/x{i}") == "tag")
+    try:
+        path = str(tmp_path / "x.tar.gz")
+        result = download_repo(
+            hub, repo_id, path, 10, 10, 0, "token0", tokens.limits["token0"]
+        )
+    finally:
+        server.shutdown()
+    assert result.unwrap()["kind"] == "tag"
+    # every request was counted, and nothing was asked for the rate limit itself
+    assert server.usage[("token0", "core")][1] == 4
+    assert tokens.limits["token0"]["core"].remaining == server.config.rate_limit - 4
+    assert "rate_limit" not in server.calls
+
+
+def test_main_delay_graphql(tmp_path, monkeypatch):
+    repo_ids = ["a/x1", "a/x2"]
+    archive = {"archive": "url", "kind": "commit", "archive_id": "sha"}
+    monkeypatch.setattr(
+        download_repos,
+        "resolve_archives",
+        lambda repo_ids, *_: {r: Success(archive) for r in repo_ids},
+    )
+
+    def fake_download(path, *args, **kwargs):
+        with open(path, "wb"):
+            return Success(None)
+
+    sleeps = []
+    monkeypatch.setattr(download_repos, "download_archive", fake_download)
+    monkeypatch.setattr(download_repos.time, "sleep", sleeps.append)
+    (tmp_path / "repos.txt").write_text("\n".join(repo_ids))
+    (tmp_path / "oauth").write_text("token0\n")
+    kwargs = dict(oroot=str(tmp_path), oauth=str(tmp_path / "oauth"), extract="none")
+    download_repos.main(str(tmp_path / "repos.txt"), delay=3, **kwargs)
+    assert sleeps == [3, 3]
+    # nothing is downloaded again, no pause
+    download_repos.main(str(tmp_path / "repos.txt"), delay=3, **kwargs)
+    assert sleeps == [3, 3]
@@ -0,0 +1,68 @@
+import os
+import json
+from src import find_repos
+from src.find_repos import get_oss_fuzz_projects, load_proj_config, scan_projects
+
+
+def _make_projects(root, n: int = 6):
+    projects = root / "oss-fuzz" / "projects"
+    for i in range(n):
+        proj = projects / f"project{i}"
+        proj.mkdir(parents=True)
+        language = "python" if i % 2 == 0 else "c++"
+        (proj / "project.yaml").write_text(
+            f"language: {language}\nmain_repo: https://github.com/owner/repo{i}/\n"
+        )
+        (proj / "fuzz_a.py").write_text("")
+    (projects / "broken").mkdir()
+    (projects / "broken" / "project.yaml").write_text("language: [python\n")
+    return projects
+
+
+def test_get_oss_fuzz_projects(tmp_path, monkeypatch):
+    _make_projects(tmp_path)
+    monkeypatch.setenv("WORKDIR", str(tmp_path))
+    found = sorted(map(json.loads, get_oss_fuzz_projects("python")), key=str)
+    assert [p["repo_id"] for p in found] == [
+        "owner/repo0",
+        "owner/repo2",
+        "owner/repo4",
+    ]
+    assert found[0]["#fuzz_target"] == 1
+    proj0 = str(tmp_path / "oss-fuzz" / "projects" / "project0")
+    assert load_proj_config(proj0, "python") == {
+        k: v for k, v in found[0].items() if k != "repo_id"
+    }
+
+
+def test_scan_projects_cached(tmp_path, monkeypatch):
+    projects = _make_projects(tmp_path)
+    cache_path = str(tmp_path / "cache.json")
+    full = scan_projects(str(projects), cache_path, workers=2)
+    assert full["broken"] is None and full["project1"]["language"] == "c++"
+
+    read = []
+    read_proj_yaml = find_repos.read_proj_yaml
+    monkeypatch.setattr(
+        find_repos, "read_proj_yaml", lambda p: read.append(p) or read_proj_yaml(p)
+    )
+    assert scan_projects(str(projects), cache_path) == full
+    assert not read
+
+    (projects / "project1" / "project.yaml").write_text("language: python\n")
+    os.utime(projects / "project1" / "project.yaml", ns=(0, 0))
+    (projects / "project3" / "fuzz_b.py").write_text("")
+    changed = scan_projects(str(projects), cache_path)
+    assert sorted(map(os.path.basename, read)) == ["project1", "project3"]
+    assert changed["project1"] == {"language": "python"}
+
+
+def test_scan_projects_dates(tmp_path):
+    projects = _make_projects(tmp_path, n=1)
+    (projects / "project0" / "project.yaml").write_text(
+        "language: python\nmain_repo: https://github.com/o/r\nsince: 2020-01-02\n"
+    )
+    cache_path = str(tmp_path / "cache.json")
+    fresh = scan_projects(str(projects), cache_path)
+    assert fresh["project0"]["since"] == "2020-01-02"
+    assert scan_projects(str(projects), cache_path) == fresh
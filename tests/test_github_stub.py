@@ -0,0 +1,39 @@
+import tarfile
+import requests
+from src.common import GraphQLClient
+from src.check_repo_stats import batch_query
+from src.github_stub import StubConfig, StubServer, repo_kind
+
+
+def test_github_stub(tmp_path):
+    server = StubServer(("127.0.0.1", 0), StubConfig(rate_limit=4, archive_files=2))
+    server.start()
+    try:
+        client = GraphQLClient("token", api=f"{server.url}/graphql")
+        response = client.query(batch_query(["a/x", "b/missing"]))
+        assert response["data"]["r0"]["name"] == "x"
+        assert response["data"]["r1"] is None
+        assert response["errors"] == [{"type": "NOT_FOUND", "path": ["r1"]}]
+        assert response["data"]["rateLimit"]["remaining"] == 3
+
+        repo_id = next(f"a/x{i}" for i in range(10) if repo_kind(f"a/x{i}") == "commit")
+        resp = requests.get(f"{server.url}/repos/{repo_id}/commits")
+        sha, etag = resp.json()[0]["sha"], resp.headers["ETag"]
+        resp = requests.get(
+            f"{server.url}/repos/{repo_id}/commits", headers={"If-None-Match": etag}
+        )
+        assert resp.status_code == 304
+        assert requests.get(f"{server.url}/repos/{repo_id}/tags").json() == []
+
+        url = f"{server.url}/repos/{repo_id}/tarball/{sha}"
+        data = requests.get(url).content
+        partial = requests.get(url, headers={"Range": "bytes=10-"})
+        assert partial.status_code == 206 and partial.content == data[10:]
+        (tmp_path / "x.tar.gz").write_bytes(data)
+        with tarfile.open(tmp_path / "x.tar.gz") as tp:
+            assert len(tp.getnames()) == 4
+        # the anonymous token is out of requests
+        assert requests.get(url).status_code == 403
+    finally:
+        server.shutdown()
+    assert server.calls["graphql"] == 1 and server.calls["tarball"] == 3
@@ -0,0 +1,31 @@
+from src.common import RepoMetadata
+from src.metadata import MetadataStore
+from src.check_repo_stats import check_requirements, req_enough_stars
+from tests.test_check_repo_stats import _repo_data
+
+
+def test_metadata_store(tmp_path):
+    path = str(tmp_path / "meta" / "metadata.db")
+    store = MetadataStore(path)
+    metadata = RepoMetadata.from_dict(_repo_data("a"))
+    store.put("owner/a", metadata)
+    store.put("owner/a", metadata)
+    assert len(store) == 1 and "owner/a" in store and "owner/b" not in store
+    store.close()
+
+    store = MetadataStore(path)
+    assert store.get("owner/a") == metadata
+    assert store.get("owner/b") is None
+    assert store.get_many(["owner/a", "owner/b"]) == {"owner/a": metadata}
+
+
+def test_check_requirements_store(tmp_path):
+    store = MetadataStore(str(tmp_path / "metadata.db"))
+    passing = RepoMetadata.from_dict(_repo_data("a"))
+    failing = RepoMetadata.from_dict(_repo_data("b") | {"stargazerCount": 0})
+    checks, reqs = [req_enough_stars], ["1"]
+    assert check_requirements("owner/a", checks, reqs, "", passing, store)
+    assert not check_requirements("owner/b", checks, reqs, "", failing, store)
+    assert list(store.get_many(["owner/a", "owner/b"])) == ["owner/a"]
+    # looked up in the store instead of querying
+    assert check_requirements("owner/a", checks, reqs, "", store=store)
@@ -0,0 +1,108 @@
+import ast
+import sys
+from src.navigate import (
+    ModuleNavigator,
+    dump_ast_func,
+    find_all,
+    flatten,
+    get_path_to,
+    load_ast_func,
+    load_ast_funcs,
+)
+
+CODE = """
+class A:
+    class B:
+        def f(self):
+            assert True
+
+    def g(self):
+        def h():
+            return [x for x in range(3)]
+
+def k():
+    pass
+"""
+
+
+def _nav(tmp_path, code: str = CODE):
+    path = tmp_path / "mod.py"
+    path.write_text(code)
+    return ModuleNavigator(str(path))
+
+
+def test_subtree_queries(tmp_path):
+    nav = _nav(tmp_path)
+    for node in nav.find_all(ast.AST):
+        assert nav.subtree(node) == flatten(node)[0]
+        assert nav.find_all(ast.Name, root=node) == find_all(node, ast.Name)
+
+
+def test_get_path_to(tmp_path):
+    nav = _nav(tmp_path)
+    for node in nav.find_all(ast.AST):
+        path = nav.get_path_to(node)
+        assert path == get_path_to(node, nav.nodes, nav.parents)
+        assert path[0] is nav.ast and path[-1] is node
+    assert nav.get_path_to(ast.parse("x")) is None
+
+
+def test_dump_load_ast_func(tmp_path):
+    nav = _nav(tmp_path)
+    for func in nav.find_all(ast.FunctionDef):
+        func_id = dump_ast_func(func, nav.path, nav=nav)
+        assert load_ast_func(func_id, nav=nav) is func
+    assert [
+        dump_ast_func(f, "mod.py", nav=nav) for f in nav.find_all(ast.FunctionDef)
+    ] == [
+        "mod.py::A::B::f",
+        "mod.py::A::g",
+        "mod.py::A::h",
+        "mod.py::k",
+    ]
+
+
+def test_flatten_deep():
+    depth = sys.getrecursionlimit() * 2
+    node: ast.expr = ast.Name(id="x", ctx=ast.Load())
+    for _ in range(depth):
+        node = ast.UnaryOp(op=ast.Not(), operand=node)
+    nodes, parents = flatten(node)
+    assert parents[0] == -1
+    assert len(find_all(node, ast.UnaryOp, nodes=nodes)) == depth
+    name = next(n for n in nodes if isinstance(n, ast.Name))
+    assert len(get_path_to(name, nodes, parents)) == depth + 1
+
+
+def test_postorder_and_types(tmp_path):
+    nav = _nav(tmp_path)
+    post = nav.postorder()
+    assert post[-1] is nav.ast and len(post) == len(nav.nodes)
+    cls = nav.find_by_name("A")
+    cls_post = nav.postorder(cls)
+    assert cls_post[-1] is cls and len(cls_post) == len(nav.subtree(cls))
+    assert nav.find_all(ast.stmt) == [n for n in nav.nodes if isinstance(n, ast.stmt)]
+    assert all(isinstance(n, ast.AST) for n in nav.nodes)
+
+
+def test_load_ast_funcs(tmp_path):
+    nav = _nav(tmp_path, CODE + "\ndef f():\n    pass\n")
+    funcs = nav.find_all(ast.FunctionDef)
+    func_ids = [dump_ast_func(f, nav.path, nav=nav) for f in funcs]
+    assert func_ids[-1] == f"{nav.path}::f"
+    loaded = load_ast_funcs(func_ids[::-1])
+    assert [(f.name, f.lineno) for f in loaded] == [
+        (f.name, f.lineno) for f in funcs[::-1]
+    ]
+    assert load_ast_func(f"{nav.path}::A::B").lineno == nav.find_by_name("B").lineno
+    assert load_ast_funcs([f"{nav.path}::missing"]) == [None]
+
+
+def test_cached_navigator_modified(tmp_path):
+    nav = _nav(tmp_path)
+    func_id = f"{nav.path}::A::g"
+    func = load_ast_func(func_id)
+    assert dump_ast_func(func, nav.path) == func_id
+    assert load_ast_func(func_id) is func
+    (tmp_path / "mod.py").write_text("\n\n" + CODE)
+    assert load_ast_func(func_id).lineno == func.lineno + 2
@@ -0,0 +1,221 @@
+import ast
+import pytest
+from src import parsers, static
+from src.navigate import ModuleNavigator
+from src.parsers import PARSERS, ParserUnavailable, tree_sitter_parser
+from src.static import collect_funcs, scan_module
+from tests.test_static import CLASSIFY_MODULE, TEST_MODULE
+
+
+def _has_tree_sitter() -> bool:
+    try:
+        tree_sitter_parser()
+    except ParserUnavailable:
+        return False
+    return True
+
+
+requires_tree_sitter = pytest.mark.skipif(
+    not _has_tree_sitter(), reason="tree-sitter python grammar is not available"
+)
+
+
+def _names(nav: ModuleNavigator):
+    return {k: [f.name for f in v] for k, v in collect_funcs(nav).items()}
+
+
+def test_fallback_is_ast(tmp_path):
+    path = tmp_path / "mod.py"
+    path.write_text(CLASSIFY_MODULE)
+    assert ast.dump(ModuleNavigator(str(path), parser="fallback").ast) == ast.dump(
+        ModuleNavigator(str(path)).ast
+    )
+    assert set(PARSERS) == {"ast", "tree_sitter", "fallback"}
+
+
+@requires_tree_sitter
+@pytest.mark.parametrize("code", [CLASSIFY_MODULE, TEST_MODULE])
+def test_tree_sitter_same_funcs(tmp_path, code):
+    path = tmp_path / "mod.py"
+    path.write_text(code)
+    by_ast = ModuleNavigator(str(path))
+    by_tree_sitter = ModuleNavigator(str(path), parser="tree_sitter")
+    assert _names(by_ast) == _names(by_tree_sitter)
+    assert len(scan_module(by_ast).property_based) == len(
+        scan_module(by_tree_sitter).property_based
+    )
+
+
+@requires_tree_sitter
+def test_tree_sitter_python2(tmp_path):
+    path = tmp_path / "mod.py"
+    path.write_text("""
+class TestFoo(unittest.TestCase):
+    def test_print(self):
+        print "python 2"
+        self.assertTrue(True)
+""")
+    assert ModuleNavigator.build(str(path)) is None
+    nav = ModuleNavigator.build(str(path), parser="fallback")
+    assert _names(nav)[True] == ["test_print"]
+
+
+# parsed by tree-sitter as FAKE_TREE below, the grammar is not needed
+FAKE_SOURCE = """class TestA(Base, metaclass=Meta):
+    def test_a(self, x: int = 1, *args, k, **kw) -> int:
+        assert f(x, key=2)
+def g(a, /, b, *, c=3):
+    pass
+"""
+
+
+class FakeNode:
+    """the attributes of a tree-sitter node used by the conversion"""
+
+    def __init__(self, kind: str, *children, line: int = 0, span=(0, 0)):
+        self.type = kind
+        self.children = list(children)
+        self.named_children = [c for c in self.children if c.is_named]
+        # anonymous nodes are the keywords and punctuation
+        self.is_named = kind.isidentifier() and kind not in ("def", "class", "async")
+        self.start_byte, self.end_byte = span
+        self.start_point = self.end_point = (line, 0)
+
+
+def _fake_tree() -> FakeNode:
+    def ident(name: str, line: int) -> FakeNode:
+        start = FAKE_SOURCE.index(name)
+        return FakeNode("identifier", line=line, span=(start, start + len(name)))
+
+    def node(kind: str, *children, line: int) -> FakeNode:
+        return FakeNode(kind, *children, line=line)
+
+    test_a = node(
+        "function_definition",
+        node("def", line=1),
+        ident("test_a", 1),
+        node(
+            "parameters",
+            ident("self", 1),
+            node(
+                "typed_default_parameter",
+                ident("x", 1),
+                node("type", ident("int", 1), line=1),
+                node("integer", line=1),
+                line=1,
+            ),
+            node("list_splat_pattern", ident("args", 1), line=1),
+            ident("k", 1),
+            node("dictionary_splat_pattern", ident("kw", 1), line=1),
+            line=1,
+        ),
+        node("type", ident("int", 1), line=1),
+        node(
+            "block",
+            node(
+                "assert_statement",
+                node(
+                    "call",
+                    ident("f", 2),
+                    node(
+                        "argument_list",
+                        ident("x", 2),
+                        node(
+                            "keyword_argument",
+                            ident("key", 2),
+                            node("integer", line=2),
+                            line=2,
+                        ),
+                        line=2,
+                    ),
+                    line=2,
+                ),
+                line=2,
+            ),
+            line=2,
+        ),
+        line=1,
+    )
+    cls = node(
+        "class_definition",
+        node("class", line=0),
+        ident("TestA", 0),
+        node(
+            "argument_list",
+            ident("Base", 0),
+            node("keyword_argument", ident("metaclass", 0), ident("Meta", 0), line=0),
+            line=0,
+        ),
+        node("block", test_a, line=1),
+        line=0,
+    )
+    g = node(
+        "function_definition",
+        node("def", line=3),
+        ident("g", 3),
+        node(
+            "parameters",
+            ident("a", 3),
+            node("positional_separator", line=3),
+            ident("b", 3),
+            node("keyword_separator", line=3),
+            node("default_parameter", ident("c", 3), node("integer", line=3), line=3),
+            line=3,
+        ),
+        node("block", node("pass_statement", line=4), line=4),
+        line=3,
+    )
+    return node("module", cls, g, line=0)
+
+
+class FakeParser:
+    def parse(self, data: bytes):
+        assert data == FAKE_SOURCE.encode()
+        return type("Tree", (), {"root_node": _fake_tree()})
+
+
+def _signature(func: ast.AST):
+    args = func.args
+    return (
+        [a.arg for a in args.posonlyargs],
+        [a.arg for a in args.args],
+        args.vararg and args.vararg.arg,
+        [a.arg for a in args.kwonlyargs],
+        args.kwarg and args.kwarg.arg,
+        len(args.defaults),
+        [d is None for d in args.kw_defaults],
+        [a.annotation is None for a in args.posonlyargs + args.args],
+        func.returns is None,
+    )
+
+
+def test_tree_sitter_convert(monkeypatch):
+    monkeypatch.setattr(parsers, "tree_sitter_parser", FakeParser)
+    by_ast = ModuleNavigator("", FAKE_SOURCE)
+    by_tree_sitter = ModuleNavigator("", FAKE_SOURCE, parser="tree_sitter")
+    assert _names(by_ast) == _names(by_tree_sitter) == {True: ["test_a"], False: ["g"]}
+    funcs = [by_tree_sitter.find_all(ast.FunctionDef), by_ast.find_all(ast.FunctionDef)]
+    for converted, parsed in zip(*funcs):
+        assert _signature(converted) == _signature(parsed)
+    for nav in (by_ast, by_tree_sitter):
+        cls = nav.find_by_name("TestA")
+        assert [b.id for b in cls.bases] == ["Base"]
+        assert [(k.arg, k.value.id) for k in cls.keywords] == [("metaclass", "Meta")]
+        call = nav.find_all(ast.Call)[0]
+        assert len(call.args) == 1 and [k.arg for k in call.keywords] == ["key"]
+    assert by_ast.total_lines == by_tree_sitter.total_lines
+
+
+def test_tree_sitter_unavailable(tmp_path, monkeypatch):
+    with pytest.raises(ParserUnavailable):
+        tree_sitter_parser(str(tmp_path / "missing.so"), str(tmp_path / "missing"))
+
+    def unavailable():
+        raise ParserUnavailable("no grammar")
+
+    monkeypatch.setattr(parsers, "tree_sitter_parser", unavailable)
+    with pytest.raises(ParserUnavailable):
+        ModuleNavigator.build("", "x = 1", parser="tree_sitter")
+    monkeypatch.setattr(static, "tree_sitter_parser", unavailable)
+    with pytest.raises(SystemExit):
+        static.main(str(tmp_path / "repos.jsonl"), "", parser="fallback")
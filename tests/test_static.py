@@ -0,0 +1,222 @@
+import io
+import json
+import time
+import tarfile
+from src import static
+from src.static import FileStats, analyze_repos, collect_funcs, main
+from src.navigate import ModuleNavigator
+
+TEST_MODULE = """
+import unittest
+from hypothesis import given, strategies as st
+
+@given(st.integers())
+def test_property(x):
+    assert x == x
+
+class TestFoo(unittest.TestCase):
+    def test_unit(self):
+        self.assertEqual(1, 1)
+
+    def helper(self):
+        return 1
+
+def func():
+    pass
+"""
+
+
+def _make_repos(root, n_repos: int = 3, n_files: int = 5):
+    repo_list = []
+    for i in range(n_repos):
+        repo_dir = root / f"owner+repo{i}"
+        repo_dir.mkdir()
+        for j in range(n_files + i):
+            (repo_dir / f"test_{j}.py").write_text(TEST_MODULE)
+        (repo_dir / "broken.py").write_text("def f(:\n")
+        repo_list.append({"repo_id": f"owner/repo{i}", "#fuzz_target": i})
+    (root / "owner+empty").mkdir()
+    repo_list.append({"repo_id": "owner/empty", "#fuzz_target": 0})
+    return repo_list
+
+
+def test_analyze_repos(tmp_path):
+    repo_list = _make_repos(tmp_path)
+    rows = list(analyze_repos(repo_list, str(tmp_path)))
+    assert [r["repo_id"] for r in rows] == [r["repo_id"] for r in repo_list]
+    assert rows[0] == {
+        "repo_id": "owner/repo0",
+        "#files": 6,
+        "#lines": 5 * 12,
+        "#funcs": 5 * 2,
+        "#unit": 5,
+        "#property_based": 5,
+        "#fuzz_target": 0,
+        "#failed": 1,
+        "#too_large": 0,
+        "#timed_out": 0,
+        "#out_of_memory": 0,
+    }
+    assert rows[-1]["#files"] == 0
+
+
+def test_analyze_repos_parallel(tmp_path):
+    repo_list = _make_repos(tmp_path)
+    serial = list(analyze_repos(repo_list, str(tmp_path)))
+    parallel = list(analyze_repos(repo_list, str(tmp_path), workers=2, chunk_size=2))
+    assert serial == parallel
+
+
+def _slow_chunk(task):
+    time.sleep(0.5)
+    return task[0], FileStats(files=len(task[1]))
+
+
+def test_analyze_repos_closed(tmp_path, monkeypatch):
+    monkeypatch.setattr(static, "analyze_chunk", _slow_chunk)
+    repo_list = _make_repos(tmp_path, n_repos=20, n_files=1)
+    start = time.monotonic()
+    rows = analyze_repos(repo_list, str(tmp_path), workers=2)
+    assert next(rows)["repo_id"] == "owner/repo0"
+    rows.close()  # the queued tasks are dropped, not waited for
+    assert time.monotonic() - start < 3
+
+
+def test_analyze_repos_cached(tmp_path):
+    repo_list = _make_repos(tmp_path)
+    cache_path = str(tmp_path / "cache.db")
+    uncached = list(analyze_repos(repo_list, str(tmp_path)))
+    for _ in range(2):
+        cached = list(analyze_repos(repo_list, str(tmp_path), cache_path=cache_path))
+        assert cached == uncached
+
+
+def test_analyze_repos_limited(tmp_path):
+    repo_list = _make_repos(tmp_path)
+    (tmp_path / "owner+repo0" / "huge.py").write_text("x = 1\n" * 10_000)
+    unlimited = list(analyze_repos(repo_list, str(tmp_path)))
+    # parsed in a worker process
+    limits = dict(max_file_size=10_000, file_timeout=10, memory_limit=1024)
+    rows = list(analyze_repos(repo_list, str(tmp_path), workers=2, **limits))
+    assert rows[0]["#too_large"] == 1
+    assert rows[0]["#lines"] == unlimited[0]["#lines"] - 10_000
+    assert rows[1:] == unlimited[1:]
+
+
+def test_max_file_size_in_bytes(tmp_path):
+    repo_list = _make_repos(tmp_path)
+    # fewer characters than max_file_size, but more bytes
+    wide = tmp_path / "owner+repo0" / "wide.py"
+    wide.write_text(f"s = '{'é' * 6000}'\n", encoding="utf-8")
+    archives = tmp_path / "archives"
+    archives.mkdir()
+    with tarfile.open(archives / "owner+repo0.tar.gz", "w:gz") as tp:
+        tp.add(wide.parent, arcname=wide.parent.name)
+    cache_path = str(tmp_path / "cache.db")
+    # cached without limits first, the limits are part of the cache key
+    list(analyze_repos(repo_list[:1], str(tmp_path), cache_path=cache_path))
+    for root, kwargs in [
+        (tmp_path, {}),
+        (tmp_path, {"cache_path": cache_path}),
+        (archives, {"archives": True}),
+        (archives, {"archives": True, "cache_path": cache_path}),
+    ]:
+        rows = list(
+            analyze_repos(repo_list[:1], str(root), max_file_size=10_000, **kwargs)
+        )
+        assert rows[0]["#too_large"] == 1
+
+
+CLASSIFY_MODULE = """
+class TestFoo(unittest.TestCase):
+    def test_a(self):
+        self.assertEqual(1, 1)
+
+    def test_nested(self):
+        def inner():
+            assert True
+
+    @staticmethod
+    def static_helper():
+        assert True
+
+    def no_assert(self):
+        pass
+
+class TestWithInit:
+    def __init__(self):
+        pass
+
+    def test_b(self):
+        assert True
+
+class Outer:
+    class TestInner(unittest.TestCase):
+        def test_c(self):
+            self.assertTrue(1)
+
+    def test_d(self):
+        assert True
+
+def test_e():
+    assert True
+
+def test_f():
+    pass
+"""
+
+
+def test_collect_funcs(tmp_path):
+    path = tmp_path / "test_mod.py"
+    path.write_text(CLASSIFY_MODULE)
+    func_dict = collect_funcs(ModuleNavigator(str(path)))
+    names = {k: [f.name for f in v] for k, v in func_dict.items()}
+    assert names == {
+        True: ["test_a", "test_nested", "static_helper", "test_c", "test_e"],
+        False: ["inner", "no_assert", "__init__", "test_b", "test_d", "test_f"],
+    }
+
+
+def test_analyze_repos_archives(tmp_path):
+    repo_list = _make_repos(tmp_path)
+    archives = tmp_path / "archives"
+    archives.mkdir()
+    for repo_dir in tmp_path.glob("owner+*"):
+        with tarfile.open(archives / f"{repo_dir.name}.tar.gz", "w:gz") as tp:
+            tp.add(repo_dir, arcname=repo_dir.name)
+    extracted = list(analyze_repos(repo_list, str(tmp_path)))
+    assert list(analyze_repos(repo_list, str(archives), archives=True)) == extracted
+
+
+def test_analyze_truncated_archive(tmp_path):
+    archive = tmp_path / "owner+repo.tar.gz"
+    with tarfile.open(archive, "w:gz") as tp:
+        for j in range(20):
+            info = tarfile.TarInfo(f"owner+repo/test_{j}.py")
+            data = (TEST_MODULE + f"# {'x' * 4096 * j}\n").encode()
+            info.size = len(data)
+            tp.addfile(info, io.BytesIO(data))
+    archive.write_bytes(archive.read_bytes()[: archive.stat().st_size // 2])
+    repo_list = [{"repo_id": "owner/repo", "#fuzz_target": 0}]
+    rows = list(analyze_repos(repo_list, str(tmp_path), archives=True))
+    assert 0 < rows[0]["#files"] < 20 and rows[0]["#failed"] == 1
+
+
+def test_main_resume(tmp_path):
+    repos = tmp_path / "repos"
+    repos.mkdir()
+    repo_list = _make_repos(repos)
+    repo_list_path = tmp_path / "repos.jsonl"
+    repo_list_path.write_text("\n".join(map(json.dumps, repo_list)))
+    output = tmp_path / "output.csv"
+    kwargs = dict(root=str(repos), output_csv_file=str(output), workers=1, cache=None)
+
+    main(str(repo_list_path), **kwargs)
+    full = output.read_text()
+    lines = full.splitlines(keepends=True)
+    assert len(lines) == len(repo_list) + 1
+
+    # interrupted in the middle of the third row
+    output.write_text("".join(lines[:3]) + lines[3][:5])
+    main(str(repo_list_path), resume=True, **kwargs)
+    assert output.read_text() == full
@@ -0,0 +1,58 @@
+import os
+import json
+import time
+import threading
+from src import tracing
+from src.common import LimitedWorker
+from src.tracing import load_spans, span, summarize, to_chrome_trace, traced
+
+
+@traced("child")
+def _child(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def test_spans(tmp_path, monkeypatch):
+    monkeypatch.delenv("TRACE_DIR", raising=False)
+    with span("ignored"):
+        pass
+    monkeypatch.setenv("TRACE_DIR", str(tmp_path))
+
+    with span("root", repo="owner/repo"):
+        _child(0.05)
+        _child(0.05)
+        worker = LimitedWorker(_child)
+        with span("wait"):
+            pid = worker(0.01)
+        worker.close()
+    thread = threading.Thread(target=_child, args=(0.01,))
+    thread.start()
+    thread.join()
+
+    spans = load_spans(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [f"spans-{os.getpid()}.jsonl", f"spans-{pid}.jsonl"]
+    )
+    root = next(s for s in spans if s["label"] == "root")
+    assert root["args"] == {"repo": "owner/repo"}
+    assert root["self_us"] < root["total_us"] - 100_000
+    # the spans of other processes are not nested for timing
+    wait = next(s for s in spans if s["label"] == "wait")
+    assert wait["self_us"] >= 10_000
+    assert {s["path"] for s in spans} == {
+        "root",
+        "root/child",
+        "root/wait",
+        "root/wait/child",
+        "child",
+    }
+
+    summary = summarize(spans)
+    assert summary["child"]["count"] == 4
+    assert list(summary)[0] == "child"
+    trace = to_chrome_trace(spans)
+    assert len(trace["traceEvents"]) == len(spans)
+    json.dumps(trace)
+    tracing.main(str(tmp_path))
+    assert json.loads((tmp_path / "summary.json").read_text()) == summary